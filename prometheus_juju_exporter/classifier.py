@@ -0,0 +1,97 @@
+"""Classifier module."""
+
+import re
+from enum import Enum
+from typing import Any, Dict, Iterable, Set
+
+# number of MAC address prefixes and interface names whose classification is remembered
+CLASSIFIER_MEMO_SIZE = 65536
+
+
+class MachineType(Enum):
+    """String type enum for selecting available machine types."""
+
+    METAL = "metal"
+    KVM = "kvm"
+    LXD = "lxd"
+
+
+class MachineTypeClassifier:
+    """Detect the type of machines from the MAC addresses of their network interfaces.
+
+    Built once from the detection config. The interface pattern is compiled, the
+    virtual MAC prefixes are normalized and indexed by length, and the results for
+    interface names and MAC address prefixes seen before are remembered.
+    """
+
+    def __init__(self, virt_mac_prefixes: Iterable[str], match_interfaces: str = "") -> None:
+        """Create a classifier.
+
+        :param Iterable[str] virt_mac_prefixes: MAC address prefixes of virtual machines
+        :param str match_interfaces: pattern of the interface names to consider,
+            '' to consider all interfaces
+        """
+        self.interface_pattern = re.compile(match_interfaces) if match_interfaces else None
+        # normalized virtual MAC prefixes, by length
+        self._prefixes: Dict[int, Set[str]] = {}
+        for prefix in virt_mac_prefixes:
+            self._prefixes.setdefault(len(prefix), set()).add(prefix.lower())
+        # only the start of a MAC address as long as the longest prefix matters
+        self._memo_key_length = max(self._prefixes, default=0)
+        self._interface_memo: Dict[str, bool] = {}
+        self._mac_memo: Dict[str, bool] = {}
+
+    @classmethod
+    def from_config(cls, config: Any) -> "MachineTypeClassifier":
+        """Create a classifier from the 'detection' section of the config.
+
+        :param config: the exporter config
+        :return MachineTypeClassifier: the classifier
+        """
+        return cls(
+            virt_mac_prefixes=config["detection"]["virt_macs"].as_str_seq(),
+            match_interfaces=config["detection"]["match_interfaces"].get(),
+        )
+
+    def _is_considered(self, interface: str) -> bool:
+        """Check if an interface name matches the interface pattern."""
+        considered = self._interface_memo.get(interface)
+        if considered is None:
+            considered = bool(
+                self.interface_pattern is None or self.interface_pattern.search(interface)
+            )
+            if len(self._interface_memo) >= CLASSIFIER_MEMO_SIZE:
+                self._interface_memo.clear()
+            self._interface_memo[interface] = considered
+        return considered
+
+    def is_virtual_mac(self, mac_address: str) -> bool:
+        """Check if a MAC address starts with one of the virtual MAC prefixes."""
+        key = mac_address[: self._memo_key_length].lower()
+        virtual = self._mac_memo.get(key)
+        if virtual is None:
+            virtual = any(key[:length] in prefixes for length, prefixes in self._prefixes.items())
+            if len(self._mac_memo) >= CLASSIFIER_MEMO_SIZE:
+                self._mac_memo.clear()
+            self._mac_memo[key] = virtual
+        return virtual
+
+    def classify(self, machine: Dict) -> MachineType:
+        """Detect the type of a machine.
+
+        :param dict machine: status information for a machine
+        :return MachineType: KVM if a considered interface has a virtual MAC address,
+            METAL otherwise
+        """
+        for interface, properties in machine["network-interfaces"].items():
+            if self._is_considered(interface) and self.is_virtual_mac(properties["mac-address"]):
+                return MachineType.KVM
+        return MachineType.METAL
+
+    def classify_all(self, machines: Dict) -> Dict[str, MachineType]:
+        """Detect the type of all machines of a model.
+
+        :param dict machines: status information for all machines in the model
+        :return dict: the type of every machine, by juju machine id
+        """
+        return {key: self.classify(machine) for key, machine in machines.items()}
@@ -1,51 +1,176 @@
 """Collector module."""
 
-import re
-from enum import Enum
+import asyncio
+import os
+import time
+from functools import partial
 from logging import getLogger
-from typing import Any, Dict, List
-
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from juju import tag
+from juju.client import client
+from juju.client.connection import Monitor
 from juju.controller import Controller
-
-from prometheus_juju_exporter.config import Config
-
-
-class MachineType(Enum):
-    """String type enum for selecting available machine types."""
-
-    METAL = "metal"
-    KVM = "kvm"
-    LXD = "lxd"
-
-
-class Collector:
+from juju.model import Model
+
+from prometheus_juju_exporter.classifier import MachineType, MachineTypeClassifier
+from prometheus_juju_exporter.config import Config, get_controller_targets
+from prometheus_juju_exporter.gauges import (
+    APPLICATION_GAUGE_NAME,
+    MACHINE_GAUGE_JOB,
+    MACHINE_GAUGE_NAME,
+    STATUS_GAUGES,
+    UNIT_GAUGE_NAME,
+    ApplicationLabels,
+    MachineLabels,
+    ModelRows,
+    UnitLabels,
+)
+from prometheus_juju_exporter.models import ModelFilter, ModelPool, ModelScheduler, in_shard
+from prometheus_juju_exporter.replay import Recording, RecordingController, ReplayController
+
+# upper bound in seconds for the delay between two rounds of reconnection attempts
+MAX_RECONNECT_BACKOFF = 300
+# shortest sleep between two cycles when models have their own intervals, so that
+# models falling due a few seconds apart are fetched by the same cycle
+MIN_SCHEDULER_DELAY = 10
+
+# unit agent statuses that are not a failure
+HEALTHY_AGENT_STATUSES = ("idle", "executing")
+
+# number of models whose machine summaries are fetched by a single request in
+# 'lightweight' mode
+MODEL_INFO_BATCH_SIZE = 500
+# instance ids of machines that are not provisioned yet, which have no gauge row
+UNPROVISIONED_INSTANCE_IDS = (None, "", "pending")
+
+
+def iter_units(application: Any) -> Iterator[Tuple[str, Any]]:
+    """Yield the units of an application, each followed by its subordinate units.
+
+    :param dict application: status information for the application
+    :return: tuples of the unit name and the status information for the unit
+    """
+    for unit_name, unit in (application.get("units") or {}).items():
+        yield unit_name, unit
+        yield from (unit.get("subordinates") or {}).items()
+
+
+class Collector:  # pylint: disable=R0902
     """Core class of the PrometheusJujuExporter collector."""
 
-    def __init__(self) -> None:
-        """Create new collector and configure runtime environment."""
+    def __init__(
+        self,
+        target: Optional[Dict[str, Any]] = None,
+        on_change: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Create new collector and configure runtime environment.
+
+        :param dict target: the endpoints, credentials and constant labels of the
+            controller to collect from, defaults to the first configured controller
+        :param Callable on_change: called whenever the state table of a watched model
+            changes
+        """
         self.config = Config().get_config()
         self.logger = getLogger(__name__)
-        self.controller = Controller(max_frame_size=6**24)
+        self.target = target or get_controller_targets(self.config)[0]
+        self.controller = self._create_controller()
+        self._endpoint_index = 0
         self.data: Dict[str, Any] = {}
-        self.virt_mac_prefixes = self.config["detection"]["virt_macs"].as_str_seq()
+        self.watch_mode = self.config["collection"]["mode"].get(str) == "watch"
+        self.lightweight_mode = self.config["collection"]["mode"].get(str) == "lightweight"
+        # models kept connected in watch mode, by uuid
+        self._watched_models: Dict[str, Model] = {}
+        # latest gauge row of every host in watch mode, by model uuid and juju machine id
+        self._machine_state: Dict[str, Dict[str, Tuple[MachineLabels, int]]] = {}
+        # machine deltas received during the running resync, by model uuid
+        self._resync_deltas: Optional[Dict[str, List[Tuple[str, Any]]]] = None
+        self.on_change = on_change
+        # gauge rows of every model with the fingerprint of the status they come from
+        self._model_cache: Dict[str, Tuple[int, ModelRows]] = {}
+        self.cache_stats = {"hit": 0, "miss": 0}
+        # fetch duration, host count, error and staleness of every model in the last
+        # cycle, by name
+        self.model_stats: Dict[str, Dict[str, Any]] = {}
+        # uuids of the models whose status could not be fetched in the current cycle
+        self._failed_models: Set[str] = set()
+        self.classifier = MachineTypeClassifier.from_config(self.config)
+        self.scheduler = ModelScheduler.from_config(self.config)
+        self.model_filter = ModelFilter.from_config(self.config)
+        self.model_pool = ModelPool(
+            size=self.config["collection"]["model_pool_size"].get(int),
+            idle_timeout=self.config["collection"]["model_idle_timeout"].get(int),
+        )
         self.logger.debug("Collector initialized")
 
-    def refresh_cache(self, gauge_name: str, gauge_desc: str, labels: List[str]) -> None:
-        """Refresh instances for each collection job.
+    def _create_controller(self) -> Any:
+        """Create the controller connection of the configured transport.
+
+        'record' wraps the controller connection to record the model list and the
+        statuses it fetches, 'replay' serves them back without any controller.
 
-        :param str gauge_name: the name of the gauge
-        :param str gauge_desc: the description of the gauge
-        :param List[str] labels: the label set of the gauge
+        :return: the controller connection
         """
+        transport = self.config["collection"]["transport"].get(str)
+        if transport == "juju":
+            return Controller(max_frame_size=6**24)
+
+        recording = Recording(
+            os.path.join(
+                self.config.config_dir(),
+                self.config["collection"]["recording_dir"].get(str),
+                self.target["cloud_name"],
+            )
+        )
+        self.logger.info("Using the '%s' transport with %s", transport, recording.directory)
+        if transport == "record":
+            return RecordingController(Controller(max_frame_size=6**24), recording)
+
+        return ReplayController(
+            recording,
+            latency=self.config["collection"]["replay_latency"].get(int) / 1000,
+            concurrency=self.config["collection"]["replay_concurrency"].get(int),
+        )
+
+    def refresh_cache(self) -> None:
+        """Refresh the instances of every collected gauge for each collection job."""
         self.data = {
             gauge_name: {
                 "gauge_desc": gauge_desc,
                 "labels": labels,
                 "labelvalues_update": [],
             }
+            for gauge_name, gauge_desc, labels in STATUS_GAUGES
+            if gauge_name == MACHINE_GAUGE_NAME or not self.lightweight_mode
         }
 
-        self.controller = Controller(max_frame_size=6**24)
+    def _add_status_rows(self, rows: ModelRows) -> None:
+        """Add the unit and application rows of a model to the collected data.
+
+        :param ModelRows rows: the gauge rows of the model
+        """
+        self.data[UNIT_GAUGE_NAME]["labelvalues_update"].extend(rows.units)
+        self.data[APPLICATION_GAUGE_NAME]["labelvalues_update"].extend(rows.applications)
+
+    def _controller_healthy(self) -> bool:
+        """Check whether the current controller session can be reused.
+
+        :return bool: True if the controller websocket is open and its receiver is running
+        """
+        if not self.controller.is_connected():
+            return False
+
+        return self.controller.connection().monitor.status == Monitor.CONNECTED
 
     async def _connect_controller(
         self, endpoints: List[str], username: str, password: str, cacert: str
@@ -58,57 +183,364 @@ class Collector:
         :param str password: the password for controller-local users
         :param str cacert: the CA certificate of the controller
             (PEM formatted)
+        :raises RuntimeError: if no endpoint accepted the connection after all the
+            configured reconnection attempts
         """
-        if not self.controller.is_connected():
-            for endpoint in endpoints:
-                self.logger.info("Connecting to controller at %s", endpoint)
+        if self._controller_healthy():
+            self.logger.debug(
+                "Reusing connection to controller at %s", endpoints[self._endpoint_index]
+            )
+            return
+
+        attempts = self.config["collection"]["reconnect_attempts"].get(int)
+        backoff = self.config["collection"]["reconnect_backoff"].get(int)
+        # start from the endpoint that worked last, fail over to the others in order
+        order = list(range(self._endpoint_index, len(endpoints))) + list(
+            range(self._endpoint_index)
+        )
+        for attempt in range(attempts):
+            if attempt:
+                delay = min(backoff * 2 ** (attempt - 1), MAX_RECONNECT_BACKOFF)
+                self.logger.info("Retrying controller connection in %ss", delay)
+                await asyncio.sleep(delay)
+
+            for index in order:
+                self.logger.info("Connecting to controller at %s", endpoints[index])
                 try:
                     await self.controller.connect(
-                        endpoint=endpoint, username=username, password=password, cacert=cacert
+                        endpoint=endpoints[index],
+                        username=username,
+                        password=password,
+                        cacert=cacert,
                     )
-                    break
+                    self._endpoint_index = index
+                    return
                 except Exception as exc:  # pylint: disable=W0718
                     # Controller.connect() can raise generic `Exception`
                     self.logger.warning(
-                        "Failed to connect to Juju controller at %s: %s", endpoint, exc
+                        "Failed to connect to Juju controller at %s: %s", endpoints[index], exc
                     )
+
+        raise RuntimeError("Unable to connect to any of the Juju controllers.")
+
+    async def _get_model_owners(self) -> Optional[Dict[str, str]]:
+        """Get the owners of the models the user can access, from a single request.
+
+        :return dict: the owner of every model, by uuid, or None if the transport
+            does not know the owners
+        """
+        if isinstance(self.controller, ReplayController):
+            return None
+
+        facade = client.ModelManagerFacade.from_connection(self.controller.connection())
+        summaries = await facade.ListModelSummaries(
+            user_tag=tag.user(self.controller.get_current_username()), all_=False
+        )
+        return {
+            summary.result.uuid: tag.untag("user-", summary.result.owner_tag)
+            for summary in summaries.results
+            if summary.result is not None
+        }
+
+    def _get_summary_rows(
+        self, uuid: str, model_name: str, machines: List[Any]
+    ) -> Optional[ModelRows]:
+        """Get the machine rows of a model from its machine summaries.
+
+        The summaries only carry the agent status of the machines, so each machine
+        keeps the labels of its last row from a full status.
+
+        :param str uuid: the uuid of the model
+        :param str model_name: the name of the model
+        :param list machines: the machine summaries of the model
+        :return ModelRows: the gauge rows of the model, or None if a machine has no
+            previous row and the full status of the model is needed
+        """
+        cached = self._model_cache.get(uuid)
+        if cached is None:
+            return None
+
+        known = {key: labels for key, labels, _ in cached[1].machines}
+        rows = []
+        for machine in machines:
+            if machine.get("instance-id") in UNPROVISIONED_INSTANCE_IDS:
+                continue
+            labels = known.get(machine["id"])
+            if labels is None or labels.juju_model != model_name:
+                self.logger.debug("Model '%s' has new machines, fetching its status", model_name)
+                return None
+            rows.append((machine["id"], labels, self._get_gauge_value(machine["status"])))
+
+        return ModelRows(machines=rows, units=[], applications=[])
+
+    async def iter_summary_rows(
+        self, model_uuids: Dict[str, str]
+    ) -> AsyncIterator[Tuple[str, ModelRows]]:
+        """Get the machine rows of models from bulk requests over the controller connection.
+
+        Up to MODEL_INFO_BATCH_SIZE models are summarized by each request. Models
+        without a summary, or with machines that were never seen in a full status,
+        are not yielded, so that their full status is fetched instead.
+
+        :param dict model_uuids: the uuids of the models, by name
+        :return: the uuid and the gauge rows of every summarized model
+        """
+        if isinstance(self.controller, ReplayController):
+            # recordings only hold full statuses
+            return
+
+        names = {uuid: name for name, uuid in model_uuids.items() if uuid in self._model_cache}
+        uuids = list(names)
+        if not uuids:
+            return
+
+        facade = client.ModelManagerFacade.from_connection(self.controller.connection())
+        for start in range(0, len(uuids), MODEL_INFO_BATCH_SIZE):
+            end = start + MODEL_INFO_BATCH_SIZE
+            batch = uuids[start:end]
+            try:
+                infos = await facade.ModelInfo(
+                    entities=[{"tag": tag.model(uuid)} for uuid in batch]
+                )
+            except Exception as err:  # pylint: disable=W0703
+                self.logger.warning("Failed fetching model summaries: %s", err)
+                return
+
+            for info in infos.results:
+                if info.error is not None or info.result is None or info.result.uuid not in names:
                     continue
-            else:
-                raise RuntimeError("Unable to connect to any of the Juju controllers.")
+                uuid = info.result.uuid
+                rows = self._get_summary_rows(uuid, names[uuid], info.result.machines or [])
+                if rows is None:
+                    continue
+                self._model_cache[uuid] = (0, rows)
+                self.model_stats[names[uuid]] = {
+                    "seconds": None,
+                    "hosts": len(rows.machines),
+                    "error": None,
+                    "stale": False,
+                }
+                yield uuid, rows
+
+    async def _get_watched_model(self, uuid: str, name: str) -> Model:
+        """Get a connected model whose machine changes are applied to the state table.
+
+        :param str uuid: the uuid of the model
+        :param str name: the name of the model
+        :return Model: the model connection, kept open between collection cycles
+        """
+        model = self._watched_models.get(uuid)
+        if model is not None and model.is_connected():
+            return model
+
+        self.logger.info("Starting to watch model '%s'", name)
+        model = await self.controller.get_model(uuid)
+        model.add_observer(partial(self._on_machine_delta, uuid, name), entity_type="machine")
+        self._watched_models[uuid] = model
+        return model
 
-    async def _get_machines_in_model(self, uuid: str) -> Dict[Any, Any]:
-        """Get a list of all machines in the model with their stats.
+    async def _unwatch_model(self, uuid: str) -> None:
+        """Disconnect a watched model and forget its machines.
 
-        :return: status information for all machines in the model
+        :param str uuid: the uuid of the model
+        """
+        model = self._watched_models.pop(uuid, None)
+        self._machine_state.pop(uuid, None)
+        if model is not None:
+            try:
+                await model.disconnect()
+            except Exception as err:  # pylint: disable=W0703
+                self.logger.warning("Failed disconnecting from model '%s': %s", uuid, err)
+
+    async def _get_model_status(self, uuid: str, name: str = "") -> Any:
+        """Get the status of the machines and applications of a model.
+
+        In watch mode the model connection is kept open, otherwise it is returned to
+        the model pool right after the status is fetched.
+
+        :param str uuid: the uuid of the model
+        :param str name: the name of the model
+        :return: the status of the model, empty if it could not be fetched
         """
         try:
-            model = await self.controller.get_model(uuid)
-            status = await model.get_status()
-            await model.disconnect()
+            if self.watch_mode:
+                model = await self._get_watched_model(uuid, name)
+                try:
+                    status = await model.get_status()
+                except Exception:
+                    await self._unwatch_model(uuid)
+                    raise
+            else:
+                model = await self.model_pool.acquire(
+                    uuid, partial(self.controller.get_model, uuid)
+                )
+                try:
+                    status = await model.get_status()
+                except BaseException:
+                    # also runs when the fetch is cancelled by the per-model timeout
+                    await self.model_pool.discard(uuid, model)
+                    raise
+                await self.model_pool.release(uuid, model)
         except Exception as err:  # pylint: disable=W0703
             self.logger.error("Failed connecting to model '%s': %s ", uuid, err)
+            self._failed_models.add(uuid)
             return {}
 
-        return status["machines"]
+        return status
+
+    async def _on_machine_delta(self, uuid: str, model_name: str, delta: Any, *_: Any) -> None:
+        """Apply a machine delta from the model's AllWatcher to the state table.
+
+        While a resync runs, the delta is also kept to be replayed on top of the table
+        built from the fetched statuses, which may predate it.
+
+        :param str uuid: the uuid of the model the delta comes from
+        :param str model_name: the name of the model the delta comes from
+        :param EntityDelta delta: the machine delta, followed by the old and new machine
+            objects and the model, which are not needed here
+        """
+        if self._resync_deltas is not None:
+            self._resync_deltas.setdefault(uuid, []).append((model_name, delta))
+
+        rows = self._machine_state.get(uuid)
+        if rows is None:
+            return
+
+        self._apply_machine_delta(rows, model_name, delta)
+        if self.on_change is not None:
+            self.on_change()
+
+    def _apply_machine_delta(
+        self, rows: Dict[str, Tuple[MachineLabels, int]], model_name: str, delta: Any
+    ) -> None:
+        """Apply a machine delta to the gauge rows of a model.
+
+        The type of a known machine is kept from the last full resync, because deltas
+        carry no network interfaces. New machines are treated as metal until then.
+
+        :param dict rows: the gauge rows of the model, by juju machine id
+        :param str model_name: the name of the model the delta comes from
+        :param EntityDelta delta: the machine delta
+        """
+        machine_id = delta.get_id()
+        self.logger.debug("Machine %s %s in model '%s'", machine_id, delta.type, model_name)
+        host_id = "None" if delta.type == "remove" else self._get_host_identifier(delta.data)
+        if host_id == "None":
+            rows.pop(machine_id, None)
+            return
+
+        if machine_id in rows:
+            machine_type = rows[machine_id][0].type
+        elif "/" in machine_id:
+            machine_type = MachineType.LXD.value
+        else:
+            machine_type = MachineType.METAL.value
+        labels = self._create_gauge_label(
+            hostname=host_id, model_name=model_name, machine_type=machine_type
+        )
+        rows[machine_id] = (labels, self._get_gauge_value(delta.data["agent-status"]["current"]))
+
+    def get_state_stats(self) -> Dict[str, Any]:
+        """Get stats of all watched models from the state table.
+
+        Deltas only update machines, so units and applications keep the rows of the
+        last resync.
+
+        :return dict: the collected data, in the same format as returned by get_stats
+        """
+        self.refresh_cache()
+        for uuid, rows in self._machine_state.items():
+            self.data[MACHINE_GAUGE_NAME]["labelvalues_update"].extend(rows.values())
+            cached = self._model_cache.get(uuid)
+            if cached is not None:
+                self._add_status_rows(cached[1])
+
+        return self.data
+
+    async def _collect_model(
+        self, name: str, uuid: str, semaphore: asyncio.Semaphore, timeout: Optional[float]
+    ) -> ModelRows:
+        """Fetch the status of a single model within the concurrency limit.
+
+        The status is turned into gauge rows right away, so that it can be freed
+        before the other models are fetched. The fetch duration, host count, error
+        and staleness of the model are kept in model_stats.
+
+        :param str name: the name of the model
+        :param str uuid: the uuid of the model
+        :param asyncio.Semaphore semaphore: bounds the number of models fetched at once
+        :param float timeout: seconds allowed for fetching the model, None for no limit
+        :return ModelRows: the gauge rows of the model
+        """
+        async with semaphore:
+            self.logger.debug("Checking model '%s'...", name)
+            start = time.perf_counter()
+            error: Optional[str] = None
+            try:
+                status = await asyncio.wait_for(
+                    self._get_model_status(uuid=uuid, name=name), timeout
+                )
+            except asyncio.TimeoutError:
+                self.logger.error("Timed out collecting model '%s' after %ss", name, timeout)
+                self._failed_models.add(uuid)
+                status, error = {}, "timeout"
+            if error is None and uuid in self._failed_models:
+                error = "error"
+
+            self.model_stats[name] = {
+                "seconds": time.perf_counter() - start,
+                "hosts": sum(
+                    len(machine["containers"]) + 1
+                    for machine in status.get("machines", {}).values()
+                ),
+                "error": error,
+                "stale": False,
+            }
+        return self._get_model_rows(uuid, status, name)
+
+    async def iter_model_rows(
+        self, model_uuids: Dict[str, str]
+    ) -> AsyncIterator[Tuple[str, ModelRows]]:
+        """Fetch models concurrently and yield the rows of each one as soon as it is done.
+
+        At most 'max_concurrent_models' statuses are held at once, since each one is
+        dropped once turned into rows.
+
+        :param dict model_uuids: the uuids of the models to fetch, by name
+        :return: the uuid and the gauge rows of every model, in completion order
+        """
+        semaphore = asyncio.Semaphore(self.config["collection"]["max_concurrent_models"].get(int))
+        timeout = self.config["collection"]["model_timeout"].get(int) or None
+
+        async def collect(name: str, uuid: str) -> Tuple[str, ModelRows]:
+            return uuid, await self._collect_model(name, uuid, semaphore, timeout)
+
+        tasks = [asyncio.ensure_future(collect(name, uuid)) for name, uuid in model_uuids.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
 
     def _create_gauge_label(
         self, hostname: str, model_name: str, machine_type: str
-    ) -> Dict[str, str]:
-        """Create label dict for gauge.
+    ) -> MachineLabels:
+        """Create the label values of a gauge series.
 
         :param str hostname: the hostname of the machine
         :param str model_name: the name of the model the machine is in
         :param str machine_type: the hardware type of the machine
-        :return dict labelvalues: the label values in dict format
+        :return MachineLabels labelvalues: the label values of the series
         """
-        return {
-            "job": "prometheus-juju-exporter",
-            "hostname": hostname,
-            "customer": self.config["customer"]["name"].get(str),
-            "cloud_name": self.config["customer"]["cloud_name"].get(str),
-            "juju_model": model_name,
-            "type": machine_type,
-        }
+        return MachineLabels(
+            job=MACHINE_GAUGE_JOB,
+            hostname=hostname,
+            customer=self.target["customer"],
+            cloud_name=self.target["cloud_name"],
+            juju_model=model_name,
+            type=machine_type,
+        )
 
     @staticmethod
     def _get_gauge_value(status: str) -> int:
@@ -120,40 +552,6 @@ class Collector:
         """
         return int(status == "started")
 
-    def _get_machine_type(self, machine: Dict, machine_id: str) -> MachineType:
-        """Detect machine type based on its MAC address.
-
-        :param dict machine: status information for a machine
-        :return MachineType: MachineType class object indicating the machine type
-        """
-        self.logger.debug("Determining type of machine: %s", machine_id)
-        machine_type = MachineType.METAL
-        match_interfaces = self.config["detection"]["match_interfaces"].get()
-
-        for interface, properties in machine["network-interfaces"].items():
-            # skip if match_interface is not empty and interface name doesn't match pattern
-            if match_interfaces and re.search(match_interfaces, interface) is None:
-                self.logger.debug(
-                    "Disregarding interface %s because it doesn't match filter: %s",
-                    interface,
-                    match_interfaces,
-                )
-                continue
-
-            mac_address = properties["mac-address"]
-            self.logger.debug(
-                "Considering interface %s matching filter: %s. MAC: %s",
-                interface,
-                match_interfaces,
-                mac_address,
-            )
-            if mac_address.startswith(tuple(self.virt_mac_prefixes)):
-                machine_type = MachineType.KVM
-                break
-
-        self.logger.debug("Machine %s is of type: %s", machine_id, machine_type)
-        return machine_type
-
     def _get_host_identifier(self, host: Dict) -> str:
         """Try to find a valid identifier for the host.
 
@@ -196,40 +594,43 @@ class Collector:
             self.logger.debug("Found identifier for host: %s", host_id)
         return host_id
 
-    async def _get_machine_stats(self, machines: Dict, model_name: str, gauge_name: str) -> None:
-        """Get baremetal or vm machines' stats.
+    def _get_machine_rows(
+        self, machines: Dict, model_name: str
+    ) -> Iterator[Tuple[str, MachineLabels, int]]:
+        """Get gauge rows of baremetal or vm machines and their containers.
 
         :param dict machines: status information for all machines in the model
         :param str model_name: the name of the model the machines are in
-        :param str gauge_name: the name of the gauge
+        :return: tuples of the juju machine id, the gauge labels and the gauge value
         """
-        for machine in machines.values():
+        machine_types = self.classifier.classify_all(machines)
+        for key, machine in machines.items():
             value = self._get_gauge_value(status=machine["agent-status"]["status"])
             machine_id = self._get_host_identifier(machine)
 
             if machine_id != "None":
-                machine_type = self._get_machine_type(machine, machine_id)
                 labels = self._create_gauge_label(
                     hostname=machine_id,
                     model_name=model_name,
-                    machine_type=machine_type.value,
+                    machine_type=machine_types[key].value,
                 )
-                self.data[gauge_name]["labelvalues_update"].append((labels, value))
+                yield key, labels, value
 
-            self._get_container_stats(
+            yield from self._get_container_rows(
                 containers=machine["containers"],
                 model_name=model_name,
-                gauge_name=gauge_name,
             )
 
-    def _get_container_stats(self, containers: Dict, model_name: str, gauge_name: str) -> None:
-        """Get lxd containers stats.
+    def _get_container_rows(
+        self, containers: Dict, model_name: str
+    ) -> Iterator[Tuple[str, MachineLabels, int]]:
+        """Get gauge rows of lxd containers.
 
         :param dict containers: status information for all containers on a machine
         :param str model_name: the name of the model the machines are in
-        :param str gauge_name: the name of the gauge
+        :return: tuples of the juju machine id, the gauge labels and the gauge value
         """
-        for container in containers.values():
+        for key, container in containers.items():
             value = self._get_gauge_value(container["agent-status"]["status"])
             container_id = self._get_host_identifier(container)
 
@@ -239,43 +640,311 @@ class Collector:
                     model_name=model_name,
                     machine_type=MachineType.LXD.value,
                 )
-                self.data[gauge_name]["labelvalues_update"].append((labels, value))
+                yield key, labels, value
+
+    def _get_unit_row(self, unit_name: str, unit: Any, model_name: str) -> Tuple[UnitLabels, int]:
+        """Get the gauge row of a unit.
+
+        :param str unit_name: the name of the unit
+        :param dict unit: status information for the unit
+        :param str model_name: the name of the model the unit is in
+        :return: the gauge labels and the gauge value
+        """
+        labels = UnitLabels(
+            job=MACHINE_GAUGE_JOB,
+            customer=self.target["customer"],
+            cloud_name=self.target["cloud_name"],
+            juju_model=model_name,
+            application=unit_name.rsplit("/", 1)[0],
+            unit=unit_name,
+        )
+        value = int(
+            unit["workload-status"]["status"] == "active"
+            and unit["agent-status"]["status"] in HEALTHY_AGENT_STATUSES
+        )
+        return labels, value
+
+    def _get_application_rows(
+        self, applications: Dict, model_name: str
+    ) -> Tuple[List[Tuple[UnitLabels, int]], List[Tuple[ApplicationLabels, int]]]:
+        """Get gauge rows of applications and of their units.
+
+        Subordinate units are listed under the units they are attached to, and are
+        labelled with their own application.
+
+        :param dict applications: status information for all applications in the model
+        :param str model_name: the name of the model the applications are in
+        :return: the unit rows and the application rows, as tuples of the gauge labels
+            and the gauge value
+        """
+        unit_rows: List[Tuple[UnitLabels, int]] = []
+        application_rows: List[Tuple[ApplicationLabels, int]] = []
+        for application_name, application in applications.items():
+            labels = ApplicationLabels(
+                job=MACHINE_GAUGE_JOB,
+                customer=self.target["customer"],
+                cloud_name=self.target["cloud_name"],
+                juju_model=model_name,
+                application=application_name,
+            )
+            application_rows.append((labels, int(application["status"]["status"] == "active")))
+            unit_rows.extend(
+                self._get_unit_row(unit_name, unit, model_name)
+                for unit_name, unit in iter_units(application)
+            )
+
+        return unit_rows, application_rows
+
+    def _get_status_rows(self, status: Any, model_name: str) -> ModelRows:
+        """Get the rows of every gauge from a single pass over the status of a model.
+
+        :param dict status: the status of the model
+        :param str model_name: the name of the model
+        :return ModelRows: the gauge rows of the model
+        """
+        unit_rows, application_rows = self._get_application_rows(
+            status.get("applications") or {}, model_name
+        )
+        return ModelRows(
+            machines=list(self._get_machine_rows(status.get("machines") or {}, model_name)),
+            units=unit_rows,
+            applications=application_rows,
+        )
+
+    @staticmethod
+    def _get_model_fingerprint(status: Any, model_name: str) -> int:
+        """Compute a fingerprint of the status fields the gauge rows are derived from.
+
+        :param dict status: the status of the model
+        :param str model_name: the name of the model
+        :return int: a hash that changes whenever the rows of the model would change
+        """
+        fields: List[Any] = [model_name]
+        for key, machine in (status.get("machines") or {}).items():
+            fields.append(
+                (
+                    key,
+                    machine.get("hostname"),
+                    machine.get("instance-id"),
+                    machine["agent-status"]["status"],
+                    tuple(
+                        (interface, properties["mac-address"])
+                        for interface, properties in machine["network-interfaces"].items()
+                    ),
+                )
+            )
+            for container_key, container in machine["containers"].items():
+                fields.append(
+                    (
+                        container_key,
+                        container.get("hostname"),
+                        container.get("instance-id"),
+                        container["agent-status"]["status"],
+                    )
+                )
+        for application_name, application in (status.get("applications") or {}).items():
+            fields.append((application_name, application["status"]["status"]))
+            fields.extend(
+                (unit_name, unit["workload-status"]["status"], unit["agent-status"]["status"])
+                for unit_name, unit in iter_units(application)
+            )
+
+        return hash(tuple(fields))
+
+    def _get_model_rows(self, uuid: str, status: Any, model_name: str) -> ModelRows:
+        """Get the gauge rows of a model, reusing the previous ones if it did not change.
+
+        A model whose status could not be fetched in this cycle keeps its last rows, so
+        that its series do not disappear because of a transient failure.
+
+        :param str uuid: the uuid of the model
+        :param dict status: the status of the model
+        :param str model_name: the name of the model
+        :return ModelRows: the gauge rows of the model
+        """
+        if uuid in self._failed_models:
+            cached = self._model_cache.get(uuid)
+            if cached is None:
+                return ModelRows([], [], [])
+            self.logger.warning("Keeping the last collected rows of model '%s'", model_name)
+            self.model_stats[model_name]["stale"] = True
+            return cached[1]
+
+        fingerprint = self._get_model_fingerprint(status, model_name)
+        cached = self._model_cache.get(uuid)
+        if cached is not None and cached[0] == fingerprint:
+            self.logger.debug("Model '%s' is unchanged, reusing its rows", model_name)
+            self.cache_stats["hit"] += 1
+            return cached[1]
+
+        self.cache_stats["miss"] += 1
+        rows = self._get_status_rows(status, model_name)
+        self._model_cache[uuid] = (fingerprint, rows)
+        return rows
+
+    async def _select_models(self) -> Dict[str, str]:
+        """Get the models to collect, and forget the ones that are no longer collected.
+
+        Models are kept when they pass the model filters and belong to the shard of
+        this exporter. The cached rows and pooled connections of other models are
+        dropped.
+
+        :return dict: the uuids of the models to collect, by name
+        """
+        model_uuids = await self.controller.model_uuids()
+        self.logger.debug("List of models in controller: %s", model_uuids)
+        owners = await self._get_model_owners() if self.model_filter.owners else None
+        collected = self.model_filter.apply(model_uuids, owners)
+        if len(collected) < len(model_uuids):
+            self.logger.debug(
+                "Skipping %d models excluded by the model filters",
+                len(model_uuids) - len(collected),
+            )
+            model_uuids = collected
+        shard_index = self.config["collection"]["shard_index"].get(int)
+        shard_count = self.config["collection"]["shard_count"].get(int)
+        if shard_count > 1:
+            model_uuids = {
+                name: uuid
+                for name, uuid in model_uuids.items()
+                if in_shard(uuid, shard_index, shard_count)
+            }
+            self.logger.debug("Models in shard %d: %s", shard_index, model_uuids)
+        for uuid in set(self._model_cache) - set(model_uuids.values()):
+            del self._model_cache[uuid]
+        await self.model_pool.prune(model_uuids.values())
+
+        return model_uuids
+
+    async def _get_all_model_rows(
+        self,
+        model_uuids: Dict[str, str],
+        due: Dict[str, str],
+        previous_stats: Dict[str, Dict[str, Any]],
+    ) -> List[Tuple[str, ModelRows]]:
+        """Get the gauge rows of every model, fetching only the due ones.
+
+        :param dict model_uuids: the uuids of the models to collect, by name
+        :param dict due: the uuids of the models to fetch, by name
+        :param dict previous_stats: the model stats of the previous cycle, by name
+        :return list: the uuid and the gauge rows of every model, in listing order
+        """
+        rows_by_uuid: Dict[str, ModelRows] = {}
+        if self.lightweight_mode:
+            rows_by_uuid = {uuid: rows async for uuid, rows in self.iter_summary_rows(due)}
+            self.logger.debug("%d of %d models served from summaries", len(rows_by_uuid), len(due))
+        fetched = {name: uuid for name, uuid in due.items() if uuid not in rows_by_uuid}
+        rows_by_uuid.update({uuid: rows async for uuid, rows in self.iter_model_rows(fetched)})
+        for name, uuid in due.items():
+            if uuid not in self._failed_models:
+                # failed models stay due, so the next cycle retries them
+                self.scheduler.schedule(name, uuid)
+        for name, uuid in model_uuids.items():
+            if uuid not in rows_by_uuid:
+                # not due yet, the rows and stats of its last fetch still hold
+                rows_by_uuid[uuid] = self._model_cache.get(uuid, (0, ModelRows([], [], [])))[1]
+                if name in previous_stats:
+                    self.model_stats[name] = dict(previous_stats[name], seconds=None, error=None)
+
+        # merge in controller listing order, regardless of completion order
+        return [(uuid, rows_by_uuid[uuid]) for uuid in model_uuids.values()]
+
+    async def _rebuild_machine_state(
+        self,
+        model_rows: List[Tuple[str, ModelRows]],
+        fetched: Set[str],
+        resync_deltas: Dict[str, List[Tuple[str, Any]]],
+    ) -> None:
+        """Rebuild the watch mode state table from the rows of a resync.
+
+        Models that were not fetched keep the state their deltas were applied to, and
+        models that no longer exist stop being watched.
+
+        :param list model_rows: the uuid and the gauge rows of every model
+        :param set fetched: the uuids of the models fetched by the resync
+        :param dict resync_deltas: the machine deltas received during the resync, by
+            model uuid
+        """
+        live = {uuid for uuid, _ in model_rows}
+        for uuid in set(self._watched_models) - live:
+            await self._unwatch_model(uuid)
+        self._machine_state = {
+            uuid: (
+                self._machine_state[uuid]
+                if uuid not in fetched and uuid in self._machine_state
+                else {key: (labels, value) for key, labels, value in rows.machines}
+            )
+            for uuid, rows in model_rows
+        }
+        # the statuses may have been fetched before some of these deltas
+        for uuid, deltas in resync_deltas.items():
+            state = self._machine_state.get(uuid)
+            if state is None:
+                continue
+            for model_name, delta in deltas:
+                self._apply_machine_delta(state, model_name, delta)
 
     async def get_stats(self) -> Dict[str, Any]:
-        """Get stats from all machines."""
-        gauge_name = "juju_machine_state"
-        gauge_desc = "Running status of juju machines"
-        labels = [
-            "job",
-            "hostname",
-            "customer",
-            "cloud_name",
-            "juju_model",
-            "type",
-        ]
-        self.refresh_cache(gauge_name=gauge_name, gauge_desc=gauge_desc, labels=labels)
-
-        endpoints: List[str] = self.config["juju"]["controller_endpoint"].as_str_seq(split=False)
-        username = self.config["juju"]["username"].get(str)
-        password = self.config["juju"]["password"].get(str)
-        cacert = self.config["juju"]["controller_cacert"].get(str)
+        """Get stats from all machines, units and applications.
+
+        The rows of every gauge come from a single status fetch per model. In
+        lightweight mode, only machines are collected and the models whose machines
+        are all known are served from bulk machine summaries instead.
 
+        In watch mode this is a full resync: the state table is rebuilt from the
+        status of every model and models that no longer exist stop being watched.
+
+        If the cycle fails, the exporter keeps serving the data of the last successful
+        one, so the models of that cycle are reported as stale, without fetch duration.
+        """
+        self.refresh_cache()
+        self.cache_stats = {"hit": 0, "miss": 0}
+        previous_stats = self.model_stats
+        self.model_stats = {}
+        self._failed_models = set()
+
+        resync_deltas: Dict[str, List[Tuple[str, Any]]] = {}
+        if self.watch_mode:
+            self._resync_deltas = resync_deltas
         try:
             await self._connect_controller(
-                endpoints=endpoints, username=username, password=password, cacert=cacert
+                endpoints=self.target["endpoints"],
+                username=self.target["username"],
+                password=self.target["password"],
+                cacert=self.target["cacert"],
+            )
+            model_uuids = await self._select_models()
+            due = self.scheduler.due(model_uuids)
+            model_rows = await self._get_all_model_rows(model_uuids, due, previous_stats)
+            self.logger.info(
+                "Model cache: %d hits, %d misses",
+                self.cache_stats["hit"],
+                self.cache_stats["miss"],
             )
-            model_uuids = await self.controller.model_uuids()
-            self.logger.debug("List of models in controller: %s", model_uuids)
 
-            for name, uuid_ in model_uuids.items():
-                self.logger.debug("Checking model '%s'...", name)
-                machines = await self._get_machines_in_model(uuid=uuid_)
+            if self.watch_mode:
+                await self._rebuild_machine_state(model_rows, set(due.values()), resync_deltas)
+                return self.get_state_stats()
 
-                await self._get_machine_stats(
-                    machines=machines, model_name=name, gauge_name=gauge_name
+            for _, rows in model_rows:
+                self.data[MACHINE_GAUGE_NAME]["labelvalues_update"].extend(
+                    (labels, value) for _, labels, value in rows.machines
                 )
-
-        finally:
+                if not self.lightweight_mode:
+                    self._add_status_rows(rows)
+
+        except Exception:
+            # models without rows in the last successful cycle have nothing to serve
+            self.model_stats = {
+                name: dict(
+                    stats, seconds=None, error=None, stale=stats["stale"] or not stats["error"]
+                )
+                for name, stats in previous_stats.items()
+            }
+            # drop the session so that the next cycle starts from a fresh connection
             await self.controller.disconnect()
+            raise
+        finally:
+            self._resync_deltas = None
 
         return self.data
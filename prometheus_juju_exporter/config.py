@@ -1,12 +1,60 @@
 """Configuration loader."""
 
+import re
 import sys
 from collections import OrderedDict
 from logging import getLogger
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Union
 
 import confuse
 
+CONTROLLER_TEMPLATE = confuse.Sequence(  # pylint: disable=E0110
+    OrderedDict(
+        [
+            ("controller_endpoint", confuse.StrSeq(split=False)),
+            ("controller_cacert", str),
+            ("username", str),
+            ("password", str),
+            ("customer", confuse.Optional(str)),
+            ("cloud_name", confuse.Optional(str)),
+        ]
+    )
+)
+
+MODEL_INTERVALS_TEMPLATE = confuse.Sequence(  # pylint: disable=E0110
+    OrderedDict([("match", str), ("interval", confuse.Choice(range(1, 10081)))])
+)
+
+
+def get_controller_targets(config: confuse.Configuration) -> List[Dict[str, Any]]:
+    """Return the controllers to collect machine stats from.
+
+    Each entry of the 'controllers' option is a target. Without any entry, the
+    'juju' section is the only target. The customer and cloud names default to
+    the values of the 'customer' section.
+
+    :param confuse.Configuration config: the validated configuration
+    :return list: targets with the endpoints, credentials and constant labels of
+        each controller
+    """
+    customer = config["customer"]["name"].get(str)
+    cloud_name = config["customer"]["cloud_name"].get(str)
+    controllers = config["controllers"].get(CONTROLLER_TEMPLATE) or [
+        config["juju"].get(CONTROLLER_TEMPLATE.subtemplate)
+    ]
+
+    return [
+        {
+            "endpoints": controller["controller_endpoint"],
+            "cacert": controller["controller_cacert"],
+            "username": controller["username"],
+            "password": controller["password"],
+            "customer": controller["customer"] or customer,
+            "cloud_name": controller["cloud_name"] or cloud_name,
+        }
+        for controller in controllers
+    ]
+
 
 class ConfigMeta(type):
     """Singleton metaclass for the Config."""
@@ -44,6 +92,12 @@ class Config(metaclass=ConfigMeta):
                 [
                     ("port", confuse.Choice(range(0, 65536), default=5000)),
                     ("collect_interval", int),
+                    ("collect_mode", confuse.Choice(["interval", "scrape"])),
+                    ("cache_ttl", confuse.Choice(range(0, 86401))),
+                    ("http_server", confuse.Choice(["thread", "asyncio"])),
+                    ("max_connections", confuse.Choice(range(1, 10001))),
+                    ("request_timeout", confuse.Choice(range(1, 3601))),
+                    ("snapshot_file", str),
                 ]
             ),
             "juju": OrderedDict(
@@ -54,6 +108,30 @@ class Config(metaclass=ConfigMeta):
                     ("password", str),
                 ]
             ),
+            "collection": OrderedDict(
+                [
+                    ("mode", confuse.Choice(["poll", "watch", "lightweight"])),
+                    ("max_concurrent_models", confuse.Choice(range(1, 1025))),
+                    ("model_timeout", confuse.Choice(range(0, 86401))),
+                    ("reconnect_attempts", confuse.Choice(range(1, 101))),
+                    ("reconnect_backoff", confuse.Choice(range(0, 3601))),
+                    ("max_failed_cycles", confuse.Choice(range(0, 10001))),
+                    ("model_pool_size", confuse.Choice(range(0, 10001))),
+                    ("model_idle_timeout", confuse.Choice(range(0, 86401))),
+                    ("shard_index", confuse.Choice(range(0, 1024))),
+                    ("shard_count", confuse.Choice(range(1, 1025))),
+                    ("model_intervals", MODEL_INTERVALS_TEMPLATE),
+                    ("interval_jitter", confuse.Choice(range(0, 51))),
+                    ("transport", confuse.Choice(["juju", "record", "replay"])),
+                    ("recording_dir", str),
+                    ("replay_latency", confuse.Choice(range(0, 600001))),
+                    ("replay_concurrency", confuse.Choice(range(0, 10001))),
+                    ("include_models", confuse.StrSeq()),
+                    ("exclude_models", confuse.StrSeq()),
+                    ("include_owners", confuse.StrSeq()),
+                ]
+            ),
+            "controllers": CONTROLLER_TEMPLATE,
             "customer": OrderedDict([("name", str), ("cloud_name", str)]),
             "detection": OrderedDict(
                 [
@@ -65,7 +143,26 @@ class Config(metaclass=ConfigMeta):
         }
 
         try:
-            self.config.get(template)
+            collection = self.config.get(template)["collection"]
+            if collection["shard_index"] >= collection["shard_count"]:
+                raise confuse.ConfigValueError(
+                    "collection.shard_index must be lower than collection.shard_count"
+                )
+            for entry in collection["model_intervals"]:
+                try:
+                    re.compile(entry["match"])
+                except re.error as err:
+                    raise confuse.ConfigValueError(
+                        f"collection.model_intervals: invalid match '{entry['match']}': {err}"
+                    ) from err
+            for option in ("include_models", "exclude_models"):
+                for pattern in collection[option]:
+                    try:
+                        re.compile(pattern)
+                    except re.error as err:
+                        raise confuse.ConfigValueError(
+                            f"collection.{option}: invalid pattern '{pattern}': {err}"
+                        ) from err
             self.logger.info("Configuration parsed successfully")
         except (
             KeyError,
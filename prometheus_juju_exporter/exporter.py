@@ -1,17 +1,121 @@
 """Exporter module."""
 
 import asyncio
+import os
 import sys
+import time
+from contextlib import suppress
 from logging import getLogger
-from typing import Any, Dict, List
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 
-from prometheus_client import CollectorRegistry, Gauge, start_http_server
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector as RegistryCollector
+from prometheus_client.samples import Sample
 
-from prometheus_juju_exporter.collector import Collector
-from prometheus_juju_exporter.config import Config
+from prometheus_juju_exporter.collector import (
+    MAX_RECONNECT_BACKOFF,
+    MIN_SCHEDULER_DELAY,
+    Collector,
+)
+from prometheus_juju_exporter.config import Config, get_controller_targets
+from prometheus_juju_exporter.exposition import (
+    AsyncExpositionServer,
+    ExpositionCache,
+    start_exposition_server,
+)
+from prometheus_juju_exporter.snapshot import load_snapshot, save_snapshot
 
+# labels whose values group the series of a gauge into chunks rebuilt together
+SERIES_CHUNK_LABELS = ("cloud_name", "juju_model")
 
-class ExporterDaemon:
+MODEL_FETCH_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, float("inf"))
+
+
+def _values_getter(indices: List[int]) -> Callable[[Sequence[str]], Tuple[str, ...]]:
+    """Return a function extracting the label values at the given positions as a tuple.
+
+    :param list indices: the positions of the labels, in order
+    :return: a function mapping the label values of a series to the selected ones
+    """
+    if len(indices) > 1:
+        return itemgetter(*indices)
+    return lambda labelvalues: tuple(labelvalues[index] for index in indices)
+
+
+class GaugeSeries(NamedTuple):
+    """Series of a gauge, as tuples of label values grouped in chunks.
+
+    The samples, which hold a dict of labels each, are only built while the registry
+    is rendered, so they are not kept between collection cycles.
+    """
+
+    name: str
+    documentation: str
+    labelnames: List[str]
+    # {chunk key: {label values: value}}
+    chunks: Dict[Tuple[str, ...], Dict[Tuple[str, ...], float]]
+
+    def metric(self) -> Metric:
+        """Build the metric family of the gauge."""
+        gauge = GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+        gauge.samples = [
+            Sample(self.name, dict(zip(self.labelnames, labelvalues)), value)
+            for chunk in self.chunks.values()
+            for labelvalues, value in chunk.items()
+        ]
+        return gauge
+
+
+class SnapshotCollector(RegistryCollector):
+    """Registry collector serving the metrics of the last collection cycle.
+
+    Each cycle publishes a complete new snapshot by replacing a single reference, so
+    a rendering of the registry sees either the previous or the new snapshot, never
+    a mix of both.
+    """
+
+    def __init__(self) -> None:
+        """Create a collector with an empty snapshot."""
+        self._snapshot: Mapping[str, GaugeSeries] = {}
+
+    @property
+    def snapshot(self) -> Mapping[str, GaugeSeries]:
+        """Return the gauges currently served, by name."""
+        return self._snapshot
+
+    def publish(self, snapshot: Mapping[str, GaugeSeries]) -> None:
+        """Replace the served gauges.
+
+        :param Mapping[str, GaugeSeries] snapshot: gauges by name, which must not be
+            modified once published
+        """
+        self._snapshot = snapshot
+
+    def describe(self) -> List[Metric]:
+        """Describe no metrics up front, since they change with every snapshot."""
+        return []
+
+    def collect(self) -> Iterator[Metric]:
+        """Yield the metric families of the current snapshot."""
+        for series in self._snapshot.values():
+            yield series.metric()
+
+
+class ExporterDaemon:  # pylint: disable=R0902
     """Core class of the exporter daemon."""
 
     def __init__(self) -> None:
@@ -20,76 +124,515 @@ class ExporterDaemon:
         self.logger = getLogger(__name__)
         self.logger.info("Parsed config: %s", self.config.config_dir())
         self._registry = CollectorRegistry()
-        self.metrics: Dict[str, Gauge] = {}
-        self.collector = Collector()
-        self.logger.debug("Exporter initialized")
+        self.scrape_mode = self.config["exporter"]["collect_mode"].get(str) == "scrape"
+        self.metrics = SnapshotCollector()
+        self._registry.register(self.metrics)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # set while a scrape-driven collection is pending or running
+        self._collect_requested = asyncio.Event()
+        self._collected_at: Optional[float] = None
+        # live series of each gauge by chunk, as {chunk key: {label values: value}}
+        self._series_index: Dict[str, Dict[Tuple[str, ...], Dict[Tuple[str, ...], float]]] = {}
+        self.model_cache_lookups = Counter(
+            "prometheus_juju_exporter_model_cache_lookups",
+            "Models whose gauge rows were reused (hit) or recomputed (miss)",
+            labelnames=["result"],
+            registry=self._registry,
+        )
+        self.cycle_duration = Gauge(
+            "prometheus_juju_exporter_cycle_duration_seconds",
+            "Duration of the stages of the last collection cycle",
+            labelnames=["stage"],
+            registry=self._registry,
+        )
+        self.model_fetch_duration = Histogram(
+            "prometheus_juju_exporter_model_fetch_duration_seconds",
+            "Time taken to fetch the status of a model",
+            buckets=MODEL_FETCH_BUCKETS,
+            registry=self._registry,
+        )
+        self.model_status_hosts = Gauge(
+            "prometheus_juju_exporter_model_status_hosts",
+            "Machines and containers in the last status fetched for a model",
+            labelnames=["cloud_name", "juju_model"],
+            registry=self._registry,
+        )
+        self.model_stale = Gauge(
+            "prometheus_juju_exporter_model_stale",
+            "Whether the series of a model are kept from an earlier cycle (1) or fresh (0)",
+            labelnames=["cloud_name", "juju_model"],
+            registry=self._registry,
+        )
+        self._model_labels: Set[Tuple[str, str]] = set()
+        self.model_errors = Counter(
+            "prometheus_juju_exporter_model_errors",
+            "Models whose status could not be fetched, by reason",
+            labelnames=["cloud_name", "juju_model", "reason"],
+            registry=self._registry,
+        )
+        # reasons of the errors counted so far, by cloud and model name
+        self._model_error_reasons: Dict[Tuple[str, str], Set[str]] = {}
+        self.series_changes = Counter(
+            "prometheus_juju_exporter_series_changes",
+            "Gauge series added or removed by registry updates",
+            labelnames=["gauge", "change"],
+            registry=self._registry,
+        )
+        self.last_success = Gauge(
+            "prometheus_juju_exporter_last_success_timestamp_seconds",
+            "Unix time of the last successful collection cycle",
+            registry=self._registry,
+        )
+        self.failed_cycles = Counter(
+            "prometheus_juju_exporter_failed_cycles",
+            "Collection cycles that failed and were retried",
+            registry=self._registry,
+        )
+        self.serving_snapshot = Gauge(
+            "prometheus_juju_exporter_serving_snapshot",
+            "Whether the series served were loaded from the snapshot of an earlier run (1)",
+            registry=self._registry,
+        )
+        snapshot_file = self.config["exporter"]["snapshot_file"].get(str)
+        self.snapshot_path = (
+            os.path.join(self.config.config_dir(), snapshot_file) if snapshot_file else None
+        )
+        # rendered once per update instead of once per scrape
+        self.exposition = ExpositionCache(self._registry)
+        self.watch_mode = self.config["collection"]["mode"].get(str) == "watch"
+        # set by the collectors whenever a watched model changes
+        self.state_changed = asyncio.Event()
+        self.collectors = [
+            Collector(target, on_change=self.state_changed_callback)
+            for target in get_controller_targets(self.config)
+        ]
+        # last data collected from each controller, served while it cannot be reached
+        self._last_results: Dict[Collector, Dict[str, Any]] = {}
+        self.logger.debug("Exporter initialized with %d controllers", len(self.collectors))
+
+    @staticmethod
+    def _merge_data(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Merge the data collected from several controllers.
+
+        :param list results: the data of each controller, in the Collector format
+        :return dict: the data with the rows of all controllers, in controller order
+        """
+        if len(results) == 1:
+            return results[0]
+
+        data: Dict[str, Any] = {}
+        for result in results:
+            for gauge_name, values in result.items():
+                if gauge_name not in data:
+                    data[gauge_name] = dict(values, labelvalues_update=[])
+                data[gauge_name]["labelvalues_update"].extend(values["labelvalues_update"])
+
+        return data
+
+    def _split_data(self, data: Dict[str, Any]) -> Dict[Collector, Dict[str, Any]]:
+        """Split merged data into the data of each controller.
+
+        A row belongs to the first controller with its customer and cloud name.
+
+        :param dict data: the data of all controllers, in the Collector format
+        :return dict: the data of each controller, by collector
+        """
+        collectors: Dict[Tuple[str, str], Collector] = {}
+        for collector in self.collectors:
+            key = (str(collector.target["customer"]), str(collector.target["cloud_name"]))
+            collectors.setdefault(key, collector)
+
+        results: Dict[Collector, Dict[str, Any]] = {
+            collector: {
+                gauge_name: dict(values, labelvalues_update=[])
+                for gauge_name, values in data.items()
+            }
+            for collector in self.collectors
+        }
+        for gauge_name, values in data.items():
+            customer = list(values["labels"]).index("customer")
+            cloud_name = list(values["labels"]).index("cloud_name")
+            for row in values["labelvalues_update"]:
+                owner = collectors.get((row[0][customer], row[0][cloud_name]))
+                if owner is not None:
+                    results[owner][gauge_name]["labelvalues_update"].append(row)
+
+        return results
+
+    async def collect(self) -> Dict[str, Any]:
+        """Collect stats from all controllers concurrently.
+
+        A controller that fails is served with the data of its last successful
+        collection, as long as at least one other controller succeeds.
+
+        :return dict: the merged data of all controllers
+        :raises Exception: the error of the first controller, if all of them failed
+        """
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(collector.get_stats() for collector in self.collectors), return_exceptions=True
+        )
+        self.cycle_duration.labels(stage="collect").set(time.perf_counter() - start)
+        merged: List[Dict[str, Any]] = []
+        errors: List[Exception] = []
+        for collector, result in zip(self.collectors, results):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    "Failed collecting from controller %s: %s",
+                    collector.target["endpoints"],
+                    result,
+                )
+                errors.append(result)
+                merged.append(self._last_results.get(collector, {}))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                self._last_results[collector] = result
+                merged.append(result)
+        for collector in self.collectors:
+            for lookup, count in collector.cache_stats.items():
+                self.model_cache_lookups.labels(result=lookup).inc(count)
+        # failed collectors report the models of their last cycle as stale, which is
+        # what the registry keeps serving if every controller failed
+        self._record_model_stats()
+        if len(errors) == len(merged):
+            raise errors[0]
+
+        return self._merge_data(merged)
+
+    def _record_model_stats(self) -> None:
+        """Export the fetch duration, host count, errors and staleness of every model."""
+        models = {}
+        for collector in self.collectors:
+            cloud_name = str(collector.target["cloud_name"])
+            for model_name, stats in collector.model_stats.items():
+                if stats["seconds"] is not None:
+                    self.model_fetch_duration.observe(stats["seconds"])
+                if stats["error"] is not None:
+                    self.model_errors.labels(cloud_name, model_name, stats["error"]).inc()
+                    self._model_error_reasons.setdefault((cloud_name, model_name), set()).add(
+                        stats["error"]
+                    )
+                models[(cloud_name, model_name)] = stats
 
-    def _create_metrics_dict(self, gauge_name: str, gauge_desc: str, labels: List[str]) -> None:
-        """Create a dict of gauge instances.
+        for labels in self._model_labels - models.keys():
+            self.model_status_hosts.remove(*labels)
+            self.model_stale.remove(*labels)
+            for reason in self._model_error_reasons.pop(labels, ()):
+                self.model_errors.remove(*labels, reason)
+        for labels, stats in models.items():
+            self.model_status_hosts.labels(*labels).set(stats["hosts"])
+            self.model_stale.labels(*labels).set(int(stats["stale"]))
+        self._model_labels = set(models)
+
+    @staticmethod
+    def _chunk_series(
+        labelnames: List[str], rows: List[Tuple[Tuple[str, ...], float]]
+    ) -> Dict[Tuple[str, ...], Dict[Tuple[str, ...], float]]:
+        """Group the series of a gauge by the values of the SERIES_CHUNK_LABELS.
+
+        :param list labelnames: the label set of the gauge
+        :param list rows: the label values, in labelnames order, and value of every series
+        :return dict: {chunk key: {label values: value}}, where the last value of a
+            duplicate series wins
+        """
+        get_key = _values_getter(
+            [labelnames.index(name) for name in SERIES_CHUNK_LABELS if name in labelnames]
+        )
+        chunks: Dict[Tuple[str, ...], Dict[Tuple[str, ...], float]] = {}
+        for labelvalues, value in rows:
+            key = get_key(labelvalues)
+            chunk = chunks.get(key)
+            if chunk is None:
+                chunk = chunks[key] = {}
+            chunk[labelvalues] = value
+
+        return chunks
+
+    def _diff_series(
+        self,
+        gauge_name: str,
+        previous: Dict[Tuple[str, ...], float],
+        series: Dict[Tuple[str, ...], float],
+    ) -> Tuple[int, int]:
+        """Compare the series of a gauge chunk with the ones of the previous update.
 
         :param str gauge_name: the name of the gauge
-        :param str gauge_desc: the description of the gauge
-        :param List[str] labels: the label set of the gauge
+        :param dict previous: the previous values of the chunk, by label values
+        :param dict series: the new values of the chunk, by label values
+        :return: the number of added and removed series
         """
-        if gauge_name not in self.metrics:
-            self.logger.debug("Creating Gauge %s", gauge_name)
-            self.metrics[gauge_name] = Gauge(
-                gauge_name, gauge_desc, labelnames=labels, registry=self._registry
-            )
+        added = series.keys() - previous.keys()
+        removed = previous.keys() - series.keys()
+        for labels in added:
+            self.logger.debug("Adding labelvalues %s to %s...", labels, gauge_name)
+        for labels in removed:
+            self.logger.debug("Deleting labelvalues %s from %s...", labels, gauge_name)
+
+        return len(added), len(removed)
 
     def update_registry(self, data: Dict[str, Any]) -> None:
         """Update the registry with newly collected values.
 
+        Gauges present in the data are replaced, so series that were not collected
+        again disappear. The series of a gauge are kept in chunks, one per model, and
+        unchanged chunks are shared with the previous update. A gauge without any
+        changed chunk keeps its previous series. The result is published to the
+        registry at once, and the samples are only built when it is rendered.
+
         :param dict data: the machine data collected by the Collector method
         """
+        start = time.perf_counter()
+        snapshot = dict(self.metrics.snapshot)
         for gauge_name, values in data.items():
-            self._create_metrics_dict(
-                gauge_name=gauge_name,
-                gauge_desc=values["gauge_desc"],
-                labels=values["labels"],
+            labelnames = values["labels"]
+            chunks = self._chunk_series(labelnames, values["labelvalues_update"])
+            previous = self._series_index.get(gauge_name, {})
+            changed = [key for key, series in chunks.items() if previous.get(key) != series]
+            dropped = previous.keys() - chunks.keys()
+            if gauge_name in snapshot and not changed and not dropped:
+                self.logger.debug("Gauge %s is unchanged", gauge_name)
+                continue
+
+            added = removed = 0
+            for key in changed:
+                chunk_added, chunk_removed = self._diff_series(
+                    gauge_name, previous.get(key, {}), chunks[key]
+                )
+                added += chunk_added
+                removed += chunk_removed
+            for key in chunks.keys() - changed:
+                chunks[key] = previous[key]
+            for key in dropped:
+                removed += self._diff_series(gauge_name, previous[key], {})[1]
+
+            self._series_index[gauge_name] = chunks
+            self.series_changes.labels(gauge=gauge_name, change="added").inc(added)
+            self.series_changes.labels(gauge=gauge_name, change="removed").inc(removed)
+            self.logger.debug(
+                "Updating Gauge %s with %d series, %d added and %d removed in %d chunks",
+                gauge_name,
+                sum(len(chunk) for chunk in chunks.values()),
+                added,
+                removed,
+                len(changed) + len(dropped),
             )
-            for labels, value in values["labelvalues_update"]:
-                self.logger.debug("Updating Gauge %s, %s: %s", gauge_name, labels, value)
-                self.metrics[gauge_name].labels(**labels).set(value)
+            snapshot[gauge_name] = GaugeSeries(
+                gauge_name, values["gauge_desc"], labelnames, chunks
+            )
+
+        self.metrics.publish(snapshot)
+        self.cycle_duration.labels(stage="update_registry").set(time.perf_counter() - start)
+
+    def render_exposition(self) -> None:
+        """Render the registry for the scrapes until the next update."""
+        start = time.perf_counter()
+        self.exposition.render()
+        self.cycle_duration.labels(stage="render").set(time.perf_counter() - start)
+
+    def warm_start(self) -> None:
+        """Serve the snapshot of the last successful cycle until the first collection.
+
+        The last success timestamp is the one of the snapshot, so that its age is
+        visible, and prometheus_juju_exporter_serving_snapshot is 1 until fresh data
+        replaces it. The snapshot rows of each controller are also served in place of
+        its data until it is collected successfully.
+        """
+        if self.snapshot_path is None:
+            return
+
+        try:
+            snapshot = load_snapshot(self.snapshot_path)
+        except ValueError as err:
+            self.logger.warning("Ignoring snapshot %s: %s", self.snapshot_path, err)
+            return
+        if snapshot is None:
+            return
+
+        saved_at, data = snapshot
+        self.update_registry(data)
+        self._last_results = self._split_data(data)
+        self.last_success.set(saved_at)
+        self.serving_snapshot.set(1)
+        self.render_exposition()
+        self.logger.info("Serving the snapshot of %s until the first collection.", saved_at)
 
-            previous_labels = set()
-            for metric in self._registry.collect():
-                for sample in metric.samples:
-                    if sample.name == gauge_name:
-                        previous_labels.add(tuple(sample.labels.values()))
+    async def persist_snapshot(self, data: Dict[str, Any]) -> None:
+        """Save the data of a successful cycle for the next warm start.
+
+        :param dict data: the data collected by the cycle
+        """
+        if self.snapshot_path is None:
+            return
+
+        start = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, save_snapshot, self.snapshot_path, data, time.time()
+            )
+        except OSError as err:
+            self.logger.warning("Could not save snapshot %s: %s", self.snapshot_path, err)
+        self.cycle_duration.labels(stage="persist_snapshot").set(time.perf_counter() - start)
 
-            current_labels = set()
-            for value in values["labelvalues_update"]:
-                current_labels.add(tuple(value[0].values()))
+    def state_changed_callback(self) -> None:
+        """Signal that the state table of a watched model changed."""
+        self.state_changed.set()
 
-            stale_labels = previous_labels - current_labels
-            for labels in stale_labels:
-                self.logger.debug("Deleting labelvalues %s from %s...", labels, gauge_name)
-                self.metrics[gauge_name].remove(*labels)
+    def request_collection(self) -> None:
+        """Request a collection if the served data is older than the cache TTL.
+
+        Called by scrapes in the HTTP server thread. The scrape is answered with the
+        current, possibly stale, data right away, and all scrapes arriving while a
+        collection is pending share that single collection.
+        """
+        if self._loop is None or self._collect_requested.is_set():
+            return
+
+        ttl = self.config["exporter"]["cache_ttl"].get(int)
+        if self._collected_at is not None and time.monotonic() - self._collected_at < ttl:
+            return
+
+        self.logger.debug("Cached data expired, requesting a collection.")
+        self._loop.call_soon_threadsafe(self._collect_requested.set)
+
+    async def follow_changes(self, duration: Optional[float]) -> None:
+        """Update the registry whenever a watched model changes, for a limited time.
+
+        :param float duration: the number of seconds to follow changes for, None to
+            follow them until cancelled
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if duration is None else loop.time() + duration
+        while True:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(self.state_changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+            self.state_changed.clear()
+            self.logger.debug("Machine state changed, updating gauges.")
+            self.update_registry(
+                self._merge_data([collector.get_state_stats() for collector in self.collectors])
+            )
+            self.render_exposition()
+
+    async def wait_for_collection_request(self) -> None:
+        """Wait until a scrape requests a collection.
+
+        In watch mode, the registry keeps following machine changes in the meantime.
+        """
+        if not self.watch_mode:
+            await self._collect_requested.wait()
+            return
+
+        follower = asyncio.ensure_future(self.follow_changes(None))
+        try:
+            await self._collect_requested.wait()
+        finally:
+            follower.cancel()
+            with suppress(asyncio.CancelledError):
+                await follower
+
+    def next_cycle_in(self) -> float:
+        """Return the seconds until the next collection cycle.
+
+        This is the collect interval, or less when a model of a collector with
+        per-model intervals is due earlier, but not less than MIN_SCHEDULER_DELAY.
+        """
+        interval: float = self.config["exporter"]["collect_interval"].get(int) * 60
+        deadlines = [
+            deadline
+            for collector in self.collectors
+            if (deadline := collector.scheduler.seconds_until_due()) is not None
+        ]
+        if deadlines:
+            interval = min(interval, max(min(deadlines), MIN_SCHEDULER_DELAY))
+        return interval
 
     async def trigger(self) -> None:
-        """Call Collector and configure prometheus_client gauges from generated stats."""
+        """Call Collector and configure prometheus_client gauges from generated stats.
+
+        In scrape mode, a collection only runs when a scrape requested it. A failed
+        cycle is retried with an exponential backoff while the last collected series
+        keep being served, until 'max_failed_cycles' consecutive cycles failed.
+        """
+        self._loop = asyncio.get_running_loop()
+        # Python < 3.10 binds events to the current loop on creation
+        self.state_changed = asyncio.Event()
+        self._collect_requested = asyncio.Event()
+        failures = 0
         while True:
             try:
+                if self.scrape_mode:
+                    await self.wait_for_collection_request()
                 self.logger.info("Collecting gauges...")
-                data = await self.collector.get_stats()
+                data = await self.collect()
                 self.update_registry(data)
+                self._collected_at = time.monotonic()
+                self.last_success.set_to_current_time()
+                self.serving_snapshot.set(0)
+                self._collect_requested.clear()
+                self.render_exposition()
+                failures = 0
+                await self.persist_snapshot(data)
                 self.logger.info("Gauges collected and ready for exporting.")
-                await asyncio.sleep(self.config["exporter"]["collect_interval"].get(int) * 60)
+                if self.scrape_mode:
+                    continue
+                interval = self.next_cycle_in()
+                if self.watch_mode:
+                    await self.follow_changes(interval)
+                else:
+                    await asyncio.sleep(interval)
             except Exception as err:  # pylint: disable=W0703
-                self.logger.error("Collection job resulted in error: %s", err)
-                sys.exit(1)
+                failures += 1
+                self.failed_cycles.inc()
+                self.render_exposition()
+                max_failures = self.config["collection"]["max_failed_cycles"].get(int)
+                if max_failures and failures >= max_failures:
+                    self.logger.error("Collection job resulted in error: %s", err)
+                    sys.exit(1)
+
+                backoff = self.config["collection"]["reconnect_backoff"].get(int)
+                delay = min(backoff * 2 ** (failures - 1), MAX_RECONNECT_BACKOFF)
+                self.logger.error(
+                    "Collection job resulted in error: %s. Retrying in %ss.", err, delay
+                )
+                await asyncio.sleep(delay)
+
+    async def serve(self) -> None:
+        """Serve scrapes from the event loop while running the collection trigger."""
+        server = AsyncExpositionServer(
+            self.exposition,
+            on_scrape=self.request_collection if self.scrape_mode else None,
+            max_connections=self.config["exporter"]["max_connections"].get(int),
+            request_timeout=self.config["exporter"]["request_timeout"].get(int),
+        )
+        await server.start(self.config["exporter"]["port"].get(int))
+        try:
+            await self.trigger()
+        finally:
+            await server.close()
 
     def run(self) -> None:
         """Run exporter."""
-        self.logger.debug("Running prometheus client http server.")
-        start_http_server(
-            self.config["exporter"]["port"].get(int),
-            registry=self._registry,
-        )
+        self.warm_start()
+        if self.config["exporter"]["http_server"].get(str) == "asyncio":
+            self.logger.debug("Running exposition http server in the event loop.")
+            main = self.serve()
+        else:
+            self.logger.debug("Running exposition http server.")
+            start_exposition_server(
+                self.config["exporter"]["port"].get(int),
+                self.exposition,
+                on_scrape=self.request_collection if self.scrape_mode else None,
+            )
+            main = self.trigger()
 
         try:
-            asyncio.run(self.trigger())
+            asyncio.run(main)
         except KeyboardInterrupt as err:
             # Gracefully handle keyboard interrupt
             self.logger.info("%s: Exiting...", err)
@@ -0,0 +1,321 @@
+"""Exposition module."""
+
+import asyncio
+import gzip
+import hashlib
+import threading
+from contextlib import suppress
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, NamedTuple, Optional, Set, Tuple, cast
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, generate_latest
+from prometheus_client.openmetrics import exposition as openmetrics
+
+
+class Rendering(NamedTuple):
+    """Text exposition of a registry, plain and gzip-compressed."""
+
+    plain: bytes
+    compressed: bytes
+    etag: str
+
+
+class ExpositionCache:
+    """Text exposition of a registry, rendered once per collection cycle.
+
+    Scrapes are answered with the bytes of the last rendering, compressed when the
+    client accepts gzip, instead of walking the registry and formatting every sample
+    again. A rendering replaces the previous one through a single reference, so a
+    scrape in the HTTP server thread never sees a partial rendering.
+
+    Scrapers that accept OpenMetrics are answered in that format. It is rendered on
+    the first such scrape after each rendering, so it costs nothing when unused.
+    """
+
+    def __init__(self, registry: CollectorRegistry, compresslevel: int = 6) -> None:
+        """Create a cache of the registry, rendered right away.
+
+        :param CollectorRegistry registry: the registry to render
+        :param int compresslevel: the gzip compression level, from 1 to 9
+        """
+        self._registry = registry
+        self._compresslevel = compresslevel
+        self._rendering = Rendering(b"", b"", "")
+        # the OpenMetrics rendering and the text rendering it was made along with
+        self._openmetrics: Tuple[Rendering, Rendering] = (self._rendering, self._rendering)
+        self.render()
+
+    @property
+    def rendering(self) -> Rendering:
+        """Return the last rendering."""
+        return self._rendering
+
+    def _render(self, generate: Callable[[CollectorRegistry], bytes]) -> Rendering:
+        """Render the current metrics of the registry in a format.
+
+        :param Callable generate: the function formatting the registry
+        :return Rendering: the rendering
+        """
+        plain = generate(self._registry)
+        return Rendering(
+            plain=plain,
+            compressed=gzip.compress(plain, compresslevel=self._compresslevel),
+            etag=hashlib.sha1(plain).hexdigest()[:20],
+        )
+
+    def render(self) -> None:
+        """Render the current metrics of the registry."""
+        self._rendering = self._render(generate_latest)
+
+    @property
+    def openmetrics_rendering(self) -> Rendering:
+        """Return the OpenMetrics rendering of the metrics of the last rendering."""
+        rendering, openmetrics_rendering = self._openmetrics
+        if rendering is not self._rendering:
+            rendering = self._rendering
+            openmetrics_rendering = self._render(openmetrics.generate_latest)
+            self._openmetrics = (rendering, openmetrics_rendering)
+        return openmetrics_rendering
+
+    def response(
+        self, accept_encoding: str = "", if_none_match: str = "", accept: str = ""
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """Return the status, headers and body answering a scrape.
+
+        :param str accept_encoding: the Accept-Encoding header of the request
+        :param str if_none_match: the If-None-Match header of the request
+        :param str accept: the Accept header of the request
+        :return tuple: the HTTP status code, the response headers and the body
+        """
+        if "application/openmetrics-text" in (
+            media_type.split(";")[0].strip() for media_type in accept.split(",")
+        ):
+            rendering, content_type = self.openmetrics_rendering, openmetrics.CONTENT_TYPE_LATEST
+        else:
+            rendering, content_type = self._rendering, CONTENT_TYPE_LATEST
+        gzipped = "gzip" in (
+            encoding.split(";")[0].strip() for encoding in accept_encoding.split(",")
+        )
+        # each encoding is a distinct representation with its own entity tag
+        etag = f'"{rendering.etag}-gzip"' if gzipped else f'"{rendering.etag}"'
+        headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding"}
+        if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match == "*":
+            return 304, headers, b""
+
+        headers["Content-Type"] = content_type
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+            return 200, headers, rendering.compressed
+        return 200, headers, rendering.plain
+
+
+class ExpositionServer(ThreadingHTTPServer):
+    """HTTP server answering every GET and HEAD request with the cached exposition."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        cache: ExpositionCache,
+        on_scrape: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Bind the server to an address.
+
+        :param tuple address: the (host, port) to listen on
+        :param ExpositionCache cache: the exposition to serve
+        :param Callable on_scrape: called before answering every scrape
+        """
+        self.cache = cache
+        self.on_scrape = on_scrape
+        super().__init__(address, ExpositionHandler)
+
+
+class ExpositionHandler(BaseHTTPRequestHandler):
+    """Request handler of the exposition server."""
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Answer a scrape with the cached exposition."""
+        self._respond()
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        """Answer a scrape with the headers of the cached exposition only."""
+        self._respond(head_only=True)
+
+    def _respond(self, head_only: bool = False) -> None:
+        """Send the response to a scrape.
+
+        :param bool head_only: whether to leave the body out
+        """
+        server = cast(ExpositionServer, self.server)
+        if server.on_scrape is not None:
+            server.on_scrape()
+        status, headers, body = server.cache.response(
+            self.headers.get("Accept-Encoding", ""),
+            self.headers.get("If-None-Match", ""),
+            self.headers.get("Accept", ""),
+        )
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head_only:
+            self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # pylint: disable=W0622
+        """Do not log every scrape."""
+
+
+def start_exposition_server(
+    port: int,
+    cache: ExpositionCache,
+    on_scrape: Optional[Callable[[], None]] = None,
+    addr: str = "0.0.0.0",
+) -> ExpositionServer:
+    """Serve the cached exposition from a daemon thread.
+
+    :param int port: the port to listen on
+    :param ExpositionCache cache: the exposition to serve
+    :param Callable on_scrape: called before answering every scrape
+    :param str addr: the address to listen on
+    :return ExpositionServer: the running server
+    """
+    server = ExpositionServer((addr, port), cache, on_scrape)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class AsyncExpositionServer:
+    """HTTP server answering scrapes with the cached exposition from the event loop.
+
+    It runs on the loop of the collection, so scrapes do not compete with it from
+    another thread. Connections beyond the limit are answered 503 right away, and a
+    connection that does not send a complete request within the timeout is closed.
+    """
+
+    def __init__(
+        self,
+        cache: ExpositionCache,
+        on_scrape: Optional[Callable[[], None]] = None,
+        max_connections: int = 100,
+        request_timeout: float = 10,
+    ) -> None:
+        """Create a server that is not listening yet.
+
+        :param ExpositionCache cache: the exposition to serve
+        :param Callable on_scrape: called before answering every scrape
+        :param int max_connections: the maximum number of connections served at once
+        :param float request_timeout: seconds to receive a request or send a response
+        """
+        self.cache = cache
+        self.on_scrape = on_scrape
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.Server] = None
+
+    @property
+    def port(self) -> int:
+        """Return the port the server listens on."""
+        if self._server is None:
+            raise RuntimeError("The exposition server is not started")
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, port: int, addr: str = "0.0.0.0") -> None:
+        """Start listening.
+
+        :param int port: the port to listen on, 0 for any free port
+        :param str addr: the address to listen on
+        """
+        self._server = await asyncio.start_server(self._serve_connection, addr, port)
+
+    async def close(self) -> None:
+        """Stop listening and close the open connections."""
+        if self._server is not None:
+            self._server.close()
+            for writer in self._writers:
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer the requests of a connection until it is closed or times out."""
+        try:
+            if len(self._writers) >= self.max_connections:
+                await self._respond(writer, HTTPStatus.SERVICE_UNAVAILABLE, {}, b"", False)
+                return
+
+            self._writers.add(writer)
+            try:
+                while await self._serve_request(reader, writer):
+                    pass
+            finally:
+                self._writers.discard(writer)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _serve_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Answer a single request.
+
+        :return bool: whether the connection is kept open for another request
+        """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.request_timeout)
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, _, version = request_line.split(" ")
+            headers = dict(
+                (name.strip().lower(), value.strip())
+                for name, _, value in (line.partition(":") for line in header_lines if line)
+            )
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            return False
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection == "keep-alive" or (
+            version == "HTTP/1.1" and connection != "close"
+        )
+        if method not in ("GET", "HEAD"):
+            await self._respond(writer, HTTPStatus.METHOD_NOT_ALLOWED, {}, b"", keep_alive)
+            return keep_alive
+
+        if self.on_scrape is not None:
+            self.on_scrape()
+        status, response_headers, body = self.cache.response(
+            headers.get("accept-encoding", ""),
+            headers.get("if-none-match", ""),
+            headers.get("accept", ""),
+        )
+        await self._respond(
+            writer, HTTPStatus(status), response_headers, body, keep_alive, method == "HEAD"
+        )
+        return keep_alive
+
+    async def _respond(  # pylint: disable=R0913
+        self,
+        writer: asyncio.StreamWriter,
+        status: HTTPStatus,
+        headers: Dict[str, str],
+        body: bytes,
+        keep_alive: bool,
+        head_only: bool = False,
+    ) -> None:
+        """Write a response and wait until it is sent."""
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write("\r\n".join(lines).encode("latin-1") + b"\r\n\r\n")
+        if not head_only:
+            writer.write(body)
+        await asyncio.wait_for(writer.drain(), self.request_timeout)
@@ -0,0 +1,74 @@
+"""Gauges module."""
+
+from typing import List, NamedTuple, Tuple
+
+MACHINE_GAUGE_NAME = "juju_machine_state"
+MACHINE_GAUGE_DESC = "Running status of juju machines"
+MACHINE_GAUGE_JOB = "prometheus-juju-exporter"
+
+UNIT_GAUGE_NAME = "juju_unit_state"
+UNIT_GAUGE_DESC = "Status of juju units, 1 if the workload is active and the agent healthy"
+APPLICATION_GAUGE_NAME = "juju_application_state"
+APPLICATION_GAUGE_DESC = "Status of juju applications, 1 if active"
+
+
+class MachineLabels(NamedTuple):
+    """Label values of a juju_machine_state series, in MACHINE_GAUGE_LABELS order.
+
+    A plain tuple per host: the job, customer, cloud name, model name and type
+    strings are shared by all the rows they appear in, instead of being held by a
+    dict per row.
+    """
+
+    job: str
+    hostname: str
+    customer: str
+    cloud_name: str
+    juju_model: str
+    type: str
+
+
+MACHINE_GAUGE_LABELS = list(MachineLabels._fields)
+
+
+class UnitLabels(NamedTuple):
+    """Label values of a juju_unit_state series, in UNIT_GAUGE_LABELS order."""
+
+    job: str
+    customer: str
+    cloud_name: str
+    juju_model: str
+    application: str
+    unit: str
+
+
+UNIT_GAUGE_LABELS = list(UnitLabels._fields)
+
+
+class ApplicationLabels(NamedTuple):
+    """Label values of a juju_application_state series, in APPLICATION_GAUGE_LABELS order."""
+
+    job: str
+    customer: str
+    cloud_name: str
+    juju_model: str
+    application: str
+
+
+APPLICATION_GAUGE_LABELS = list(ApplicationLabels._fields)
+
+# name, description and label set of every gauge built from the model statuses
+STATUS_GAUGES = (
+    (MACHINE_GAUGE_NAME, MACHINE_GAUGE_DESC, MACHINE_GAUGE_LABELS),
+    (UNIT_GAUGE_NAME, UNIT_GAUGE_DESC, UNIT_GAUGE_LABELS),
+    (APPLICATION_GAUGE_NAME, APPLICATION_GAUGE_DESC, APPLICATION_GAUGE_LABELS),
+)
+
+
+class ModelRows(NamedTuple):
+    """Gauge rows derived from the status of a model."""
+
+    # tuples of the juju machine id, the gauge labels and the gauge value
+    machines: List[Tuple[str, MachineLabels, int]]
+    units: List[Tuple[UnitLabels, int]]
+    applications: List[Tuple[ApplicationLabels, int]]
@@ -0,0 +1,310 @@
+"""Models module."""
+
+import heapq
+import random
+import re
+import time
+import zlib
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from juju.client.connection import Monitor
+from juju.model import Model
+
+from prometheus_juju_exporter.config import MODEL_INTERVALS_TEMPLATE
+
+
+def in_shard(uuid: str, shard_index: int, shard_count: int) -> bool:
+    """Check whether a model belongs to a shard.
+
+    The hash is stable across processes and Python versions, so every replica agrees
+    on the shard of each model.
+
+    :param str uuid: the uuid of the model
+    :param int shard_index: the shard of this exporter
+    :param int shard_count: the number of shards
+    :return bool: True if the model is collected by this shard
+    """
+    return zlib.crc32(uuid.encode()) % shard_count == shard_index
+
+
+class ModelPool:
+    """Least recently used pool of open model connections, reused across cycles.
+
+    A connection is taken out of the pool while a model is fetched and put back
+    afterwards. Beyond the size of the pool, the least recently used connections
+    are closed, as well as the ones idle for longer than the idle timeout.
+    """
+
+    def __init__(self, size: int, idle_timeout: float) -> None:
+        """Create an empty pool.
+
+        :param int size: the maximum number of idle connections kept open, 0 to close
+            every connection once its model is fetched
+        :param float idle_timeout: seconds after which an unused connection is closed
+        """
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.logger = getLogger(__name__)
+        # idle connections with the time they were last used, least recent first
+        self._models: "OrderedDict[str, Tuple[Model, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of idle connections in the pool."""
+        return len(self._models)
+
+    @staticmethod
+    def _healthy(model: Model) -> bool:
+        """Check whether a model connection can be reused.
+
+        :param Model model: the model connection
+        :return bool: True if the websocket is open and its receiver is running
+        """
+        if not model.is_connected():
+            return False
+
+        return model.connection().monitor.status == Monitor.CONNECTED
+
+    async def _close(self, uuid: str, model: Model) -> None:
+        """Disconnect a model, logging failures."""
+        try:
+            await model.disconnect()
+        except Exception as err:  # pylint: disable=W0703
+            self.logger.warning("Failed disconnecting from model '%s': %s", uuid, err)
+
+    async def acquire(self, uuid: str, connect: Callable[[], Awaitable[Model]]) -> Model:
+        """Take the connection of a model out of the pool, or open a new one.
+
+        :param str uuid: the uuid of the model
+        :param Callable connect: opens a new connection to the model
+        :return Model: the model connection, to be released or discarded once used
+        """
+        entry = self._models.pop(uuid, None)
+        if entry is not None:
+            model, used_at = entry
+            if self._healthy(model) and time.monotonic() - used_at < self.idle_timeout:
+                self.logger.debug("Reusing connection to model '%s'", uuid)
+                return model
+            await self._close(uuid, model)
+
+        return await connect()
+
+    async def release(self, uuid: str, model: Model) -> None:
+        """Put a model connection back into the pool, closing the least recently used.
+
+        :param str uuid: the uuid of the model
+        :param Model model: the model connection
+        """
+        self._models[uuid] = (model, time.monotonic())
+        self._models.move_to_end(uuid)
+        while len(self._models) > self.size:
+            evicted, (evicted_model, _) = self._models.popitem(last=False)
+            await self._close(evicted, evicted_model)
+
+    async def discard(self, uuid: str, model: Model) -> None:
+        """Close a model connection that failed, instead of putting it back.
+
+        :param str uuid: the uuid of the model
+        :param Model model: the model connection
+        """
+        await self._close(uuid, model)
+
+    async def prune(self, uuids: Iterable[str]) -> None:
+        """Close the connections of models that are gone or idle for too long.
+
+        :param Iterable[str] uuids: the uuids of the models that still exist
+        """
+        live = set(uuids)
+        now = time.monotonic()
+        for uuid, (model, used_at) in list(self._models.items()):
+            if uuid not in live or now - used_at >= self.idle_timeout:
+                del self._models[uuid]
+                await self._close(uuid, model)
+
+
+class ModelFilter:
+    """Select the models to collect from their name and owner.
+
+    Built once from the collection config, with its patterns compiled, and applied
+    to the model list before any model connection is opened.
+    """
+
+    def __init__(
+        self, include: Iterable[str] = (), exclude: Iterable[str] = (), owners: Iterable[str] = ()
+    ) -> None:
+        """Create a filter.
+
+        :param Iterable[str] include: patterns of the model names to collect, all models
+            if empty
+        :param Iterable[str] exclude: patterns of the model names to skip
+        :param Iterable[str] owners: the users whose models are collected, all users if
+            empty
+        """
+        self.include = [re.compile(pattern) for pattern in include]
+        self.exclude = [re.compile(pattern) for pattern in exclude]
+        self.owners = set(owners)
+
+    @classmethod
+    def from_config(cls, config: Any) -> "ModelFilter":
+        """Create a filter from the collection section of the config.
+
+        :param config: the exporter config
+        :return ModelFilter: the filter
+        """
+        return cls(
+            include=config["collection"]["include_models"].get(list),
+            exclude=config["collection"]["exclude_models"].get(list),
+            owners=config["collection"]["include_owners"].get(list),
+        )
+
+    def matches(self, name: str, owner: Optional[str] = None) -> bool:
+        """Check whether a model is collected.
+
+        :param str name: the name of the model
+        :param str owner: the owner of the model, None to ignore the owner filter
+        :return bool: True if the model is collected
+        """
+        if self.include and not any(pattern.search(name) for pattern in self.include):
+            return False
+        if any(pattern.search(name) for pattern in self.exclude):
+            return False
+        return owner is None or not self.owners or owner in self.owners
+
+    def apply(
+        self, model_uuids: Dict[str, str], owners: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Return the models that are collected.
+
+        :param dict model_uuids: the uuids of the models, by name
+        :param dict owners: the owners of the models, by uuid, None to ignore the
+            owner filter
+        :return dict: the uuids of the collected models, by name
+        """
+        if not self.include and not self.exclude and owners is None:
+            return model_uuids
+
+        return {
+            name: uuid
+            for name, uuid in model_uuids.items()
+            if self.matches(name, None if owners is None else owners.get(uuid, ""))
+        }
+
+
+class ModelScheduler:
+    """Deadline scheduler deciding which models are fetched in a collection cycle.
+
+    A model is fetched every interval of the first pattern matching its name, or
+    every default interval. The first deadline of a model is spread uniformly over
+    its interval and the following ones are jittered, so that fetches do not burst.
+    Deadlines are kept in a heap, so finding the due models and the time until the
+    next one does not scan every model.
+    """
+
+    def __init__(
+        self, default_interval: float, intervals: Iterable[Tuple[str, float]], jitter: float
+    ) -> None:
+        """Create a scheduler without any scheduled model.
+
+        :param float default_interval: seconds between two fetches of unmatched models
+        :param Iterable intervals: (pattern, seconds) pairs, the first pattern found in
+            the name of a model gives its interval
+        :param float jitter: maximum relative deviation of an interval, e.g. 0.1
+        """
+        self.default_interval = default_interval
+        self.patterns = [(re.compile(pattern), interval) for pattern, interval in intervals]
+        self.jitter = jitter
+        # next deadline of the scheduled models, by uuid, and the same in a heap that
+        # may hold outdated entries
+        self._deadlines: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._known: Set[str] = set()
+        self._intervals: Dict[str, float] = {}
+
+    @classmethod
+    def from_config(cls, config: Any) -> "ModelScheduler":
+        """Create a scheduler from the exporter and collection sections of the config.
+
+        :param config: the exporter config
+        :return ModelScheduler: the scheduler
+        """
+        return cls(
+            default_interval=config["exporter"]["collect_interval"].get(int) * 60,
+            intervals=[
+                (entry["match"], entry["interval"] * 60)
+                for entry in config["collection"]["model_intervals"].get(MODEL_INTERVALS_TEMPLATE)
+            ],
+            jitter=config["collection"]["interval_jitter"].get(int) / 100,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Return whether models have their own intervals."""
+        return bool(self.patterns)
+
+    def interval(self, name: str) -> float:
+        """Return the seconds between two fetches of a model.
+
+        :param str name: the name of the model
+        """
+        interval = self._intervals.get(name)
+        if interval is None:
+            interval = next(
+                (seconds for pattern, seconds in self.patterns if pattern.search(name)),
+                self.default_interval,
+            )
+            self._intervals[name] = interval
+        return interval
+
+    def due(self, model_uuids: Dict[str, str]) -> Dict[str, str]:
+        """Return the models to fetch now, and forget the ones that no longer exist.
+
+        Due models stay due until they are scheduled again, so a model whose fetch did
+        not complete is fetched by the next cycle.
+
+        :param dict model_uuids: the uuids of all models, by name
+        :return dict: the uuids of the due models, by name
+        """
+        if not self.enabled:
+            return model_uuids
+
+        live = set(model_uuids.values())
+        for uuid in set(self._deadlines) - live:
+            del self._deadlines[uuid]
+        self._known &= live
+
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, uuid = heapq.heappop(self._heap)
+            if self._deadlines.get(uuid) == deadline:
+                del self._deadlines[uuid]
+
+        return {name: uuid for name, uuid in model_uuids.items() if uuid not in self._deadlines}
+
+    def schedule(self, name: str, uuid: str) -> None:
+        """Set the next deadline of a model that was just fetched.
+
+        :param str name: the name of the model
+        :param str uuid: the uuid of the model
+        """
+        if not self.enabled:
+            return
+
+        interval = self.interval(name)
+        if uuid in self._known:
+            delay = interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        else:
+            delay = interval * random.uniform(self.jitter, 1)
+            self._known.add(uuid)
+        deadline = time.monotonic() + delay
+        self._deadlines[uuid] = deadline
+        heapq.heappush(self._heap, (deadline, uuid))
+
+    def seconds_until_due(self) -> Optional[float]:
+        """Return the seconds until the next model is due, None if none is scheduled."""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+
+        return max(self._heap[0][0] - time.monotonic(), 0.0)
@@ -0,0 +1,288 @@
+"""Replay module."""
+
+import asyncio
+import copy
+import gzip
+import json
+import os
+import re
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Pattern, Tuple
+
+from juju.client.connection import Monitor
+from juju.client.facade import TypeEncoder
+
+# keys whose values are replaced in recorded statuses
+REDACTED_KEYS = re.compile(r"(?i)password|secret|token|credential|cacert|private")
+REDACTED = "<redacted>"
+
+logger = getLogger(__name__)
+
+
+def redact(value: Any, pattern: Pattern = REDACTED_KEYS) -> Any:
+    """Return a copy of a JSON value whose sensitive entries are redacted.
+
+    :param value: the JSON value
+    :param Pattern pattern: matches the keys whose values are redacted
+    :return: the redacted copy
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if pattern.search(key) else redact(item, pattern)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item, pattern) for item in value]
+    return value
+
+
+class Recording:
+    """Model list and model statuses of a controller, stored in a directory.
+
+    The model list is kept in models.json and the status of each model in
+    status/<uuid>.json.gz. Each file is replaced atomically, so a recording can be
+    refreshed by a running exporter while it is replayed elsewhere.
+    """
+
+    def __init__(self, directory: str) -> None:
+        """Use a recording directory, which does not need to exist yet.
+
+        :param str directory: the recording directory
+        """
+        self.directory = directory
+
+    def _status_path(self, uuid: str) -> str:
+        return os.path.join(self.directory, "status", f"{uuid}.json.gz")
+
+    @staticmethod
+    def _write(path: str, payload: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as tmp_file:
+            tmp_file.write(payload)
+        os.replace(tmp_path, path)
+
+    def save_models(self, model_uuids: Dict[str, str]) -> None:
+        """Record the model list.
+
+        :param dict model_uuids: the uuids of the models, by name
+        """
+        self._write(os.path.join(self.directory, "models.json"), json.dumps(model_uuids).encode())
+
+    def save_status(self, uuid: str, status: Any) -> None:
+        """Record the redacted status of a model.
+
+        :param str uuid: the uuid of the model
+        :param status: the FullStatus of the model, or its JSON representation
+        """
+        data = json.loads(json.dumps(status, cls=TypeEncoder))
+        self._write(
+            self._status_path(uuid),
+            gzip.compress(json.dumps(redact(data), separators=(",", ":")).encode()),
+        )
+
+    def load_models(self) -> Dict[str, str]:
+        """Return the recorded model list.
+
+        :raises OSError: if no model list was recorded
+        """
+        with open(os.path.join(self.directory, "models.json"), encoding="utf-8") as models:
+            return json.load(models)
+
+    def load_status(self, uuid: str) -> Dict[str, Any]:
+        """Return the recorded status of a model.
+
+        :param str uuid: the uuid of the model
+        :raises OSError: if no status was recorded for the model
+        """
+        with gzip.open(self._status_path(uuid), "rb") as status:
+            return json.loads(status.read())
+
+    def __iter__(self) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """Yield the name, uuid and status of every recorded model."""
+        for name, uuid in self.load_models().items():
+            yield name, uuid, self.load_status(uuid)
+
+
+class RecordingModel:
+    """Model connection recording every status it fetches."""
+
+    def __init__(self, model: Any, uuid: str, recording: Recording) -> None:
+        """Wrap a model connection.
+
+        :param Model model: the model connection
+        :param str uuid: the uuid of the model
+        :param Recording recording: where statuses are recorded
+        """
+        self._model = model
+        self._uuid = uuid
+        self._recording = recording
+
+    def __getattr__(self, name: str) -> Any:
+        """Forward everything else to the model connection."""
+        return getattr(self._model, name)
+
+    async def get_status(self) -> Any:
+        """Fetch the status of the model and record it."""
+        status = await self._model.get_status()
+        try:
+            self._recording.save_status(self._uuid, status)
+        except (OSError, TypeError, ValueError) as err:
+            logger.warning("Could not record the status of model '%s': %s", self._uuid, err)
+        return status
+
+
+class RecordingController:
+    """Controller connection recording the model list and statuses it fetches."""
+
+    def __init__(self, controller: Any, recording: Recording) -> None:
+        """Wrap a controller connection.
+
+        :param Controller controller: the controller connection
+        :param Recording recording: where the model list and statuses are recorded
+        """
+        self._controller = controller
+        self._recording = recording
+
+    def __getattr__(self, name: str) -> Any:
+        """Forward everything else to the controller connection."""
+        return getattr(self._controller, name)
+
+    async def model_uuids(self) -> Dict[str, str]:
+        """Fetch the model list and record it."""
+        model_uuids = await self._controller.model_uuids()
+        try:
+            self._recording.save_models(model_uuids)
+        except OSError as err:
+            logger.warning("Could not record the model list: %s", err)
+        return model_uuids
+
+    async def get_model(self, uuid: str) -> RecordingModel:
+        """Connect to a model whose statuses are recorded.
+
+        :param str uuid: the uuid of the model
+        """
+        return RecordingModel(await self._controller.get_model(uuid), uuid, self._recording)
+
+
+class _ReplayConnection:
+    """Connection whose receiver is always running."""
+
+    class _Monitor:  # pylint: disable=R0903
+        status = Monitor.CONNECTED
+
+    monitor = _Monitor()
+
+
+class ReplayModel:
+    """Model connection answering with a recorded status."""
+
+    def __init__(self, uuid: str, controller: "ReplayController") -> None:
+        """Create a connection to a recorded model.
+
+        :param str uuid: the uuid of the model
+        :param ReplayController controller: the controller replaying the recording
+        """
+        self.uuid = uuid
+        self._controller = controller
+        self._connected = True
+
+    def is_connected(self) -> bool:
+        """Return whether the connection is open."""
+        return self._connected
+
+    @staticmethod
+    def connection() -> _ReplayConnection:
+        """Return the connection, which never drops."""
+        return _ReplayConnection()
+
+    def add_observer(self, *_: Any, **__: Any) -> None:
+        """Accept observers, which are never called since a recording does not change."""
+
+    async def get_status(self) -> Dict[str, Any]:
+        """Return a fresh copy of the recorded status after the replay latency."""
+        async with self._controller.request():
+            return copy.deepcopy(self._controller.status(self.uuid))
+
+    async def disconnect(self) -> None:
+        """Close the connection."""
+        self._connected = False
+
+
+class ReplayController:
+    """Controller connection replaying a recording instead of contacting a controller.
+
+    Every request waits for the configured latency, and at most `concurrency`
+    requests are served at once, so that production-size cycles can be reproduced
+    offline.
+    """
+
+    def __init__(self, recording: Recording, latency: float = 0, concurrency: int = 0) -> None:
+        """Create a connection to a recording.
+
+        :param Recording recording: the recording to replay
+        :param float latency: seconds each request takes
+        :param int concurrency: the number of requests served at once, 0 for no limit
+        """
+        self.recording = recording
+        self.latency = latency
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._statuses: Dict[str, Dict[str, Any]] = {}
+        self._connected = False
+
+    @asynccontextmanager
+    async def request(self) -> AsyncIterator[None]:
+        """Simulate the latency and concurrency limit of a request."""
+        if not self.concurrency:
+            await asyncio.sleep(self.latency)
+            yield
+            return
+
+        if self._semaphore is None:
+            # created here to be bound to the running loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            await asyncio.sleep(self.latency)
+            yield
+
+    def status(self, uuid: str) -> Dict[str, Any]:
+        """Return the recorded status of a model, loaded once.
+
+        :param str uuid: the uuid of the model
+        """
+        if uuid not in self._statuses:
+            self._statuses[uuid] = self.recording.load_status(uuid)
+        return self._statuses[uuid]
+
+    def is_connected(self) -> bool:
+        """Return whether the connection is open."""
+        return self._connected
+
+    @staticmethod
+    def connection() -> _ReplayConnection:
+        """Return the connection, which never drops."""
+        return _ReplayConnection()
+
+    async def connect(self, **_: Any) -> None:
+        """Open the connection, whatever the endpoint and credentials."""
+        async with self.request():
+            self._connected = True
+
+    async def disconnect(self) -> None:
+        """Close the connection."""
+        self._connected = False
+
+    async def model_uuids(self) -> Dict[str, str]:
+        """Return the recorded model list."""
+        async with self.request():
+            return self.recording.load_models()
+
+    async def get_model(self, uuid: str) -> ReplayModel:
+        """Connect to a recorded model.
+
+        :param str uuid: the uuid of the model
+        """
+        async with self.request():
+            return ReplayModel(uuid, self)
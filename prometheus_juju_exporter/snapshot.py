@@ -0,0 +1,80 @@
+"""Snapshot module."""
+
+import gzip
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str, data: Dict[str, Any], saved_at: float) -> None:
+    """Write the gauge data of a collection cycle to a file, atomically.
+
+    The data is written to a temporary file in the same directory, which then
+    replaces the snapshot, so a crash never leaves a partial snapshot behind.
+    Rows are stored as flat lists of their label values followed by their value.
+
+    :param str path: the snapshot file
+    :param dict data: the gauge data, as returned by ExporterDaemon.collect
+    :param float saved_at: the unix time of the collection
+    :raises OSError: if the snapshot cannot be written
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": saved_at,
+        "gauges": {
+            gauge_name: {
+                "gauge_desc": values["gauge_desc"],
+                "labels": list(values["labels"]),
+                "rows": [[*labels, value] for labels, value in values["labelvalues_update"]],
+            }
+            for gauge_name, values in data.items()
+        },
+    }
+    payload = gzip.compress(json.dumps(snapshot, separators=(",", ":")).encode(), compresslevel=6)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(payload)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """Read the gauge data saved by save_snapshot.
+
+    :param str path: the snapshot file
+    :return tuple: the unix time of the collection and the gauge data, or None if
+        there is no snapshot
+    :raises ValueError: if the snapshot is corrupted or has another version
+    """
+    try:
+        with gzip.open(path, "rb") as snapshot_file:
+            snapshot = json.loads(snapshot_file.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError) as err:
+        raise ValueError(f"unreadable snapshot: {err}") from err
+
+    try:
+        if snapshot["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {snapshot['version']}")
+        data = {
+            gauge_name: {
+                "gauge_desc": values["gauge_desc"],
+                "labels": values["labels"],
+                "labelvalues_update": [(tuple(row[:-1]), row[-1]) for row in values["rows"]],
+            }
+            for gauge_name, values in snapshot["gauges"].items()
+        }
+        return float(snapshot["saved_at"]), data
+    except (KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f"malformed snapshot: {err!r}") from err
@@ -0,0 +1,333 @@
+"""Local stand-in for a Juju controller, serving synthetic models over the Juju API.
+
+It speaks enough of the websocket API for libjuju to log in, list the models,
+connect to each of them and fetch their FullStatus, so that the whole collection
+path, including connection handling and frame sizes, can be exercised offline.
+
+Usage:
+    python -m tests.benchmark.fake_controller --hosts 10000 --port 17070 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import datetime
+import ipaddress
+import json
+import random
+import ssl
+import tempfile
+import uuid as uuid_module
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from juju.client.connection import client_facade_versions
+from websockets.asyncio.server import Server, ServerConnection, serve
+
+from tests.benchmark.synthetic import JUJU_VERSION, generate_controller_status
+
+Payload = List[Tuple[str, str, Dict[str, Any]]]
+Handler = Callable[[ServerConnection, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+CONTROLLER_UUID = "deadbeef-0bad-400d-8000-4b1d0000c0de"
+CONTROLLER_MODEL_UUID = "deadbeef-0bad-400d-8000-4b1d00000000"
+USER_TAG = "user-admin"
+
+
+class RPCError(Exception):
+    """Error returned to the client instead of a response."""
+
+
+def generate_certificate() -> Tuple[str, str]:
+    """Return a self-signed certificate for 127.0.0.1 and its private key, in PEM."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "juju-fake-controller")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(
+            x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+            critical=False,
+        )
+        .sign(key, hashes.SHA256())
+    )
+    return (
+        certificate.public_bytes(serialization.Encoding.PEM).decode(),
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ).decode(),
+    )
+
+
+class FakeController:  # pylint: disable=R0902
+    """Juju controller serving the models of a synthetic payload.
+
+    Like a real controller, it also has an empty 'controller' model, which gives
+    clients access to the controller addresses. Every request is answered after
+    `latency` seconds. FullStatus fails for the models in `failing_models`, and for
+    any model with probability `failure_rate`.
+    Requests and response bytes are counted by request name in `calls` and
+    `bytes_sent`, and the largest frame sent is kept in `max_frame`.
+    """
+
+    def __init__(
+        self,
+        payload: Payload,
+        latency: float = 0.0,
+        failure_rate: float = 0.0,
+        failing_models: Iterable[str] = (),
+        seed: int = 0,
+    ) -> None:
+        """Create a controller that is not listening yet.
+
+        :param list payload: the (name, uuid, status) of every model
+        :param float latency: seconds before each response
+        :param float failure_rate: probability of a FullStatus failure
+        :param Iterable failing_models: names of the models whose FullStatus always fails
+        :param int seed: seed of the injected failures
+        """
+        self.models = {CONTROLLER_MODEL_UUID: ("controller", {"machines": {}, "applications": {}})}
+        self.models.update((uuid, (name, status)) for name, uuid, status in payload)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failing_models = set(failing_models)
+        self.calls: Counter = Counter()
+        self.bytes_sent: Counter = Counter()
+        self.max_frame = 0
+        self.cacert, self._key = generate_certificate()
+        self._rng = random.Random(seed)
+        self._server: Optional[Server] = None
+        self._handlers: Dict[Tuple[str, str], Handler] = {
+            ("Admin", "Login"): self._login,
+            ("Pinger", "Ping"): self._empty,
+            ("ModelManager", "ListModelSummaries"): self._list_model_summaries,
+            ("ModelManager", "ModelInfo"): self._model_info,
+            ("ModelConfig", "ModelGet"): self._model_get,
+            ("Client", "WatchAll"): self._watch_all,
+            ("AllWatcher", "Next"): self._next,
+            ("AllWatcher", "Stop"): self._empty,
+            ("Client", "FullStatus"): self._full_status,
+            ("Controller", "ControllerAPIInfoForModels"): self._api_info,
+        }
+
+    @property
+    def endpoint(self) -> str:
+        """Return the host:port endpoint of the controller."""
+        if self._server is None:
+            raise RuntimeError("The fake controller is not started")
+        host, port = list(self._server.sockets)[0].getsockname()[:2]
+        return f"{host}:{port}"
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        with tempfile.NamedTemporaryFile("w", suffix=".pem") as pem:
+            pem.write(self.cacert + self._key)
+            pem.flush()
+            context.load_cert_chain(pem.name)
+        return context
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """Start listening.
+
+        :param str host: the address to listen on
+        :param int port: the port to listen on, 0 for any free port
+        """
+        self._server = await serve(
+            self._serve, host, port, ssl=self._ssl_context(), max_size=None, compression=None
+        )
+
+    async def close(self) -> None:
+        """Stop listening and close every connection."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, connection: ServerConnection) -> None:
+        """Answer the requests of a connection, each in its own task."""
+        tasks = set()
+        try:
+            async for message in connection:
+                task = asyncio.ensure_future(self._answer(connection, json.loads(message)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _answer(self, connection: ServerConnection, request: Dict[str, Any]) -> None:
+        name = f"{request['type']}.{request['request']}"
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        reply: Dict[str, Any] = {"request-id": request["request-id"]}
+        handler = self._handlers.get((request["type"], request["request"]))
+        try:
+            if handler is None:
+                raise RPCError(f"no such request - method {name} is not implemented")
+            reply["response"] = await handler(connection, request)
+        except RPCError as err:
+            reply.update({"error": str(err), "error-code": "", "response": {}})
+
+        frame = json.dumps(reply, separators=(",", ":"))
+        self.bytes_sent[name] += len(frame)
+        self.max_frame = max(self.max_frame, len(frame))
+        await connection.send(frame)
+
+    @staticmethod
+    def _model_uuid(connection: ServerConnection) -> Optional[str]:
+        """Return the uuid of the model a connection is for, None for the controller."""
+        parts = connection.request.path.strip("/").split("/") if connection.request else []
+        return parts[1] if len(parts) == 3 and parts[0] == "model" else None
+
+    def _model(self, uuid: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        if uuid not in self.models:
+            raise RPCError(f'model "{uuid}" not found')
+        return self.models[uuid]
+
+    async def _empty(self, *_: Any) -> Dict[str, Any]:
+        return {}
+
+    async def _login(self, connection: ServerConnection, _: Dict[str, Any]) -> Dict[str, Any]:
+        uuid = self._model_uuid(connection)
+        response = {
+            "server-version": JUJU_VERSION,
+            "controller-tag": f"controller-{CONTROLLER_UUID}",
+            "servers": [],
+            "facades": [
+                {"name": name, "versions": list(versions)}
+                for name, versions in client_facade_versions.items()
+            ],
+            "user-info": {
+                "identity": USER_TAG,
+                "display-name": "admin",
+                "controller-access": "superuser",
+                "model-access": "admin" if uuid else "",
+            },
+        }
+        if uuid is not None:
+            self._model(uuid)
+            response["model-tag"] = f"model-{uuid}"
+        return response
+
+    def _model_summary(self, uuid: str) -> Dict[str, Any]:
+        name, _ = self.models[uuid]
+        return {
+            "name": name,
+            "uuid": uuid,
+            "type": "iaas",
+            "controller-uuid": CONTROLLER_UUID,
+            "owner-tag": USER_TAG,
+            "life": "alive",
+            "cloud-tag": "cloud-fake",
+            "cloud-region": "local",
+            "provider-type": "manual",
+            "default-series": "jammy",
+            "status": {"status": "available", "info": ""},
+            "user-access": "admin",
+        }
+
+    async def _list_model_summaries(self, *_: Any) -> Dict[str, Any]:
+        return {"results": [{"result": self._model_summary(uuid)} for uuid in self.models]}
+
+    def _machine_summaries(self, uuid: str) -> List[Dict[str, Any]]:
+        """Return the machine summaries of a model, containers included."""
+        _, status = self.models[uuid]
+        hosts = []
+        for key, machine in status["machines"].items():
+            hosts.append((key, machine))
+            hosts.extend(machine.get("containers", {}).items())
+        return [
+            {
+                "id": key,
+                "display-name": host.get("hostname") or "",
+                "instance-id": host.get("instance-id") or "",
+                "status": host["agent-status"]["status"],
+            }
+            for key, host in hosts
+        ]
+
+    async def _model_info(self, _: ServerConnection, request: Dict[str, Any]) -> Dict[str, Any]:
+        results: List[Dict[str, Any]] = []
+        for entity in request["params"].get("entities", []):
+            uuid = entity["tag"].split("-", 1)[1]
+            if uuid not in self.models:
+                results.append({"error": {"message": f'model "{uuid}" not found', "code": ""}})
+                continue
+            results.append(
+                {
+                    "result": dict(
+                        self._model_summary(uuid), users=[], machines=self._machine_summaries(uuid)
+                    )
+                }
+            )
+        return {"results": results}
+
+    async def _model_get(self, *_: Any) -> Dict[str, Any]:
+        return {"config": {"name": {"source": "model", "value": "fake"}}}
+
+    async def _watch_all(self, *_: Any) -> Dict[str, Any]:
+        return {"watcher-id": str(uuid_module.uuid4())}
+
+    async def _next(self, connection: ServerConnection, _: Dict[str, Any]) -> Dict[str, Any]:
+        # the first call returns the initial state, the following ones block like a
+        # watcher of a model that never changes
+        watched = getattr(connection, "fake_watched", False)
+        if watched:
+            await asyncio.Future()
+        connection.fake_watched = True  # type: ignore[attr-defined]
+        return {"deltas": []}
+
+    async def _api_info(self, *_: Any) -> Dict[str, Any]:
+        return {"results": [{"addresses": [self.endpoint], "cacert": self.cacert}]}
+
+    async def _full_status(
+        self, connection: ServerConnection, _: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        name, status = self._model(self._model_uuid(connection))
+        if name in self.failing_models or self._rng.random() < self.failure_rate:
+            raise RPCError(f"injected failure of model {name}")
+        return status
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run a fake controller from the command line until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=1000)
+    parser.add_argument("--models", type=int, default=100)
+    parser.add_argument("--port", type=int, default=17070)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    async def run() -> None:
+        controller = FakeController(
+            list(generate_controller_status(args.hosts, models=args.models)),
+            latency=args.latency,
+            failure_rate=args.failure_rate,
+        )
+        await controller.start(port=args.port)
+        print(f"Listening on {controller.endpoint}, controller_cacert:")
+        print(json.dumps(controller.cacert))
+        await asyncio.Future()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
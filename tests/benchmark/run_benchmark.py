@@ -0,0 +1,349 @@
+"""Benchmark the collector and registry update path against synthetic controllers.
+
+Runs offline, without a Juju controller. Every stage is run twice for each size:
+once to measure its duration and once under tracemalloc to measure its peak memory.
+
+Usage:
+    python -m tests.benchmark.run_benchmark --hosts 1000 10000 100000
+    python -m tests.benchmark.run_benchmark --output results.json
+    python -m tests.benchmark.run_benchmark --baseline results.json --tolerance 0.2
+    python -m tests.benchmark.run_benchmark --replay recording/example_cloud
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from prometheus_client import generate_latest
+
+from tests.benchmark.fake_controller import FakeController
+from tests.benchmark.synthetic import VIRT_MAC_PREFIXES, generate_controller_status
+
+# run against the default configuration unless told otherwise
+os.environ.setdefault("PROMETHEUSJUJUEXPORTERDIR", os.path.dirname(os.path.abspath(__file__)))
+
+from prometheus_juju_exporter.collector import Collector  # noqa: E402 pylint: disable=C0413
+from prometheus_juju_exporter.config import Config  # noqa: E402 pylint: disable=C0413
+from prometheus_juju_exporter.exporter import ExporterDaemon  # noqa: E402 pylint: disable=C0413
+from prometheus_juju_exporter.gauges import (  # noqa: E402 pylint: disable=C0413
+    MACHINE_GAUGE_NAME,
+)
+from prometheus_juju_exporter.replay import Recording  # noqa: E402 pylint: disable=C0413
+
+Payload = List[Tuple[str, str, Dict[str, Any]]]
+
+
+class Stage(NamedTuple):
+    """A benchmarked stage: `run` is measured on the state returned by `setup`."""
+
+    name: str
+    setup: Callable[[Payload], Any]
+    run: Callable[[Any, Payload], Any]
+
+
+def _collector() -> Collector:
+    """Return a collector configured like a typical production deployment."""
+    config = Config().get_config()
+    config["detection"]["virt_macs"].set(VIRT_MAC_PREFIXES)
+    config["detection"]["match_interfaces"].set(r"^(en[os]|eth)\d+|enp\d+s\d+|enx[0-9a-f]+")
+    return Collector()
+
+
+class _FakeModel:
+    """Model whose status is a fresh copy of a payload entry, like a parsed response."""
+
+    def __init__(self, status: Dict[str, Any]) -> None:
+        self._status = status
+
+    async def get_status(self) -> Dict[str, Any]:
+        return copy.deepcopy(self._status)
+
+    async def disconnect(self) -> None:
+        pass
+
+
+class _FakeController:
+    """Controller serving the models of a payload."""
+
+    def __init__(self, payload: Payload) -> None:
+        self._names = {name: uuid for name, uuid, _ in payload}
+        self._statuses = {uuid: status for _, uuid, status in payload}
+
+    async def model_uuids(self) -> Dict[str, str]:
+        return dict(self._names)
+
+    async def get_model(self, uuid: str) -> _FakeModel:
+        return _FakeModel(self._statuses[uuid])
+
+
+async def _connected(**_: Any) -> None:
+    """Stand in for Collector._connect_controller."""
+
+
+def _polling_collector(payload: Payload) -> Collector:
+    collector = _collector()
+    collector.config["collection"]["max_concurrent_models"].set(10)
+    collector.controller = _FakeController(payload)
+    collector._connect_controller = _connected  # type: ignore[method-assign]
+    return collector
+
+
+def _websocket_collector(payload: Payload) -> Tuple[Collector, FakeController]:
+    """Return a collector and a fake controller serving the payload, not started yet."""
+    fake_controller = FakeController(payload)
+    collector = _collector()
+    collector.config["collection"]["max_concurrent_models"].set(10)
+    return collector, fake_controller
+
+
+async def _collect_over_websocket(collector: Collector, fake_controller: FakeController) -> None:
+    """Run a collection cycle against the fake controller, through libjuju."""
+    await fake_controller.start()
+    try:
+        collector.target = dict(
+            collector.target, endpoints=[fake_controller.endpoint], cacert=fake_controller.cacert
+        )
+        await collector.get_stats()
+        await collector.model_pool.prune([])
+        await collector.controller.disconnect()
+    finally:
+        await fake_controller.close()
+
+
+def _lightweight_collector(payload: Payload) -> Tuple[Collector, FakeController]:
+    """Return a lightweight collector that already collected the payload once."""
+    collector, fake_controller = _websocket_collector(payload)
+    collector.lightweight_mode = True
+    asyncio.run(_collect_over_websocket(collector, fake_controller))
+    return collector, fake_controller
+
+
+def _classify(collector: Collector, payload: Payload) -> None:
+    for _, _, status in payload:
+        collector.classifier.classify_all(status["machines"])
+
+
+def _rows(collector: Collector, payload: Payload) -> List[Any]:
+    return [collector._get_model_rows(uuid, status, name) for name, uuid, status in payload]
+
+
+def _cached_collector(payload: Payload) -> Collector:
+    collector = _collector()
+    _rows(collector, payload)
+    return collector
+
+
+def _data(payload: Payload) -> Dict[str, Any]:
+    collector = _collector()
+    collector.refresh_cache()
+    for model_rows in _rows(collector, payload):
+        collector.data[MACHINE_GAUGE_NAME]["labelvalues_update"].extend(
+            (labels, value) for _, labels, value in model_rows.machines
+        )
+        collector._add_status_rows(model_rows)
+    return collector.data
+
+
+def _fresh_daemon(payload: Payload) -> Tuple[ExporterDaemon, Dict[str, Any]]:
+    return ExporterDaemon(), _data(payload)
+
+
+def _updated_daemon(payload: Payload) -> Tuple[ExporterDaemon, Dict[str, Any]]:
+    daemon, data = _fresh_daemon(payload)
+    daemon.update_registry(data)
+    return daemon, data
+
+
+def _rendered_daemon(payload: Payload) -> Tuple[ExporterDaemon, Dict[str, Any]]:
+    daemon, data = _updated_daemon(payload)
+    daemon.render_exposition()
+    return daemon, data
+
+
+STAGES = [
+    Stage("classify", lambda payload: _collector(), _classify),
+    Stage("rows", lambda payload: _collector(), _rows),
+    Stage("rows_cached", _cached_collector, _rows),
+    Stage(
+        "get_stats", _polling_collector, lambda collector, _: asyncio.run(collector.get_stats())
+    ),
+    Stage(
+        "get_stats_websocket",
+        _websocket_collector,
+        lambda state, _: asyncio.run(_collect_over_websocket(*state)),
+    ),
+    Stage(
+        "get_stats_lightweight",
+        _lightweight_collector,
+        lambda state, _: asyncio.run(_collect_over_websocket(*state)),
+    ),
+    Stage("update_registry", _fresh_daemon, lambda state, _: state[0].update_registry(state[1])),
+    Stage(
+        "update_registry_unchanged",
+        _updated_daemon,
+        lambda state, _: state[0].update_registry(state[1]),
+    ),
+    Stage("render", _updated_daemon, lambda state, _: generate_latest(state[0]._registry)),
+    Stage("render_exposition", _updated_daemon, lambda state, _: state[0].render_exposition()),
+    Stage("scrape", _rendered_daemon, lambda state, _: state[0].exposition.response("gzip")),
+]
+
+
+def _measure(stage: Stage, payload: Payload) -> Tuple[float, int]:
+    """Return the duration in seconds and the peak memory in bytes of a stage."""
+    state = stage.setup(payload)
+    start = time.perf_counter()
+    stage.run(state, payload)
+    duration = time.perf_counter() - start
+
+    state = stage.setup(payload)
+    tracemalloc.start()
+    stage.run(state, payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def _generate(hosts: int, **kwargs: Any) -> Tuple[Payload, int]:
+    """Generate the payload of a controller and return it with its memory footprint."""
+    tracemalloc.start()
+    payload = list(generate_controller_status(hosts, **kwargs))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return payload, size
+
+
+def count_hosts(payload: Payload) -> int:
+    """Return the number of machines and containers in a payload."""
+    return sum(
+        len(machine["containers"]) + 1
+        for _, _, status in payload
+        for machine in status["machines"].values()
+    )
+
+
+def run_benchmark(hosts: int, **kwargs: Any) -> List[Dict[str, Any]]:
+    """Benchmark every stage against a synthetic controller with about `hosts` hosts.
+
+    :param int hosts: the number of machines and containers to generate
+    :param kwargs: passed on to generate_controller_status
+    :return list: one result per stage, plus a 'status' row with the memory size of
+        the payload
+    """
+    payload, payload_size = _generate(hosts, **kwargs)
+    return _run_stages(payload, payload_size)
+
+
+def run_replay_benchmark(directory: str) -> List[Dict[str, Any]]:
+    """Benchmark every stage against a controller recorded with the 'record' transport.
+
+    :param str directory: the recording directory of the controller
+    :return list: one result per stage, plus a 'status' row with the memory size of
+        the payload
+    """
+    tracemalloc.start()
+    payload = list(Recording(directory))
+    payload_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return _run_stages(payload, payload_size)
+
+
+def _run_stages(payload: Payload, payload_size: int) -> List[Dict[str, Any]]:
+    """Measure every stage against a payload."""
+    host_count = count_hosts(payload)
+    results = [
+        {"hosts": host_count, "stage": "status", "seconds": 0.0, "peak_bytes": payload_size}
+    ]
+    for stage in STAGES:
+        seconds, peak = _measure(stage, payload)
+        results.append(
+            {"hosts": host_count, "stage": stage.name, "seconds": seconds, "peak_bytes": peak}
+        )
+
+    return results
+
+
+def find_regressions(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Compare results with a baseline and describe the stages that got slower.
+
+    :param list results: the results of this run
+    :param list baseline: the results of a previous run
+    :param float tolerance: the allowed slowdown, e.g. 0.2 for 20%
+    :return list: a message per regressed stage
+    """
+    previous = {(result["hosts"], result["stage"]): result["seconds"] for result in baseline}
+    regressions = []
+    for result in results:
+        reference = previous.get((result["hosts"], result["stage"]))
+        if reference and result["seconds"] > reference * (1 + tolerance):
+            regressions.append(
+                f"{result['stage']} at {result['hosts']} hosts: "
+                f"{result['seconds']:.3f}s, baseline {reference:.3f}s"
+            )
+
+    return regressions
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    """Format results as a table."""
+    lines = [f"{'hosts':>8} {'stage':<26} {'seconds':>9} {'hosts/s':>11} {'peak MiB':>9}"]
+    for result in results:
+        rate = result["hosts"] / result["seconds"] if result["seconds"] else 0
+        lines.append(
+            f"{result['hosts']:>8} {result['stage']:<26} {result['seconds']:>9.3f} "
+            f"{rate:>11.0f} {result['peak_bytes'] / 2**20:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--models", type=int, default=100)
+    parser.add_argument("--containers", type=int, default=1, help="containers per machine")
+    parser.add_argument("--interfaces", type=int, default=4, help="interfaces per machine")
+    parser.add_argument("--virtual-ratio", type=float, default=0.5)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--replay", help="benchmark this recording instead of synthetic ones")
+    args = parser.parse_args(argv)
+
+    results = run_replay_benchmark(args.replay) if args.replay else []
+    for hosts in [] if args.replay else args.hosts:
+        results.extend(
+            run_benchmark(
+                hosts,
+                models=args.models,
+                containers=args.containers,
+                interfaces=args.interfaces,
+                virtual_ratio=args.virtual_ratio,
+            )
+        )
+    print(format_results(results))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            regressions = find_regressions(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
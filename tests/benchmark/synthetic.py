@@ -0,0 +1,151 @@
+"""Generate synthetic FullStatus payloads for benchmarking the exporter offline."""
+
+import math
+import random
+from typing import Any, Dict, Iterator, Tuple
+
+VIRT_MAC_PREFIXES = ["52:54:00", "fa:16:3e", "06:f1:3a", "00:0d:3a", "00:50:56"]
+METAL_MAC_PREFIXES = ["00:25:90", "3c:ec:ef", "b8:ca:3a", "ac:1f:6b"]
+INTERFACE_NAMES = ["eno{}", "enp{}s0", "eth{}", "br-eth{}", "virbr{}", "tap{}"]
+STATUS_SINCE = "24 Nov 2022 13:21:25Z"
+JUJU_VERSION = "3.1.8"
+
+
+def _mac_address(rng: random.Random, prefix: str) -> str:
+    """Return a random MAC address with the given prefix."""
+    return prefix + "".join(f":{rng.randrange(256):02x}" for _ in range(3))
+
+
+def _network_interfaces(rng: random.Random, count: int, virtual: bool) -> Dict[str, Any]:
+    """Return the network interfaces of a machine.
+
+    Virtual machines get a virtual MAC on their first interface only, so that the
+    classifier has to look past non-matching interfaces.
+    """
+    interfaces = {}
+    for index in range(count):
+        name = INTERFACE_NAMES[index % len(INTERFACE_NAMES)].format(index)
+        prefixes = VIRT_MAC_PREFIXES if virtual and index == 0 else METAL_MAC_PREFIXES
+        interfaces[name] = {
+            "ip-addresses": [f"10.{index}.{rng.randrange(256)}.{rng.randrange(256)}"],
+            "mac-address": _mac_address(rng, rng.choice(prefixes)),
+            "gateway": f"10.{index}.0.1",
+            "space": "alpha",
+            "is-up": True,
+        }
+    return interfaces
+
+
+def _host(rng: random.Random, hostname: str, down_ratio: float) -> Dict[str, Any]:
+    """Return the status fields shared by machines and containers."""
+    return {
+        "agent-status": {
+            "status": "down" if rng.random() < down_ratio else "started",
+            "since": STATUS_SINCE,
+            "version": JUJU_VERSION,
+        },
+        "hostname": hostname,
+        "dns-name": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}",
+        "instance-id": f"{hostname}-instance",
+        "instance-status": {"status": "running", "message": "Deployed", "since": STATUS_SINCE},
+        "modification-status": {"current": "idle", "since": STATUS_SINCE},
+        "series": "jammy",
+        "constraints": "arch=amd64",
+        "hardware": "arch=amd64 cores=8 mem=32768M",
+    }
+
+
+def _unit(rng: random.Random, machine: str, down_ratio: float) -> Dict[str, Any]:
+    """Return the status of a unit without subordinates."""
+    down = rng.random() < down_ratio
+    return {
+        "workload-status": {
+            "status": "blocked" if down else "active",
+            "info": "",
+            "since": STATUS_SINCE,
+        },
+        "agent-status": {"status": "lost" if down else "idle", "since": STATUS_SINCE},
+        "machine": machine,
+        "leader": machine == "0",
+        "subordinates": {},
+    }
+
+
+def _applications(rng: random.Random, machines: int, down_ratio: float) -> Dict[str, Any]:
+    """Return a principal application with a unit on every machine, each with a subordinate."""
+    units = {}
+    for machine_id in range(machines):
+        unit = _unit(rng, str(machine_id), down_ratio)
+        unit["subordinates"][f"telegraf/{machine_id}"] = _unit(rng, str(machine_id), down_ratio)
+        units[f"ubuntu/{machine_id}"] = unit
+    return {
+        name: {
+            "charm": name,
+            "status": {"status": "active", "info": "", "since": STATUS_SINCE},
+            "units": units if name == "ubuntu" else {},
+        }
+        for name in ("ubuntu", "telegraf")
+    }
+
+
+def generate_model_status(  # pylint: disable=R0913
+    model_name: str,
+    machines: int,
+    containers: int = 1,
+    interfaces: int = 4,
+    virtual_ratio: float = 0.5,
+    down_ratio: float = 0.01,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Generate the FullStatus of one model.
+
+    :param str model_name: the name of the model
+    :param int machines: the number of machines in the model
+    :param int containers: the number of lxd containers on each machine
+    :param int interfaces: the number of network interfaces of each machine
+    :param float virtual_ratio: the share of machines with a virtual MAC address
+    :param float down_ratio: the share of hosts whose agent is down
+    :param int seed: the seed of the random generator
+    :return dict: the status, in the format returned by Model.get_status
+    """
+    rng = random.Random(f"{seed}-{model_name}")
+    status_machines = {}
+    for machine_id in range(machines):
+        machine = _host(rng, f"{model_name}-{machine_id}", down_ratio)
+        machine["network-interfaces"] = _network_interfaces(
+            rng, interfaces, rng.random() < virtual_ratio
+        )
+        machine["containers"] = {}
+        for container_id in range(containers):
+            key = f"{machine_id}/lxd/{container_id}"
+            container = _host(rng, f"{model_name}-{machine_id}-lxd-{container_id}", down_ratio)
+            container["network-interfaces"] = _network_interfaces(rng, 1, True)
+            machine["containers"][key] = container
+        status_machines[str(machine_id)] = machine
+
+    return {
+        "model": {"name": model_name, "type": "iaas", "version": JUJU_VERSION},
+        "machines": status_machines,
+        "applications": _applications(rng, machines, down_ratio),
+        "storage": {},
+    }
+
+
+def generate_controller_status(
+    hosts: int, models: int, containers: int = 1, **kwargs: Any
+) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """Generate the FullStatus of every model of a controller with about `hosts` hosts.
+
+    :param int hosts: the total number of machines and containers to generate
+    :param int models: the number of models to spread the hosts over
+    :param int containers: the number of lxd containers on each machine
+    :param kwargs: passed on to generate_model_status
+    :return: tuples of the model name, the model uuid and the model status
+    """
+    machines = max(1, math.ceil(hosts / models / (1 + containers)))
+    for index in range(models):
+        model_name = f"model-{index}"
+        uuid = f"00000000-0000-4000-8000-{index:012d}"
+        yield model_name, uuid, generate_model_status(
+            model_name, machines, containers=containers, **kwargs
+        )
@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 """Test exporter daemon."""
+
 from subprocess import check_call
 
 from helpers import add_machine, get_machines_counts, get_registry_data, remove_machine
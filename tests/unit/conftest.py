@@ -127,28 +127,50 @@ def get_juju_stats_data():
                 "charm-rev": 21,
                 "charm-channel": "stable",
                 "exposed": "false",
-                "application-status": {
-                    "current": "active",
+                "status": {
+                    "status": "active",
                     "since": "24 Nov 2022 13:23:52Z",
                 },
                 "units": {
                     "ubuntu/0": {
                         "workload-status": {
-                            "current": "active",
+                            "status": "active",
                             "since": "24 Nov 2022 13:23:52Z",
                         },
-                        "juju-status": {
-                            "current": "idle",
+                        "agent-status": {
+                            "status": "idle",
                             "since": "24 Nov 2022 13:23:56Z",
                             "version": "2.9.29",
                         },
                         "leader": "true",
                         "machine": "0/lxd/0",
                         "public-address": "252.0.18.190",
+                        "subordinates": {
+                            "ntp/0": {
+                                "workload-status": {
+                                    "status": "blocked",
+                                    "since": "24 Nov 2022 13:24:10Z",
+                                },
+                                "agent-status": {
+                                    "status": "idle",
+                                    "since": "24 Nov 2022 13:24:12Z",
+                                    "version": "2.9.29",
+                                },
+                            }
+                        },
                     }
                 },
                 "version": "20.04",
-            }
+            },
+            "ntp": {
+                "charm": "ntp",
+                "subordinate-to": ["ubuntu"],
+                "status": {
+                    "status": "blocked",
+                    "since": "24 Nov 2022 13:24:10Z",
+                },
+                "units": {},
+            },
         },
         "storage": {},
         "controller": {"timestamp": "13:38:17Z"},
@@ -171,25 +193,25 @@ def collected_stats_data():
             ],
             "labelvalues_update": [
                 (
-                    {
-                        "job": "prometheus-juju-exporter",
-                        "hostname": "hostname1",
-                        "customer": "customer1",
-                        "cloud_name": "cloud name",
-                        "juju_model": "juju model",
-                        "type": "machine type",
-                    },
+                    (
+                        "prometheus-juju-exporter",
+                        "hostname1",
+                        "customer1",
+                        "cloud name",
+                        "juju model",
+                        "machine type",
+                    ),
                     0,
                 ),
                 (
-                    {
-                        "job": "prometheus-juju-exporter",
-                        "hostname": "hostname2",
-                        "customer": "customer2",
-                        "cloud_name": "cloud name",
-                        "juju_model": "juju model",
-                        "type": "machine type",
-                    },
+                    (
+                        "prometheus-juju-exporter",
+                        "hostname2",
+                        "customer2",
+                        "cloud name",
+                        "juju model",
+                        "machine type",
+                    ),
                     0,
                 ),
             ],
@@ -197,6 +219,17 @@ def collected_stats_data():
     }
 
 
+@pytest.fixture(autouse=True)
+def restore_config():
+    """Drop config values set by a test once it finishes."""
+    from prometheus_juju_exporter.config import Config
+
+    config = Config().get_config()
+    sources = list(config.sources)
+    yield
+    config.sources[:] = sources
+
+
 @pytest.fixture
 def update_model_status(monkeypatch, request):
     """Fixture to update the model status dynamically."""
@@ -245,12 +278,15 @@ def mock_controller_connection(monkeypatch, mock_model_connection):
     mock_controller = Controller
     mock_connection = mock.AsyncMock()
     mock_connection.return_value = mock_connection
-    mock_controller.connect = mock_connection
-    mock_controller.disconnect = mock_connection
-    mock_controller.is_connected.return_value = False
-    mock_controller.model_uuids = get_model_list_data()
-    mock_controller.get_model = mock.AsyncMock()
-    mock_controller.get_model.return_value = mock_model_connection()
+    # patched on the class through monkeypatch, so that tests against a real or
+    # fake controller are not affected
+    monkeypatch.setattr(mock_controller, "connect", mock_connection)
+    monkeypatch.setattr(mock_controller, "disconnect", mock_connection)
+    monkeypatch.setattr(mock_controller, "is_connected", mock.MagicMock(return_value=False))
+    monkeypatch.setattr(mock_controller, "model_uuids", get_model_list_data())
+    monkeypatch.setattr(
+        mock_controller, "get_model", mock.AsyncMock(return_value=mock_model_connection())
+    )
     monkeypatch.setattr(
         "prometheus_juju_exporter.collector.Controller",
         mock_controller,
@@ -260,16 +296,16 @@ def mock_controller_connection(monkeypatch, mock_model_connection):
 
 
 @pytest.fixture
-def mock_model_connection():
+def mock_model_connection(monkeypatch):
     """Mock juju model for the collector module path."""
     mock_model = Model
-    mock_model.get_status = get_juju_stats_data()
+    monkeypatch.setattr(mock_model, "get_status", get_juju_stats_data())
 
     return mock_model
 
 
 @pytest.fixture
-def exporter_daemon(monkeypatch, stats_gauge):
+def exporter_daemon(monkeypatch):
     """Mock exporter daemon."""
     from prometheus_juju_exporter.exporter import ExporterDaemon
 
@@ -284,7 +320,7 @@ def exporter_daemon(monkeypatch, stats_gauge):
         mock_logger.handlers = None
 
         monkeypatch.setattr(
-            "prometheus_juju_exporter.exporter.start_http_server", mock_http_server
+            "prometheus_juju_exporter.exporter.start_exposition_server", mock_http_server
         )
         monkeypatch.setattr(
             "prometheus_juju_exporter.collector.Collector.get_stats",
@@ -311,43 +347,3 @@ def collector_daemon(monkeypatch, mock_controller_connection):
         return Collector(*args, **kwargs)
 
     return _collector
-
-
-@pytest.fixture
-def mock_gauge():
-    """Provide mechanism to test args passed in calls to prometheus_client.Gauge."""
-
-    class TestArgs(object):
-        def __init__(self):
-            self.args = []
-            self.kwargs = []
-            self.values = []
-            self.call_labels = []
-
-        def __call__(self, *args, **kwargs):
-            self.args.append(list(args))
-            if "registry" in kwargs:
-                kwargs.pop("registry")
-            self.kwargs.append(dict(kwargs))
-            return self
-
-        def labels(self, *args, **kwargs):
-            self.call_labels.append(kwargs)
-            return self
-
-        def set(self, value):
-            self.values.append(value)
-
-        def remove(self, *labelvalues):
-            self.values = []
-
-    return TestArgs()
-
-
-@pytest.fixture
-def stats_gauge(monkeypatch, mock_gauge):
-    """Mock Gauge calls for the collector module path."""
-    monkeypatch.setattr("prometheus_juju_exporter.exporter.Gauge", mock_gauge)
-    gauge = mock_gauge
-
-    return gauge
@@ -0,0 +1,172 @@
+"""Smoke tests of the benchmark suite."""
+
+import json
+
+import pytest
+from juju.errors import JujuAPIError
+
+from prometheus_juju_exporter.collector import Collector
+from prometheus_juju_exporter.config import Config
+from prometheus_juju_exporter.replay import Recording
+from tests.benchmark import run_benchmark
+from tests.benchmark.fake_controller import FakeController
+from tests.benchmark.synthetic import generate_controller_status
+
+
+class TestBenchmark:
+    """Benchmark test class."""
+
+    def test_generate_controller_status(self):
+        """Test the size and determinism of the synthetic payload."""
+        payload = list(generate_controller_status(200, models=4, containers=1))
+        assert len(payload) == 4
+        assert run_benchmark.count_hosts(payload) == 200
+        assert payload == list(generate_controller_status(200, models=4, containers=1))
+
+        _, _, status = payload[0]
+        machine = status["machines"]["0"]
+        assert len(machine["network-interfaces"]) == 4
+        assert list(machine["containers"]) == ["0/lxd/0"]
+
+    @pytest.mark.benchmark
+    def test_run_benchmark(self):
+        """Test every stage runs against a small synthetic controller."""
+        results = run_benchmark.run_benchmark(100, models=2)
+
+        assert [result["stage"] for result in results] == ["status"] + [
+            stage.name for stage in run_benchmark.STAGES
+        ]
+        assert all(result["hosts"] == 100 for result in results)
+        assert "update_registry_unchanged" in run_benchmark.format_results(results)
+
+    @pytest.mark.benchmark
+    def test_replay_benchmark(self, tmp_path, capsys):
+        """Test running the stages against a recorded controller."""
+        recording = Recording(str(tmp_path))
+        payload = list(generate_controller_status(40, models=2, containers=1))
+        recording.save_models({name: uuid for name, uuid, _ in payload})
+        for _, uuid, status in payload:
+            recording.save_status(uuid, status)
+
+        assert run_benchmark.main(["--replay", str(tmp_path)]) == 0
+        assert "get_stats" in capsys.readouterr().out
+        results = run_benchmark.run_replay_benchmark(str(tmp_path))
+        assert all(result["hosts"] == 40 for result in results)
+
+    @pytest.mark.asyncio
+    @pytest.mark.benchmark
+    async def test_fake_controller(self):
+        """Test a collection through libjuju against the fake controller."""
+        payload = list(generate_controller_status(40, models=2, containers=1))
+        fake_controller = FakeController(payload, latency=0.001, failing_models=["model-1"])
+        await fake_controller.start()
+        collector = Collector(
+            {
+                "endpoints": [fake_controller.endpoint],
+                "cacert": fake_controller.cacert,
+                "username": "admin",
+                "password": "password",
+                "customer": "customer",
+                "cloud_name": "cloud",
+            }
+        )
+
+        try:
+            data = await collector.get_stats()
+            with pytest.raises(JujuAPIError, match="not implemented"):
+                await collector.controller.connection().rpc(
+                    {"type": "Client", "request": "Unknown", "version": 8}
+                )
+        finally:
+            await collector.controller.disconnect()
+            await fake_controller.close()
+
+        rows = next(iter(data.values()))["labelvalues_update"]
+        assert {labels[4] for labels, _ in rows} == {"model-0"}
+        assert collector.model_stats["model-0"]["hosts"] == 20
+        assert collector.model_stats["model-1"]["error"] == "error"
+        assert collector.model_stats["controller"]["hosts"] == 0
+        assert fake_controller.calls["Client.FullStatus"] == 3
+        assert fake_controller.max_frame >= fake_controller.bytes_sent["Client.FullStatus"] / 3
+
+    @pytest.mark.asyncio
+    @pytest.mark.benchmark
+    async def test_fake_controller_lightweight(self):
+        """Test that lightweight cycles only fetch the status of models with new machines."""
+        payload = list(generate_controller_status(40, models=2, containers=1))
+        fake_controller = FakeController(payload)
+        await fake_controller.start()
+        Config().get_config()["collection"]["mode"].set("lightweight")
+        collector = Collector(
+            {
+                "endpoints": [fake_controller.endpoint],
+                "cacert": fake_controller.cacert,
+                "username": "admin",
+                "password": "password",
+                "customer": "customer",
+                "cloud_name": "cloud",
+            }
+        )
+
+        try:
+            first = await collector.get_stats()
+            status = payload[0][2]
+            status["machines"]["0"]["agent-status"]["status"] = "down"
+            status["machines"]["99"] = dict(
+                status["machines"]["1"], hostname="model-0-99", containers={}
+            )
+            second = await collector.get_stats()
+        finally:
+            await collector.controller.disconnect()
+            await fake_controller.close()
+
+        assert list(first) == list(second) == ["juju_machine_state"]
+        # every model is fetched once, then only model-0 has a new machine
+        assert fake_controller.calls["Client.FullStatus"] == 4
+        assert fake_controller.calls["ModelManager.ModelInfo"] >= 1
+        rows = {
+            labels[1]: value
+            for labels, value in second["juju_machine_state"]["labelvalues_update"]
+        }
+        assert len(rows) == 41
+        assert rows["model-0-0"] == 0
+        assert collector.model_stats["model-1"]["seconds"] is None
+
+    def test_find_regressions(self):
+        """Test only stages slower than the baseline and tolerance are reported."""
+        baseline = [
+            {"hosts": 10, "stage": "rows", "seconds": 1.0},
+            {"hosts": 10, "stage": "render", "seconds": 1.0},
+        ]
+        results = [
+            {"hosts": 10, "stage": "rows", "seconds": 1.1},
+            {"hosts": 10, "stage": "render", "seconds": 1.5},
+            {"hosts": 20, "stage": "render", "seconds": 9.0},
+        ]
+
+        regressions = run_benchmark.find_regressions(results, baseline, tolerance=0.2)
+
+        assert regressions == ["render at 10 hosts: 1.500s, baseline 1.000s"]
+
+    @pytest.mark.benchmark
+    def test_main(self, tmp_path, capsys):
+        """Test the command line writes results and compares them with a baseline."""
+        output = tmp_path / "results.json"
+        argv = ["--hosts", "50", "--models", "2", "--output", str(output)]
+
+        assert run_benchmark.main(argv) == 0
+        results = json.loads(output.read_text())
+        assert "render" in capsys.readouterr().out
+
+        for result in results:
+            result["seconds"] = 0.0 if result["stage"] == "status" else 1e-9
+        output.write_text(json.dumps(results))
+        assert (
+            run_benchmark.main(["--hosts", "50", "--models", "2", "--baseline", str(output)]) == 1
+        )
+        assert "REGRESSION" in capsys.readouterr().out
+
+        output.write_text("[]")
+        assert (
+            run_benchmark.main(["--hosts", "50", "--models", "2", "--baseline", str(output)]) == 0
+        )
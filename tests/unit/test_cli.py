@@ -1,5 +1,6 @@
 #!/usr/bin/python3
 """Test Cli."""
+
 from unittest import mock
 
 import pytest
@@ -1,11 +1,19 @@
 #!/usr/bin/python3
 """Test collctor."""
+
+import asyncio
+import heapq
 from unittest import mock
 
 import pytest
+from juju.client.connection import Monitor
 from juju.errors import JujuError
 
-from prometheus_juju_exporter.collector import MachineType
+from prometheus_juju_exporter.classifier import MachineType, MachineTypeClassifier
+from prometheus_juju_exporter.config import Config
+from prometheus_juju_exporter.gauges import MachineLabels, ModelRows
+from prometheus_juju_exporter.models import ModelFilter, ModelPool, ModelScheduler, in_shard
+from tests.unit.conftest import get_juju_stats_data, get_model_list_data
 
 
 class TestCollectorDaemon:
@@ -16,6 +24,28 @@ class TestCollectorDaemon:
         stats_collector_daemon = collector_daemon()
         assert stats_collector_daemon is not None
 
+    @pytest.mark.asyncio
+    async def test_get_stats_target(self, collector_daemon):
+        """Test that the collector connects to its target and labels rows with it."""
+        target = {
+            "endpoints": ["10.0.0.1:17070"],
+            "cacert": "CA data",
+            "username": "admin",
+            "password": "secret",
+            "customer": "other_customer",
+            "cloud_name": "other_cloud",
+        }
+        statsd = collector_daemon(target)
+        with mock.patch.object(statsd, "_connect_controller") as connect_controller:
+            data = await statsd.get_stats()
+
+        connect_controller.assert_awaited_once_with(
+            endpoints=["10.0.0.1:17070"], username="admin", password="secret", cacert="CA data"
+        )
+        for labels, _ in data["juju_machine_state"]["labelvalues_update"]:
+            assert labels.customer == "other_customer"
+            assert labels.cloud_name == "other_cloud"
+
     def test_parse_config(self, collector_daemon):
         """Test config parsing."""
         statsd = collector_daemon()
@@ -56,66 +86,105 @@ class TestCollectorDaemon:
 
         await statsd.get_stats()
 
-        assert statsd.data == {
-            "juju_machine_state": {
-                "gauge_desc": "Running status of juju machines",
-                "labels": [
-                    "job",
-                    "hostname",
-                    "customer",
-                    "cloud_name",
-                    "juju_model",
-                    "type",
-                ],
-                "labelvalues_update": [
-                    (
-                        {
-                            "cloud_name": "example_cloud",
-                            "customer": "example_customer",
-                            "hostname": "juju-000ddd-test-0",
-                            "job": "prometheus-juju-exporter",
-                            "juju_model": "controller",
-                            "type": "kvm",
-                        },
-                        1,
+        assert statsd.data["juju_machine_state"] == {
+            "gauge_desc": "Running status of juju machines",
+            "labels": [
+                "job",
+                "hostname",
+                "customer",
+                "cloud_name",
+                "juju_model",
+                "type",
+            ],
+            "labelvalues_update": [
+                (
+                    MachineLabels(
+                        job="prometheus-juju-exporter",
+                        hostname="juju-000ddd-test-0",
+                        customer="example_customer",
+                        cloud_name="example_cloud",
+                        juju_model="controller",
+                        type="kvm",
                     ),
-                    (
-                        {
-                            "cloud_name": "example_cloud",
-                            "customer": "example_customer",
-                            "hostname": "juju-000ddd-0-lxd-0",
-                            "job": "prometheus-juju-exporter",
-                            "juju_model": "controller",
-                            "type": "lxd",
-                        },
-                        1,
+                    1,
+                ),
+                (
+                    MachineLabels(
+                        job="prometheus-juju-exporter",
+                        hostname="juju-000ddd-0-lxd-0",
+                        customer="example_customer",
+                        cloud_name="example_cloud",
+                        juju_model="controller",
+                        type="lxd",
                     ),
-                    (
-                        {
-                            "cloud_name": "example_cloud",
-                            "customer": "example_customer",
-                            "hostname": "juju-000ddd-test-0",
-                            "job": "prometheus-juju-exporter",
-                            "juju_model": "default",
-                            "type": "kvm",
-                        },
-                        1,
+                    1,
+                ),
+                (
+                    MachineLabels(
+                        job="prometheus-juju-exporter",
+                        hostname="juju-000ddd-test-0",
+                        customer="example_customer",
+                        cloud_name="example_cloud",
+                        juju_model="default",
+                        type="kvm",
                     ),
-                    (
-                        {
-                            "cloud_name": "example_cloud",
-                            "customer": "example_customer",
-                            "hostname": "juju-000ddd-0-lxd-0",
-                            "job": "prometheus-juju-exporter",
-                            "juju_model": "default",
-                            "type": "lxd",
-                        },
-                        1,
+                    1,
+                ),
+                (
+                    MachineLabels(
+                        job="prometheus-juju-exporter",
+                        hostname="juju-000ddd-0-lxd-0",
+                        customer="example_customer",
+                        cloud_name="example_cloud",
+                        juju_model="default",
+                        type="lxd",
                     ),
-                ],
-            },
+                    1,
+                ),
+            ],
         }
 
+    @pytest.mark.asyncio
+    async def test_get_stats_units_and_applications(self, collector_daemon):
+        """Test that unit and application gauges come from the same status fetch."""
+        statsd = collector_daemon()
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Model.get_status", get_juju_stats_data()
+        ) as get_status:
+            data = await statsd.get_stats()
+
+        assert get_status.await_count == 2
+        assert data["juju_unit_state"]["labels"] == [
+            "job",
+            "customer",
+            "cloud_name",
+            "juju_model",
+            "application",
+            "unit",
+        ]
+        units = [
+            (labels.juju_model, labels.application, labels.unit, value)
+            for labels, value in data["juju_unit_state"]["labelvalues_update"]
+        ]
+        assert units == [
+            ("controller", "ubuntu", "ubuntu/0", 1),
+            ("controller", "ntp", "ntp/0", 0),
+            ("default", "ubuntu", "ubuntu/0", 1),
+            ("default", "ntp", "ntp/0", 0),
+        ]
+        # a status change changes the value of the series, not its labels
+        assert data["juju_application_state"]["labels"][-1] == "application"
+        applications = [
+            (labels.juju_model, labels.application, value)
+            for labels, value in data["juju_application_state"]["labelvalues_update"]
+        ]
+        assert applications == [
+            ("controller", "ubuntu", 1),
+            ("controller", "ntp", 0),
+            ("default", "ubuntu", 1),
+            ("default", "ntp", 0),
+        ]
+
     @pytest.mark.asyncio
     async def test_skip_inaccessible_models(self, collector_daemon):
         """Test exception handling in case a model is inaccessible."""
@@ -126,27 +195,15 @@ class TestCollectorDaemon:
         ):
             await statsd.get_stats()
 
-        assert statsd.data == {
-            "juju_machine_state": {
-                "gauge_desc": "Running status of juju machines",
-                "labels": [
-                    "job",
-                    "hostname",
-                    "customer",
-                    "cloud_name",
-                    "juju_model",
-                    "type",
-                ],
-                "labelvalues_update": [],
-            }
-        }
+        assert all(not values["labelvalues_update"] for values in statsd.data.values())
+        assert all(stats["error"] == "error" for stats in statsd.model_stats.values())
 
     @pytest.mark.parametrize(
         "mac_address,expect_machine_type",
         [("fa:16:3e:d4:00:00", "kvm"), ("00:00:00:00:00:00", "metal")],
     )
-    def test_get_machine_type(self, collector_daemon, mac_address, expect_machine_type):
-        """Test get_stats function and the execution of the collector."""
+    def test_classify(self, collector_daemon, mac_address, expect_machine_type):
+        """Test detecting the machine type from the MAC addresses of its interfaces."""
         statsd = collector_daemon()
         machine = {
             "network-interfaces": {
@@ -155,7 +212,7 @@ class TestCollectorDaemon:
                 }
             }
         }
-        machine_type = statsd._get_machine_type(machine, "dummy-0")
+        machine_type = statsd.classifier.classify(machine)
 
         assert machine_type.value == expect_machine_type
 
@@ -167,9 +224,7 @@ class TestCollectorDaemon:
             (r"", MachineType.KVM),
         ],
     )
-    def test_get_machine_type_interface_match(
-        self, match_interfaces, expected_type, collector_daemon
-    ):
+    def test_classify_interface_match(self, match_interfaces, expected_type, collector_daemon):
         """Test that only whitelisted interfaces are used to detect machine type.
 
         There are three scenarios to this test:
@@ -201,8 +256,50 @@ class TestCollectorDaemon:
 
         statsd.config["detection"]["virt_macs"].set([kvm_prefix, tap_prefix])
         statsd.config["detection"]["match_interfaces"].set(match_interfaces)
+        statsd.classifier = MachineTypeClassifier.from_config(statsd.config)
+
+        assert statsd.classifier.classify(machine) == expected_type
+
+    def test_classifier_normalizes_prefixes(self):
+        """Test that virtual MAC prefixes match regardless of case and length."""
+        classifier = MachineTypeClassifier(["FA:16:3E", "52:54"])
 
-        assert statsd._get_machine_type(machine, "dummy-0") == expected_type
+        assert classifier.is_virtual_mac("fa:16:3e:00:00:01")
+        assert classifier.is_virtual_mac("52:54:00:00:00:01")
+        # answered from the memo, which is keyed by the start of the address
+        assert classifier.is_virtual_mac("52:54:00:00:00:02")
+        assert not classifier.is_virtual_mac("fa:16:3f:00:00:01")
+        assert sorted(classifier._mac_memo) == ["52:54:00", "fa:16:3e", "fa:16:3f"]
+        assert not MachineTypeClassifier([]).is_virtual_mac("fa:16:3e:00:00:01")
+
+    def test_classifier_memo_size(self):
+        """Test that the memos of the classifier are bounded."""
+        classifier = MachineTypeClassifier(["fa:16:3e"], match_interfaces=r"^eth")
+        machine = {"network-interfaces": {}}
+        with mock.patch("prometheus_juju_exporter.classifier.CLASSIFIER_MEMO_SIZE", 2):
+            for index in range(3):
+                machine["network-interfaces"] = {
+                    f"eth{index}": {"mac-address": f"fa:16:3{index}:00:00:01"}
+                }
+                assert classifier.classify(machine) == MachineType.METAL
+
+        assert len(classifier._mac_memo) == 1
+        assert len(classifier._interface_memo) == 1
+
+    def test_classifier_classify_all(self):
+        """Test classifying all machines of a model in one pass."""
+        classifier = MachineTypeClassifier(["fa:16:3e"], match_interfaces=r"^ens")
+        machines = {
+            "0": {"network-interfaces": {"ens3": {"mac-address": "fa:16:3e:00:00:01"}}},
+            "1": {"network-interfaces": {"virbr0": {"mac-address": "fa:16:3e:00:00:02"}}},
+            "2": {"network-interfaces": {}},
+        }
+
+        assert classifier.classify_all(machines) == {
+            "0": MachineType.KVM,
+            "1": MachineType.METAL,
+            "2": MachineType.METAL,
+        }
 
     @pytest.mark.parametrize(
         "host, host_id",
@@ -296,9 +393,989 @@ class TestCollectorDaemon:
                 mock.call(endpoint=endpoint, username=username, password=password, cacert=cacert)
             )
 
-        with pytest.raises(RuntimeError):
+        with mock.patch(
+            "prometheus_juju_exporter.collector.asyncio.sleep"
+        ) as mock_sleep, pytest.raises(RuntimeError):
             await statsd._connect_controller(
                 endpoints=endpoints, username=username, password=password, cacert=cacert
             )
 
-        controller.connect.assert_has_calls(expected_calls)
+        controller.connect.assert_has_calls(expected_calls * 3)
+        mock_sleep.assert_has_awaits([mock.call(5), mock.call(10)])
+
+    @pytest.mark.asyncio
+    async def test_connect_controller_backoff_cap(self, collector_daemon):
+        """Test that the delay between reconnection rounds does not exceed the cap."""
+        controller = mock.MagicMock()
+        controller.connect = mock.AsyncMock(side_effect=JujuError)
+        controller.is_connected.return_value = False
+        statsd = collector_daemon()
+        statsd.controller = controller
+        statsd.config["collection"]["reconnect_attempts"].set(5)
+        statsd.config["collection"]["reconnect_backoff"].set(100)
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.asyncio.sleep"
+        ) as mock_sleep, pytest.raises(RuntimeError):
+            await statsd._connect_controller(
+                endpoints=["10.0.0.1:17070"], username="admin", password="admin", cacert="CA"
+            )
+
+        assert [call.args[0] for call in mock_sleep.await_args_list] == [100, 200, 300, 300]
+
+    @pytest.mark.asyncio
+    async def test_connect_controller_reuse(self, collector_daemon):
+        """Test that a healthy controller connection is reused without reconnecting."""
+        controller = mock.MagicMock()
+        controller.connect = mock.AsyncMock()
+        controller.is_connected.return_value = True
+        controller.connection.return_value.monitor.status = Monitor.CONNECTED
+        statsd = collector_daemon()
+        statsd.controller = controller
+
+        await statsd._connect_controller(
+            endpoints=["10.0.0.1:17070"], username="admin", password="admin", cacert="CA"
+        )
+
+        controller.connect.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_connect_controller_reconnect_last_endpoint(self, collector_daemon):
+        """Test that a dropped connection is re-established starting from the last endpoint."""
+        controller = mock.MagicMock()
+        controller.connect = mock.AsyncMock(side_effect=[None, JujuError, None])
+        controller.is_connected.return_value = True
+        controller.connection.return_value.monitor.status = Monitor.ERROR
+        endpoints = ["10.0.0.1:17070", "10.0.0.2:17070", "10.0.0.3:17070"]
+        statsd = collector_daemon()
+        statsd.controller = controller
+        statsd._endpoint_index = 1
+
+        await statsd._connect_controller(
+            endpoints=endpoints, username="admin", password="admin", cacert="CA"
+        )
+        assert statsd._endpoint_index == 1
+        await statsd._connect_controller(
+            endpoints=endpoints, username="admin", password="admin", cacert="CA"
+        )
+
+        called_endpoints = [call.kwargs["endpoint"] for call in controller.connect.call_args_list]
+        assert called_endpoints == [endpoints[1], endpoints[1], endpoints[2]]
+        assert statsd._endpoint_index == 2
+
+    @pytest.mark.asyncio
+    async def test_get_stats_keeps_controller_connection(self, collector_daemon):
+        """Test that the controller connection survives a successful collection cycle."""
+        statsd = collector_daemon()
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.disconnect"
+        ) as mock_disconnect:
+            await statsd.get_stats()
+
+        mock_disconnect.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_get_stats_drops_controller_connection_on_error(self, collector_daemon):
+        """Test that the controller connection is dropped when a collection cycle fails."""
+        statsd = collector_daemon()
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            side_effect=JujuError,
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.disconnect"
+        ) as mock_disconnect, pytest.raises(
+            JujuError
+        ):
+            await statsd.get_stats()
+
+        mock_disconnect.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_get_stats_bounded_concurrency(self, collector_daemon):
+        """Test that no more than 'max_concurrent_models' models are fetched at once."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["max_concurrent_models"].set(2)
+        in_flight, peak = 0, 0
+
+        async def get_status():
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return {"machines": {}}
+
+        model = mock.MagicMock()
+        model.get_status = get_status
+        model.disconnect = mock.AsyncMock()
+        model_uuids = {f"model-{i}": f"uuid-{i}" for i in range(5)}
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            mock.AsyncMock(return_value=model_uuids),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            await statsd.get_stats()
+
+        assert peak == 2
+        assert model.disconnect.await_count == 5
+
+    @pytest.mark.asyncio
+    async def test_get_stats_deterministic_order(self, collector_daemon):
+        """Test that results are merged in model listing order, not completion order."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["max_concurrent_models"].set(2)
+        status = get_juju_stats_data().return_value
+        delays = {"controller": 0.02, "default": 0}
+
+        async def get_model(uuid):
+            model = mock.MagicMock()
+            model.disconnect = mock.AsyncMock()
+
+            async def get_status():
+                await asyncio.sleep(delays[uuid])
+                return status
+
+            model.get_status = get_status
+            return model
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            mock.AsyncMock(return_value={"controller": "controller", "default": "default"}),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            side_effect=get_model,
+        ):
+            await statsd.get_stats()
+
+        models = [
+            labels.juju_model
+            for labels, _ in statsd.data["juju_machine_state"]["labelvalues_update"]
+        ]
+        assert models == ["controller", "controller", "default", "default"]
+
+    @pytest.mark.asyncio
+    async def test_iter_model_rows(self, collector_daemon):
+        """Test that the rows of each model are yielded as soon as it is fetched."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["max_concurrent_models"].set(2)
+        release_slow = asyncio.Event()
+
+        async def get_model(uuid):
+            model = mock.MagicMock(disconnect=mock.AsyncMock())
+
+            async def get_status():
+                if uuid == "slow":
+                    await release_slow.wait()
+                return get_juju_stats_data().return_value
+
+            model.get_status = get_status
+            return model
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model", side_effect=get_model
+        ):
+            rows = statsd.iter_model_rows({"slow": "slow", "fast": "fast"})
+            uuid, fast_rows = await rows.__anext__()
+            assert uuid == "fast"
+            assert [labels.juju_model for _, labels, _ in fast_rows.machines] == ["fast", "fast"]
+            release_slow.set()
+            assert [uuid async for uuid, _ in rows] == ["slow"]
+
+    @pytest.mark.asyncio
+    async def test_iter_model_rows_cancelled(self, collector_daemon):
+        """Test that pending fetches are cancelled when the consumer stops early."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["max_concurrent_models"].set(2)
+        model = mock.MagicMock(disconnect=mock.AsyncMock())
+        statuses = [get_juju_stats_data().return_value]
+
+        async def get_status():
+            if statuses:
+                return statuses.pop()
+            await asyncio.Event().wait()
+
+        model.get_status = get_status
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            rows = statsd.iter_model_rows({"first": "first", "stuck": "stuck"})
+            await rows.__anext__()
+            await rows.aclose()
+            await asyncio.sleep(0)
+
+        # once when the first model is done, once when the stuck fetch is cancelled
+        assert model.disconnect.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_timeout(self, collector_daemon):
+        """Test that a model exceeding 'model_timeout' is skipped and disconnected."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["model_timeout"].set(1)
+        model = mock.MagicMock()
+        model.get_status = mock.AsyncMock(side_effect=asyncio.Event().wait)
+        model.disconnect = mock.AsyncMock()
+        wait_for = asyncio.wait_for
+
+        async def short_wait_for(aw, timeout):
+            return await wait_for(aw, timeout / 100)
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.asyncio.wait_for",
+            side_effect=short_wait_for,
+        ) as mock_wait_for:
+            await statsd.get_stats()
+
+        assert statsd.data["juju_machine_state"]["labelvalues_update"] == []
+        assert mock_wait_for.call_args.args[1] == 1
+        assert model.disconnect.await_count == 2
+        assert [stats["error"] for stats in statsd.model_stats.values()] == ["timeout"] * 2
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_stats(self, collector_daemon):
+        """Test that the fetch duration, host count and error of every model are kept."""
+        statsd = collector_daemon()
+        status = get_juju_stats_data().return_value
+
+        async def get_model(uuid):
+            if uuid == "broken":
+                raise JujuError("model not found")
+            model = mock.MagicMock()
+            model.disconnect = mock.AsyncMock()
+
+            async def get_status():
+                await asyncio.sleep(0.01)
+                return status
+
+            model.get_status = get_status
+            return model
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            mock.AsyncMock(return_value={"default": "default", "broken": "broken"}),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            side_effect=get_model,
+        ):
+            await statsd.get_stats()
+
+        assert statsd.model_stats["default"]["seconds"] >= 0.01
+        assert statsd.model_stats["default"]["hosts"] == 2
+        assert statsd.model_stats["default"]["error"] is None
+        assert statsd.model_stats["broken"]["hosts"] == 0
+        assert statsd.model_stats["broken"]["error"] == "error"
+
+        # errors are not carried over to the next cycle
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            mock.AsyncMock(return_value={"default": "default"}),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            side_effect=get_model,
+        ):
+            await statsd.get_stats()
+
+        assert list(statsd.model_stats) == ["default"]
+
+    @pytest.mark.asyncio
+    async def test_get_stats_failed_model_keeps_rows(self, collector_daemon):
+        """Test that a model failing after a successful cycle keeps its last rows."""
+        statsd = collector_daemon()
+        first = list((await statsd.get_stats())["juju_machine_state"]["labelvalues_update"])
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            side_effect=JujuError("model not found"),
+        ):
+            second = await statsd.get_stats()
+
+        assert second["juju_machine_state"]["labelvalues_update"] == first
+        assert all(
+            stats["error"] == "error" and stats["stale"] for stats in statsd.model_stats.values()
+        )
+
+    @pytest.mark.asyncio
+    async def test_get_stats_failed_controller_marks_models_stale(self, collector_daemon):
+        """Test that the models of the last cycle are stale when the controller fails."""
+        statsd = collector_daemon()
+        model = mock.MagicMock(get_status=get_juju_stats_data(), disconnect=mock.AsyncMock())
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            mock.AsyncMock(return_value={"default": "default", "broken": "broken"}),
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            side_effect=[model, JujuError],
+        ):
+            await statsd.get_stats()
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.model_uuids",
+            side_effect=JujuError,
+        ), pytest.raises(JujuError):
+            await statsd.get_stats()
+
+        # the broken model had no rows to keep, so nothing stale is served for it
+        assert statsd.model_stats == {
+            "default": {"seconds": None, "hosts": 2, "error": None, "stale": True},
+            "broken": {"seconds": None, "hosts": 0, "error": None, "stale": False},
+        }
+
+    def test_in_shard(self):
+        """Test that every model belongs to exactly one shard."""
+        uuids = [f"00000000-0000-0000-0000-{index:012d}" for index in range(100)]
+        shards = [[uuid for uuid in uuids if in_shard(uuid, index, 3)] for index in range(3)]
+
+        assert sorted(sum(shards, [])) == uuids
+        assert all(shard for shard in shards)
+        assert in_shard("65f76aed-789f-4dbf-a75a-a32e5d90ab7e", 0, 1)
+
+    @pytest.mark.asyncio
+    async def test_get_stats_shard(self, collector_daemon):
+        """Test that only the models of the configured shard are fetched."""
+        statsd = collector_daemon()
+        statsd.config["collection"]["shard_count"].set(2)
+        uuids = ["65f76aed-789f-4dbf-a75a-a32e5d90ab7e", "77643b91-a6f8-4cf6-8755-83c6becd09bb"]
+        shard_index = int(not in_shard(uuids[0], 0, 2))
+        statsd.config["collection"]["shard_index"].set(shard_index)
+        expected = [uuid for uuid in uuids if in_shard(uuid, shard_index, 2)]
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._pooled_model()),
+        ) as get_model:
+            await statsd.get_stats()
+
+        assert [call.args[0] for call in get_model.await_args_list] == expected
+        assert list(statsd._model_cache) == expected
+
+    @pytest.mark.parametrize(
+        "include, exclude, owners, expected",
+        [
+            ([], [], [], ["prod-a", "test-b", "prod-c"]),
+            (["^prod-"], [], [], ["prod-a", "prod-c"]),
+            ([], ["^test-", "-c$"], [], ["prod-a"]),
+            (["^prod-"], ["-c$"], ["admin"], ["prod-a"]),
+            ([], [], ["alice", "bob"], ["test-b", "prod-c"]),
+        ],
+    )
+    def test_model_filter(self, include, exclude, owners, expected):
+        """Test selecting models by name patterns and owners."""
+        model_filter = ModelFilter(include, exclude, owners)
+        models = {"prod-a": "uuid-a", "test-b": "uuid-b", "prod-c": "uuid-c"}
+        model_owners = {"uuid-a": "admin", "uuid-b": "alice", "uuid-c": "bob"}
+
+        assert list(model_filter.apply(models, model_owners)) == expected
+
+    def test_model_filter_without_owners(self):
+        """Test that the owner filter is ignored when the owners are unknown."""
+        model_filter = ModelFilter(exclude=["^test-"], owners=["admin"])
+        models = {"prod-a": "uuid-a", "test-b": "uuid-b"}
+
+        assert model_filter.apply(models) == {"prod-a": "uuid-a"}
+        assert ModelFilter().apply(models) is models
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_filters(self, collector_daemon):
+        """Test that filtered out models are never connected to."""
+        Config().get_config()["collection"]["exclude_models"].set(["^default$"])
+        Config().get_config()["collection"]["include_owners"].set(["admin"])
+        statsd = collector_daemon()
+        summaries = mock.MagicMock(
+            results=[
+                mock.MagicMock(result=mock.MagicMock(uuid=uuid, owner_tag=f"user-{owner}"))
+                for uuid, owner in [
+                    ("65f76aed-789f-4dbf-a75a-a32e5d90ab7e", "admin"),
+                    ("77643b91-a6f8-4cf6-8755-83c6becd09bb", "admin"),
+                ]
+            ]
+        )
+        facade = mock.MagicMock(ListModelSummaries=mock.AsyncMock(return_value=summaries))
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.client.ModelManagerFacade.from_connection",
+            return_value=facade,
+        ), mock.patch.object(statsd.controller, "connection"), mock.patch.object(
+            statsd.controller, "get_current_username", return_value="admin"
+        ), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._pooled_model()),
+        ) as get_model:
+            await statsd.get_stats()
+
+        facade.ListModelSummaries.assert_awaited_once_with(user_tag="user-admin", all_=False)
+        get_model.assert_awaited_once_with("65f76aed-789f-4dbf-a75a-a32e5d90ab7e")
+        assert list(statsd.model_stats) == ["controller"]
+
+    @pytest.mark.asyncio
+    async def test_get_summary_rows(self, collector_daemon):
+        """Test that summaries only serve models whose machines all have a previous row."""
+        statsd = collector_daemon()
+        await statsd.get_stats()
+        uuid = "77643b91-a6f8-4cf6-8755-83c6becd09bb"
+
+        def summary(machine_id, status="started", instance_id="juju-000ddd-test-0"):
+            return {"id": machine_id, "instance-id": instance_id, "status": status}
+
+        rows = statsd._get_summary_rows(
+            uuid, "default", [summary("0", "down"), summary("0/lxd/0"), summary("1", "", "")]
+        )
+        assert [(labels.hostname, labels.type, value) for _, labels, value in rows.machines] == [
+            ("juju-000ddd-test-0", "kvm", 0),
+            ("juju-000ddd-0-lxd-0", "lxd", 1),
+        ]
+        assert statsd._get_summary_rows(uuid, "default", [summary("1")]) is None
+        assert statsd._get_summary_rows(uuid, "renamed", [summary("0")]) is None
+        assert statsd._get_summary_rows("unknown", "default", []) is None
+
+    @pytest.mark.asyncio
+    async def test_get_stats_lightweight(self, collector_daemon):
+        """Test that models are served from their summaries once their status was fetched."""
+        Config().get_config()["collection"]["mode"].set("lightweight")
+        statsd = collector_daemon()
+        machines = [
+            {"id": "0", "instance-id": "149e81c8", "status": "down"},
+            {"id": "0/lxd/0", "instance-id": "juju-000ddd-0-lxd-0", "status": "started"},
+        ]
+        infos = mock.MagicMock(
+            results=[
+                mock.MagicMock(error=None, result=mock.MagicMock(uuid=uuid, machines=machines))
+                for uuid in get_model_list_data().return_value.values()
+            ]
+        )
+        facade = mock.MagicMock(ModelInfo=mock.AsyncMock(return_value=infos))
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.client.ModelManagerFacade.from_connection",
+            return_value=facade,
+        ), mock.patch.object(statsd.controller, "connection"), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._pooled_model()),
+        ) as get_model:
+            first = await statsd.get_stats()
+            data = await statsd.get_stats()
+
+        assert get_model.await_count == 2
+        first_rows = first["juju_machine_state"]["labelvalues_update"]
+        rows = data["juju_machine_state"]["labelvalues_update"]
+        assert [labels for labels, _ in rows] == [labels for labels, _ in first_rows]
+        assert [value for _, value in rows] == [0, 1, 0, 1]
+        assert statsd.model_stats["default"] == {
+            "seconds": None,
+            "hosts": 2,
+            "error": None,
+            "stale": False,
+        }
+
+    @pytest.mark.asyncio
+    async def test_iter_summary_rows_skipped(self, collector_daemon):
+        """Test that models without a usable summary are left to a full status fetch."""
+        statsd = collector_daemon()
+        await statsd.get_stats()
+        model_uuids = get_model_list_data().return_value
+        controller_uuid, default_uuid = model_uuids.values()
+        infos = mock.MagicMock(
+            results=[
+                mock.MagicMock(error=mock.MagicMock(message="denied"), result=None),
+                mock.MagicMock(error=None, result=None),
+                mock.MagicMock(error=None, result=mock.MagicMock(uuid="unknown")),
+                # a machine without a previous row
+                mock.MagicMock(
+                    error=None,
+                    result=mock.MagicMock(
+                        uuid=controller_uuid,
+                        machines=[{"id": "9", "instance-id": "i-9", "status": "started"}],
+                    ),
+                ),
+                mock.MagicMock(error=None, result=mock.MagicMock(uuid=default_uuid, machines=[])),
+            ]
+        )
+        facade = mock.MagicMock(ModelInfo=mock.AsyncMock(return_value=infos))
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.client.ModelManagerFacade.from_connection",
+            return_value=facade,
+        ), mock.patch.object(statsd.controller, "connection"):
+            summarized = [uuid async for uuid, _ in statsd.iter_summary_rows(model_uuids)]
+
+        assert summarized == [default_uuid]
+
+    @pytest.mark.asyncio
+    async def test_iter_summary_rows_replay(self, collector_daemon, tmp_path):
+        """Test that recordings, which only hold full statuses, are never summarized."""
+        Config().get_config()["collection"]["recording_dir"].set(str(tmp_path))
+        Config().get_config()["collection"]["transport"].set("replay")
+        statsd = collector_daemon()
+        uuid = "77643b91-a6f8-4cf6-8755-83c6becd09bb"
+        statsd._model_cache[uuid] = (0, ModelRows([], [], []))
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.client.ModelManagerFacade.from_connection"
+        ) as from_connection:
+            summarized = [uuid async for uuid, _ in statsd.iter_summary_rows({"default": uuid})]
+
+        assert summarized == []
+        from_connection.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_get_stats_lightweight_fallback(self, collector_daemon):
+        """Test that models are fetched one by one when the summaries cannot be fetched."""
+        Config().get_config()["collection"]["mode"].set("lightweight")
+        statsd = collector_daemon()
+        facade = mock.MagicMock(ModelInfo=mock.AsyncMock(side_effect=JujuError("denied")))
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.client.ModelManagerFacade.from_connection",
+            return_value=facade,
+        ), mock.patch.object(statsd.controller, "connection"), mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._pooled_model()),
+        ) as get_model:
+            await statsd.get_stats()
+            facade.ModelInfo.assert_not_awaited()
+            data = await statsd.get_stats()
+
+        facade.ModelInfo.assert_awaited_once()
+        assert get_model.await_count == 4
+        assert list(data) == ["juju_machine_state"]
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 4
+
+    def test_model_scheduler(self):
+        """Test that models are due when new or once their interval elapsed."""
+        scheduler = ModelScheduler(600, [("^prod-", 60), ("prod", 120)], 0.1)
+        models = {"prod-a": "uuid-a", "dev-prod": "uuid-b", "dev": "uuid-c"}
+
+        assert [scheduler.interval(name) for name in models] == [60, 120, 600]
+        with mock.patch(
+            "prometheus_juju_exporter.models.time.monotonic", return_value=1000
+        ), mock.patch(
+            "prometheus_juju_exporter.models.random.uniform", side_effect=lambda a, b: b
+        ):
+            assert scheduler.due(models) == models
+            assert scheduler.seconds_until_due() is None
+            for name, uuid in models.items():
+                scheduler.schedule(name, uuid)
+            assert scheduler.due(models) == {}
+            assert scheduler.seconds_until_due() == 60
+
+        with mock.patch(
+            "prometheus_juju_exporter.models.time.monotonic", return_value=1130
+        ), mock.patch(
+            "prometheus_juju_exporter.models.random.uniform", side_effect=lambda a, b: a
+        ):
+            assert scheduler.due(models) == {"prod-a": "uuid-a", "dev-prod": "uuid-b"}
+            # due models stay due until they are scheduled again
+            assert scheduler.due(models) == {"prod-a": "uuid-a", "dev-prod": "uuid-b"}
+            scheduler.schedule("prod-a", "uuid-a")
+            assert scheduler.seconds_until_due() == pytest.approx(54)
+            # models that are gone are forgotten
+            assert scheduler.due({"prod-a": "uuid-a"}) == {}
+            assert scheduler.seconds_until_due() == pytest.approx(54)
+            # the outdated deadline of a forgotten model is skipped
+            scheduler.schedule("dev", "uuid-c")
+            assert scheduler.due({"dev": "uuid-c"}) == {}
+            assert scheduler.seconds_until_due() == pytest.approx(60)
+
+    def test_model_scheduler_disabled(self):
+        """Test that every model is due every cycle without per-model intervals."""
+        scheduler = ModelScheduler(600, [], 0.1)
+        models = {"prod-a": "uuid-a"}
+
+        scheduler.schedule("prod-a", "uuid-a")
+        assert scheduler.due(models) == models
+        assert scheduler.seconds_until_due() is None
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_intervals(self, collector_daemon):
+        """Test that models that are not due keep the rows and stats of their last fetch."""
+        Config().get_config()["collection"]["model_intervals"].set(
+            [{"match": "^default$", "interval": 60}]
+        )
+        statsd = collector_daemon()
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._pooled_model()),
+        ) as get_model:
+            first = await statsd.get_stats()
+            # the controller model falls due, the default model is not due for an hour
+            statsd.scheduler._deadlines["65f76aed-789f-4dbf-a75a-a32e5d90ab7e"] = 0
+            heapq.heappush(statsd.scheduler._heap, (0, "65f76aed-789f-4dbf-a75a-a32e5d90ab7e"))
+            second = await statsd.get_stats()
+
+        assert [call.args[0] for call in get_model.await_args_list] == [
+            "65f76aed-789f-4dbf-a75a-a32e5d90ab7e",
+            "77643b91-a6f8-4cf6-8755-83c6becd09bb",
+            "65f76aed-789f-4dbf-a75a-a32e5d90ab7e",
+        ]
+        assert second == first
+        assert statsd.model_stats["default"]["seconds"] is None
+        assert statsd.model_stats["default"]["hosts"] == 2
+        assert statsd.model_stats["controller"]["seconds"] is not None
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_intervals_failed_model(self, collector_daemon):
+        """Test that a model that failed is retried by the next cycle, not after its interval."""
+        Config().get_config()["collection"]["model_intervals"].set(
+            [{"match": "^default$", "interval": 60}]
+        )
+        statsd = collector_daemon()
+        models = {
+            "65f76aed-789f-4dbf-a75a-a32e5d90ab7e": self._pooled_model(),
+            "77643b91-a6f8-4cf6-8755-83c6becd09bb": self._pooled_model(),
+        }
+        default = models["77643b91-a6f8-4cf6-8755-83c6becd09bb"]
+        default.get_status.side_effect = [
+            Exception("unreachable"),
+            default.get_status.return_value,
+        ]
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(side_effect=models.get),
+        ):
+            await statsd.get_stats()
+            assert statsd.model_stats["default"]["error"] == "error"
+            await statsd.get_stats()
+
+        assert statsd.model_stats["default"]["error"] is None
+        assert set(statsd.scheduler._deadlines) == {
+            "65f76aed-789f-4dbf-a75a-a32e5d90ab7e",
+            "77643b91-a6f8-4cf6-8755-83c6becd09bb",
+        }
+
+    @staticmethod
+    def _pooled_model():
+        model = mock.MagicMock()
+        model.get_status = get_juju_stats_data()
+        model.is_connected.return_value = True
+        model.connection.return_value.monitor.status = Monitor.CONNECTED
+        model.disconnect = mock.AsyncMock()
+        return model
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_pool(self, collector_daemon):
+        """Test that pooled model connections are reused by the next cycles."""
+        Config().get_config()["collection"]["model_pool_size"].set(5)
+        statsd = collector_daemon()
+        models = {}
+
+        async def get_model(uuid):
+            models[uuid] = self._pooled_model()
+            return models[uuid]
+
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model", side_effect=get_model
+        ) as mock_get_model:
+            await statsd.get_stats()
+            data = await statsd.get_stats()
+
+        assert mock_get_model.await_count == 2
+        assert len(statsd.model_pool) == 2
+        assert all(model.get_status.await_count == 2 for model in models.values())
+        assert not any(model.disconnect.await_count for model in models.values())
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 4
+
+    @pytest.mark.asyncio
+    async def test_model_pool_evicts_least_recently_used(self):
+        """Test that the pool keeps at most 'size' idle connections."""
+        pool = ModelPool(size=1, idle_timeout=60)
+        first, second = self._pooled_model(), self._pooled_model()
+
+        await pool.release("first", first)
+        await pool.release("second", second)
+
+        first.disconnect.assert_awaited_once()
+        second.disconnect.assert_not_awaited()
+        assert await pool.acquire("second", mock.AsyncMock()) is second
+        assert len(pool) == 0
+
+    @pytest.mark.asyncio
+    async def test_model_pool_replaces_unusable_connections(self):
+        """Test that idle-expired and unhealthy connections are replaced."""
+        pool = ModelPool(size=5, idle_timeout=60)
+        expired, broken, closed, fresh = (self._pooled_model() for _ in range(4))
+        broken.connection.return_value.monitor.status = Monitor.DISCONNECTED
+        closed.is_connected.return_value = False
+        connect = mock.AsyncMock(return_value=fresh)
+
+        with mock.patch("prometheus_juju_exporter.models.time.monotonic", return_value=0):
+            await pool.release("expired", expired)
+        with mock.patch("prometheus_juju_exporter.models.time.monotonic", return_value=60):
+            await pool.release("broken", broken)
+            await pool.release("closed", closed)
+            assert await pool.acquire("expired", connect) is fresh
+            assert await pool.acquire("broken", connect) is fresh
+            assert await pool.acquire("closed", connect) is fresh
+
+        expired.disconnect.assert_awaited_once()
+        broken.disconnect.assert_awaited_once()
+        closed.disconnect.assert_awaited_once()
+        assert connect.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_model_pool_prune(self):
+        """Test that connections of removed or idle models are closed."""
+        pool = ModelPool(size=5, idle_timeout=60)
+        gone, idle, kept = (self._pooled_model() for _ in range(3))
+        gone.disconnect.side_effect = JujuError("already closed")
+        with mock.patch("prometheus_juju_exporter.models.time.monotonic", return_value=0):
+            await pool.release("gone", gone)
+            await pool.release("idle", idle)
+        with mock.patch("prometheus_juju_exporter.models.time.monotonic", return_value=30):
+            await pool.release("kept", kept)
+        with mock.patch("prometheus_juju_exporter.models.time.monotonic", return_value=60):
+            await pool.prune(["idle", "kept"])
+
+        gone.disconnect.assert_awaited_once()
+        idle.disconnect.assert_awaited_once()
+        kept.disconnect.assert_not_awaited()
+        assert len(pool) == 1
+
+    @staticmethod
+    def _watched_model():
+        model = mock.MagicMock()
+        model.get_status = get_juju_stats_data()
+        model.is_connected.return_value = True
+        model.disconnect = mock.AsyncMock()
+        return model
+
+    def test_watch_mode_from_config(self, collector_daemon):
+        """Test that watch mode is enabled by the 'collection.mode' option."""
+        assert collector_daemon().watch_mode is False
+        Config().get_config()["collection"]["mode"].set("watch")
+        assert collector_daemon().watch_mode is True
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode(self, collector_daemon):
+        """Test that watched models stay connected and are reused by the next resync."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        model = self._watched_model()
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ) as get_model:
+            await statsd.get_stats()
+            data = await statsd.get_stats()
+
+        assert get_model.await_count == 2
+        assert model.add_observer.call_count == 2
+        model.disconnect.assert_not_awaited()
+        assert [
+            (labels.juju_model, labels.hostname, labels.type, value)
+            for labels, value in data["juju_machine_state"]["labelvalues_update"]
+        ] == [
+            ("controller", "juju-000ddd-test-0", "kvm", 1),
+            ("controller", "juju-000ddd-0-lxd-0", "lxd", 1),
+            ("default", "juju-000ddd-test-0", "kvm", 1),
+            ("default", "juju-000ddd-0-lxd-0", "lxd", 1),
+        ]
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode_reconnect(self, collector_daemon):
+        """Test that a watched model whose connection dropped is connected again."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        model = self._watched_model()
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ) as get_model:
+            await statsd.get_stats()
+            model.is_connected.return_value = False
+            await statsd.get_stats()
+
+        assert get_model.await_count == 4
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode_removed_model(self, collector_daemon):
+        """Test that models gone from the controller are no longer watched."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        model = self._watched_model()
+        model.disconnect.side_effect = [JujuError("already closed")]
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            await statsd.get_stats()
+            with mock.patch(
+                "prometheus_juju_exporter.collector.Controller.model_uuids",
+                mock.AsyncMock(return_value={"default": "77643b91-a6f8-4cf6-8755-83c6becd09bb"}),
+            ):
+                data = await statsd.get_stats()
+
+        model.disconnect.assert_awaited_once()
+        assert list(statsd._watched_models) == ["77643b91-a6f8-4cf6-8755-83c6becd09bb"]
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode_failed_model(self, collector_daemon):
+        """Test that a watched model failing to report its status is disconnected."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        model = self._watched_model()
+        model.get_status.side_effect = JujuError("boom")
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            data = await statsd.get_stats()
+
+        assert model.disconnect.await_count == 2
+        assert statsd._watched_models == {}
+        assert data["juju_machine_state"]["labelvalues_update"] == []
+
+    @pytest.mark.asyncio
+    async def test_on_machine_delta(self, collector_daemon):
+        """Test that machine deltas are applied to the state table."""
+        on_change = mock.MagicMock()
+        statsd = collector_daemon(on_change=on_change)
+        statsd.watch_mode = True
+        uuid = "65f76aed-789f-4dbf-a75a-a32e5d90ab7e"
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=self._watched_model()),
+        ):
+            await statsd.get_stats()
+
+        def delta(type_, machine_id, hostname, status="started"):
+            return mock.MagicMock(
+                type=type_,
+                get_id=mock.MagicMock(return_value=machine_id),
+                data={"id": machine_id, "hostname": hostname, "agent-status": {"current": status}},
+            )
+
+        await statsd._on_machine_delta(uuid, "controller", delta("change", "0", "host-0", "down"))
+        await statsd._on_machine_delta(uuid, "controller", delta("add", "1", "host-1"))
+        await statsd._on_machine_delta(uuid, "controller", delta("add", "1/lxd/0", "host-2"))
+        await statsd._on_machine_delta(uuid, "controller", delta("remove", "0/lxd/0", None))
+        await statsd._on_machine_delta(uuid, "controller", delta("add", "2", "pending"))
+        await statsd._on_machine_delta("unknown", "unknown", delta("add", "0", "host-3"))
+
+        assert on_change.call_count == 5
+        assert [
+            (labels.hostname, labels.type, value)
+            for labels, value in statsd._machine_state[uuid].values()
+        ] == [("host-0", "kvm", 0), ("host-1", "metal", 1), ("host-2", "lxd", 1)]
+        data = statsd.get_state_stats()
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 5
+        # units and applications keep the rows of the last resync
+        assert len(data["juju_unit_state"]["labelvalues_update"]) == 4
+        assert len(data["juju_application_state"]["labelvalues_update"]) == 4
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode_replays_deltas(self, collector_daemon):
+        """Test that deltas received during a resync are applied on top of its statuses."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        uuid = "65f76aed-789f-4dbf-a75a-a32e5d90ab7e"
+        model = self._watched_model()
+        status = get_juju_stats_data().return_value
+        delta = mock.MagicMock(
+            type="change",
+            get_id=mock.MagicMock(return_value="0"),
+            data={"id": "0", "hostname": "host-0", "agent-status": {"current": "down"}},
+        )
+
+        async def get_status():
+            # the delta arrives before the resync is over, on a model not watched yet
+            await statsd._on_machine_delta(uuid, "controller", delta)
+            return status
+
+        model.get_status = get_status
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            data = await statsd.get_stats()
+
+        assert statsd._machine_state[uuid]["0"][0].hostname == "host-0"
+        assert statsd._machine_state[uuid]["0"][0].type == "kvm"
+        assert statsd._machine_state[uuid]["0"][1] == 0
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 4
+        assert statsd._resync_deltas is None
+
+    @pytest.mark.asyncio
+    async def test_get_stats_watch_mode_drops_deltas_of_removed_models(self, collector_daemon):
+        """Test that deltas received during a resync for a removed model are dropped."""
+        statsd = collector_daemon()
+        statsd.watch_mode = True
+        model = self._watched_model()
+        status = get_juju_stats_data().return_value
+        delta = mock.MagicMock(
+            type="add",
+            get_id=mock.MagicMock(return_value="0"),
+            data={"id": "0", "hostname": "host-0", "agent-status": {"current": "started"}},
+        )
+
+        async def get_status():
+            # the model of the delta is gone from the model list of this resync
+            await statsd._on_machine_delta("removed-uuid", "removed", delta)
+            return status
+
+        model.get_status = get_status
+        with mock.patch(
+            "prometheus_juju_exporter.collector.Controller.get_model",
+            mock.AsyncMock(return_value=model),
+        ):
+            data = await statsd.get_stats()
+
+        assert "removed-uuid" not in statsd._machine_state
+        assert len(data["juju_machine_state"]["labelvalues_update"]) == 4
+
+    @pytest.mark.asyncio
+    async def test_get_stats_model_cache(self, collector_daemon):
+        """Test that rows of unchanged models are reused and changed ones recomputed."""
+        statsd = collector_daemon()
+        status = get_juju_stats_data().return_value
+
+        with mock.patch.object(
+            statsd.classifier, "classify_all", wraps=statsd.classifier.classify_all
+        ) as classify_all:
+            first = await statsd.get_stats()
+            first_rows = list(first["juju_machine_state"]["labelvalues_update"])
+            assert statsd.cache_stats == {"hit": 0, "miss": 2}
+
+            second = await statsd.get_stats()
+            assert statsd.cache_stats == {"hit": 2, "miss": 0}
+            assert second["juju_machine_state"]["labelvalues_update"] == first_rows
+            assert classify_all.call_count == 2
+
+            status["machines"]["0"]["agent-status"]["status"] = "down"
+            with mock.patch(
+                "juju.model.Model.get_status", mock.AsyncMock(return_value=status)
+            ), mock.patch(
+                "prometheus_juju_exporter.collector.Controller.model_uuids",
+                mock.AsyncMock(return_value={"default": "77643b91-a6f8-4cf6-8755-83c6becd09bb"}),
+            ):
+                third = await statsd.get_stats()
+
+        assert statsd.cache_stats == {"hit": 0, "miss": 1}
+        assert [value for _, value in third["juju_machine_state"]["labelvalues_update"]] == [0, 1]
+        assert list(statsd._model_cache) == ["77643b91-a6f8-4cf6-8755-83c6becd09bb"]
+
+    def test_get_model_fingerprint(self, collector_daemon):
+        """Test that the fingerprint follows the fields the gauge rows depend on."""
+        statsd = collector_daemon()
+        status = get_juju_stats_data().return_value
+        machines = status["machines"]
+        fingerprint = statsd._get_model_fingerprint(status, "default")
+
+        assert statsd._get_model_fingerprint(status, "default") == fingerprint
+        assert statsd._get_model_fingerprint(status, "renamed") != fingerprint
+        machines["0"]["network-interfaces"]["ens3"]["mac-address"] = "00:00:00:00:00:01"
+        assert statsd._get_model_fingerprint(status, "default") != fingerprint
+        fingerprint = statsd._get_model_fingerprint(status, "default")
+        machines["0"]["containers"]["0/lxd/0"]["hostname"] = "renamed-host"
+        assert statsd._get_model_fingerprint(status, "default") != fingerprint
+        fingerprint = statsd._get_model_fingerprint(status, "default")
+        unit = status["applications"]["ubuntu"]["units"]["ubuntu/0"]
+        unit["subordinates"]["ntp/0"]["agent-status"]["status"] = "failed"
+        assert statsd._get_model_fingerprint(status, "default") != fingerprint
@@ -1,9 +1,12 @@
 #!/usr/bin/python3
 """Test Config class."""
+
 from unittest import mock
 
 import pytest
 
+from prometheus_juju_exporter.config import get_controller_targets
+
 
 class TestConfig:
     """Config test class."""
@@ -61,3 +64,76 @@ class TestConfig:
             config_ins.validate_config_options()
             assert config_ins.config["exporter"]["port"].get() == port_value
             exit_call.assert_called_once()
+
+    @pytest.mark.parametrize("shard_index,shard_count", [(0, 1), (2, 3), (3, 3), (1, 0)])
+    def test_validate_config_options_shard(self, config_instance, shard_index, shard_count):
+        """Test that the shard index must be lower than the shard count."""
+        config_ins = config_instance()
+        config_ins.config["collection"]["shard_index"].set(shard_index)
+        config_ins.config["collection"]["shard_count"].set(shard_count)
+
+        with mock.patch("prometheus_juju_exporter.config.sys.exit") as exit_call:
+            config_ins.validate_config_options()
+
+        assert exit_call.called is (shard_index >= shard_count)
+
+    @pytest.mark.parametrize("match, valid", [("^prod-", True), ("prod-(", False)])
+    def test_validate_config_options_model_intervals(self, config_instance, match, valid):
+        """Test that the patterns of per-model intervals must be valid regexps."""
+        config_ins = config_instance()
+        config_ins.config["collection"]["model_intervals"].set([{"match": match, "interval": 1}])
+
+        with mock.patch("prometheus_juju_exporter.config.sys.exit") as exit_call:
+            config_ins.validate_config_options()
+
+        assert exit_call.called is not valid
+
+    @pytest.mark.parametrize("option", ["include_models", "exclude_models"])
+    @pytest.mark.parametrize("pattern, valid", [("^test-", True), ("test-(", False)])
+    def test_validate_config_options_model_filters(self, config_instance, option, pattern, valid):
+        """Test that the model filter patterns must be valid regexps."""
+        config_ins = config_instance()
+        config_ins.config["collection"][option].set([pattern])
+
+        with mock.patch("prometheus_juju_exporter.config.sys.exit") as exit_call:
+            config_ins.validate_config_options()
+
+        assert exit_call.called is not valid
+
+    def test_get_controller_targets_juju_section(self, config_instance):
+        """Test that the 'juju' section is the only target without 'controllers'."""
+        config_ins = config_instance()
+
+        assert get_controller_targets(config_ins.get_config()) == [
+            {
+                "endpoints": ["192.168.1.100:17070"],
+                "cacert": "-----BEGIN CERTIFICATE-----\n-----END CERTIFICATE-----\n",
+                "username": "example_user",
+                "password": "example_password",
+                "customer": "example_customer",
+                "cloud_name": "example_cloud",
+            }
+        ]
+
+    def test_get_controller_targets_controllers(self, config_instance):
+        """Test that each 'controllers' entry is a target with its own labels."""
+        config_ins = config_instance()
+        config = config_ins.get_config()
+        controller = {
+            "controller_endpoint": ["10.0.0.1:17070", "10.0.0.2:17070"],
+            "controller_cacert": "CA data",
+            "username": "admin",
+            "password": "secret",
+        }
+        config["controllers"].set(
+            [controller, dict(controller, customer="other_customer", cloud_name="other_cloud")]
+        )
+        config_ins.validate_config_options()
+
+        targets = get_controller_targets(config)
+
+        assert [(target["customer"], target["cloud_name"]) for target in targets] == [
+            ("example_customer", "example_cloud"),
+            ("other_customer", "other_cloud"),
+        ]
+        assert targets[0]["endpoints"] == ["10.0.0.1:17070", "10.0.0.2:17070"]
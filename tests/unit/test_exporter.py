@@ -1,9 +1,16 @@
 #!/usr/bin/python3
 """Test exporter daemon."""
+
+import asyncio
 from unittest import mock
 
 import pytest
 
+from prometheus_juju_exporter.collector import MIN_SCHEDULER_DELAY
+from prometheus_juju_exporter.config import Config
+from prometheus_juju_exporter.snapshot import load_snapshot, save_snapshot
+from tests.unit.conftest import collected_stats_data
+
 
 class TestExporterDaemon:
     """Exporter daemon test class."""
@@ -24,67 +31,156 @@ class TestExporterDaemon:
         assert statsd.config["exporter"]["collect_interval"].get() == 15
 
     @pytest.mark.asyncio
-    async def test_update_registry(self, monkeypatch, exporter_daemon):
+    async def test_update_registry(self, exporter_daemon):
         """Test update_registry function."""
         statsd = exporter_daemon()
-        collector = statsd.collector
-        stats = await collector.get_stats()
-        sample_labels = [
-            {
-                "job": "prometheus-juju-exporter",
-                "hostname": "hostname0",
-                "customer": "customer0",
-                "cloud_name": "cloud name",
-                "juju_model": "juju model",
-                "type": "machine type",
-            },
-            {
-                "job": "prometheus-juju-exporter",
-                "hostname": "hostname1",
-                "customer": "customer1",
-                "cloud_name": "cloud name",
-                "juju_model": "juju model",
-                "type": "machine type",
-            },
-        ]
-        expected_labels = [
-            {
-                "job": "prometheus-juju-exporter",
-                "hostname": "hostname1",
-                "customer": "customer1",
-                "cloud_name": "cloud name",
-                "juju_model": "juju model",
-                "type": "machine type",
-            },
-            {
-                "job": "prometheus-juju-exporter",
-                "hostname": "hostname2",
-                "customer": "customer2",
-                "cloud_name": "cloud name",
-                "juju_model": "juju model",
-                "type": "machine type",
-            },
+        stats = await statsd.collectors[0].get_stats()
+        labelvalues = stats["example_gauge"]["labelvalues_update"][0][0]
+        labels = dict(zip(stats["example_gauge"]["labels"], labelvalues))
+
+        statsd.update_registry(stats)
+
+        assert statsd._registry.get_sample_value("example_gauge", labels) == 0
+        assert len(list(statsd._registry.collect())[0].samples) == 2
+
+        # a series that is not collected again is removed, a changed value is updated
+        stats["example_gauge"]["labelvalues_update"] = [(labelvalues, 1)]
+        statsd.update_registry(stats)
+
+        samples = list(statsd._registry.collect())[0].samples
+        assert [(sample.labels, sample.value) for sample in samples] == [(labels, 1)]
+
+    @pytest.mark.asyncio
+    async def test_update_registry_duplicate_series(self, exporter_daemon):
+        """Test that the last value wins when a series is collected twice."""
+        statsd = exporter_daemon()
+        stats = await statsd.collectors[0].get_stats()
+        labelvalues = stats["example_gauge"]["labelvalues_update"][0][0]
+        stats["example_gauge"]["labelvalues_update"].append((tuple(labelvalues), 1))
+        labels = dict(zip(stats["example_gauge"]["labels"], labelvalues))
+
+        statsd.update_registry(stats)
+
+        assert statsd._registry.get_sample_value("example_gauge", labels) == 1
+        assert len(list(statsd._registry.collect())[0].samples) == 2
+
+    @pytest.mark.asyncio
+    async def test_update_registry_series_index(self, exporter_daemon):
+        """Test that series changes are computed against the index of live series."""
+        statsd = exporter_daemon()
+        stats = await statsd.collectors[0].get_stats()
+        rows = stats["example_gauge"]["labelvalues_update"]
+        statsd.update_registry(stats)
+        gauge = statsd.metrics.snapshot["example_gauge"]
+
+        # unchanged data keeps the published metric family
+        statsd.update_registry(stats)
+        assert statsd.metrics.snapshot["example_gauge"] is gauge
+
+        new_labelvalues = rows[0][0][:1] + ("hostname3",) + rows[0][0][2:]
+        stats["example_gauge"]["labelvalues_update"] = [rows[0], (new_labelvalues, 1)]
+        statsd.update_registry(stats)
+
+        assert statsd._series_index["example_gauge"] == {
+            ("cloud name", "juju model"): {rows[0][0]: 0, new_labelvalues: 1}
+        }
+        assert statsd.metrics.snapshot["example_gauge"] is not gauge
+
+    @pytest.mark.asyncio
+    async def test_update_registry_rebuilds_changed_chunks(self, exporter_daemon):
+        """Test that only the chunks of models whose series changed are replaced."""
+        statsd = exporter_daemon()
+        stats = await statsd.collectors[0].get_stats()
+        rows = stats["example_gauge"]["labelvalues_update"]
+        other = rows[0][0][:4] + ("other model",) + rows[0][0][5:]
+        rows.append((other, 1))
+        statsd.update_registry(stats)
+        chunks = statsd.metrics.snapshot["example_gauge"].chunks
+
+        rows[-1] = (other, 0)
+        statsd.update_registry(stats)
+        updated = statsd.metrics.snapshot["example_gauge"]
+
+        assert [sample.value for sample in updated.metric().samples] == [0, 0, 0]
+        assert updated.chunks[("cloud name", "juju model")] is chunks[("cloud name", "juju model")]
+        assert updated.chunks[("cloud name", "other model")] == {other: 0}
+
+        # the series of a model that is gone are removed with its chunk
+        del rows[-1]
+        statsd.update_registry(stats)
+
+        assert list(statsd.metrics.snapshot["example_gauge"].chunks) == [
+            ("cloud name", "juju model")
         ]
-        metric1, metric2 = mock.MagicMock(), mock.MagicMock()
-        metrics = [metric1, metric2]
-        sample1, sample2 = mock.MagicMock(), mock.MagicMock()
-        sample1.labels, sample2.labels = sample_labels
-        samples = [sample1, sample2]
-        for sample in samples:
-            sample.name = "example_gauge"
-        for metric in metrics:
-            metric.samples = samples
-        monkeypatch.setattr(
-            "prometheus_juju_exporter.exporter.CollectorRegistry.collect",
-            lambda r: metrics,
+        assert (
+            statsd._registry.get_sample_value(
+                "prometheus_juju_exporter_series_changes_total",
+                {"gauge": "example_gauge", "change": "removed"},
+            )
+            == 1
+        )
+
+    def test_next_cycle_in(self, exporter_daemon):
+        """Test that the next cycle starts when the first scheduled model is due."""
+        statsd = exporter_daemon()
+        statsd.config["exporter"]["collect_interval"].set(5)
+        collector = statsd.collectors[0]
+
+        assert statsd.next_cycle_in() == 300
+        with mock.patch.object(collector.scheduler, "seconds_until_due", return_value=42.5):
+            assert statsd.next_cycle_in() == 42.5
+        with mock.patch.object(collector.scheduler, "seconds_until_due", return_value=0):
+            assert statsd.next_cycle_in() == MIN_SCHEDULER_DELAY
+        with mock.patch.object(collector.scheduler, "seconds_until_due", return_value=900):
+            assert statsd.next_cycle_in() == 300
+
+    def test_chunk_series(self, exporter_daemon):
+        """Test grouping series by model, or in a single chunk without model labels."""
+        statsd = exporter_daemon()
+        rows = [(("a", "m1"), 1), (("b", "m2"), 0), (("a", "m1"), 0)]
+
+        assert statsd._chunk_series(["hostname", "juju_model"], rows) == {
+            ("m1",): {("a", "m1"): 0},
+            ("m2",): {("b", "m2"): 0},
+        }
+        assert statsd._chunk_series(["hostname", "site"], rows) == {
+            (): {("a", "m1"): 0, ("b", "m2"): 0}
+        }
+
+    def test_diff_series(self, exporter_daemon):
+        """Test counting added and removed series of a gauge chunk."""
+        statsd = exporter_daemon()
+
+        assert statsd._diff_series("gauge", {}, {("a",): 1, ("b",): 1}) == (2, 0)
+        assert statsd._diff_series("gauge", {("a",): 1, ("b",): 1}, {("b",): 0, ("c",): 1}) == (
+            1,
+            1,
         )
+
+    @pytest.mark.asyncio
+    async def test_update_registry_publishes_new_snapshot(self, exporter_daemon):
+        """Test that a scrape holding the previous snapshot is not affected by an update."""
+        statsd = exporter_daemon()
+        stats = await statsd.collectors[0].get_stats()
+        statsd.update_registry(stats)
+        previous = statsd.metrics.snapshot
+        scrape = statsd.metrics.collect()
+        next(scrape)
+
+        stats["example_gauge"]["labelvalues_update"] = []
         statsd.update_registry(stats)
-        assert statsd.metrics["example_gauge"].call_labels == expected_labels
+
+        assert statsd.metrics.snapshot is not previous
+        assert len(previous["example_gauge"].metric().samples) == 2
+        assert statsd.metrics.snapshot["example_gauge"].metric().samples == []
+        assert list(scrape) == []
 
     @pytest.mark.asyncio
     async def test_trigger(self, exporter_daemon):
         """Test trigger function."""
+        Config().get_config()["collection"]["max_failed_cycles"].set(1)
         statsd = exporter_daemon()
+        statsd.collectors[0].cache_stats = {"hit": 3, "miss": 1}
 
         with mock.patch(
             "prometheus_juju_exporter.exporter.asyncio.sleep",
@@ -92,12 +188,538 @@ class TestExporterDaemon:
         ), pytest.raises(SystemExit) as exit_call:
             await statsd.trigger()
 
-        statsd.collector.get_stats.assert_called_once()
-        assert "example_gauge" in statsd.metrics.keys()
+        for result, count in [("hit", 3), ("miss", 1)]:
+            assert (
+                statsd._registry.get_sample_value(
+                    "prometheus_juju_exporter_model_cache_lookups_total", {"result": result}
+                )
+                == count
+            )
+
+        statsd.collectors[0].get_stats.assert_called_once()
+        assert "example_gauge" in statsd.metrics.snapshot
+        for stage in ["collect", "update_registry"]:
+            assert (
+                statsd._registry.get_sample_value(
+                    "prometheus_juju_exporter_cycle_duration_seconds", {"stage": stage}
+                )
+                >= 0
+            )
+        assert statsd._registry.get_sample_value(
+            "prometheus_juju_exporter_series_changes_total",
+            {"gauge": "example_gauge", "change": "added"},
+        ) == len(collected_stats_data()["example_gauge"]["labelvalues_update"])
+        assert (
+            statsd._registry.get_sample_value(
+                "prometheus_juju_exporter_last_success_timestamp_seconds"
+            )
+            > 0
+        )
 
         assert exit_call.type == SystemExit
         assert exit_call.value.code == 1
 
+    @pytest.mark.asyncio
+    async def test_trigger_retries_failed_cycles(self, exporter_daemon):
+        """Test that failed cycles are retried with backoff until 'max_failed_cycles'."""
+        Config().get_config()["collection"]["max_failed_cycles"].set(3)
+        Config().get_config()["collection"]["reconnect_backoff"].set(200)
+        statsd = exporter_daemon()
+        statsd.collectors[0].get_stats.side_effect = [
+            Exception("boom"),
+            collected_stats_data(),
+            Exception("boom"),
+            Exception("boom"),
+            Exception("boom"),
+        ]
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.asyncio.sleep", mock.AsyncMock()
+        ) as sleep, pytest.raises(SystemExit) as exit_call:
+            await statsd.trigger()
+
+        assert exit_call.value.code == 1
+        # the success resets the backoff, which is capped at MAX_RECONNECT_BACKOFF
+        assert [call.args[0] for call in sleep.await_args_list] == [200, 15 * 60, 200, 300]
+        assert (
+            statsd._registry.get_sample_value("prometheus_juju_exporter_failed_cycles_total") == 4
+        )
+        # the series of the last successful cycle keep being served
+        assert len(statsd.metrics.snapshot["example_gauge"].metric().samples) == 2
+
+    @pytest.mark.asyncio
+    async def test_trigger_watch_mode(self, exporter_daemon):
+        """Test that the trigger follows machine changes between resyncs in watch mode."""
+        Config().get_config()["collection"]["max_failed_cycles"].set(1)
+        statsd = exporter_daemon()
+        statsd.watch_mode = True
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.ExporterDaemon.follow_changes",
+            side_effect=Exception,
+        ) as follow_changes, pytest.raises(SystemExit):
+            await statsd.trigger()
+
+        follow_changes.assert_awaited_once_with(15 * 60)
+
+    @pytest.mark.asyncio
+    async def test_follow_changes(self, exporter_daemon):
+        """Test that the registry is updated on each change until the deadline."""
+        statsd = exporter_daemon()
+        statsd.collectors[0].get_state_stats = mock.MagicMock(return_value={})
+        statsd.state_changed.set()
+        loop = mock.MagicMock()
+        loop.time.side_effect = [0, 0, 30]
+        timeouts = []
+
+        async def wait_for(awaitable, timeout):
+            awaitable.close()
+            timeouts.append(timeout)
+            if len(timeouts) > 1:
+                raise asyncio.TimeoutError
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.asyncio.get_running_loop", return_value=loop
+        ), mock.patch("prometheus_juju_exporter.exporter.asyncio.wait_for", wait_for):
+            await statsd.follow_changes(60)
+
+        assert timeouts == [60, 30]
+        assert not statsd.state_changed.is_set()
+        statsd.collectors[0].get_state_stats.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_follow_changes_expired(self, exporter_daemon):
+        """Test that changes are not followed once the deadline passed."""
+        statsd = exporter_daemon()
+        statsd.collectors[0].get_state_stats = mock.MagicMock(return_value={})
+        statsd.state_changed.set()
+
+        await statsd.follow_changes(0)
+
+        assert statsd.state_changed.is_set()
+        statsd.collectors[0].get_state_stats.assert_not_called()
+
+    def test_request_collection(self, exporter_daemon):
+        """Test that scrapes request a collection only when the cached data expired."""
+        Config().get_config()["exporter"]["collect_mode"].set("scrape")
+        statsd = exporter_daemon()
+        loop = mock.MagicMock()
+
+        # no running trigger yet
+        statsd.request_collection()
+        statsd._loop = loop
+        # nothing collected yet
+        statsd.request_collection()
+        loop.call_soon_threadsafe.assert_called_once_with(statsd._collect_requested.set)
+
+        # a collection is already pending
+        statsd._collect_requested.set()
+        statsd.request_collection()
+        statsd._collect_requested.clear()
+
+        with mock.patch("prometheus_juju_exporter.exporter.time.monotonic", return_value=100):
+            statsd._collected_at = 50
+            statsd.request_collection()
+            assert loop.call_soon_threadsafe.call_count == 1
+            statsd._collected_at = 30
+            statsd.request_collection()
+            assert loop.call_soon_threadsafe.call_count == 2
+
+    @pytest.mark.parametrize("collect_mode", ["interval", "scrape"])
+    def test_run_scrape_hook(self, exporter_daemon, collect_mode):
+        """Test that scrapes request collections in scrape mode only."""
+        Config().get_config()["exporter"]["collect_mode"].set(collect_mode)
+        statsd = exporter_daemon()
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.ExporterDaemon.trigger",
+            side_effect=KeyboardInterrupt,
+        ), pytest.raises(SystemExit), mock.patch(
+            "prometheus_juju_exporter.exporter.start_exposition_server"
+        ) as start_server:
+            statsd.run()
+
+        start_server.assert_called_once_with(
+            9748,
+            statsd.exposition,
+            on_scrape=statsd.request_collection if collect_mode == "scrape" else None,
+        )
+
+    def test_run_asyncio_server(self, exporter_daemon):
+        """Test that the asyncio server runs next to the trigger in the event loop."""
+        Config().get_config()["exporter"]["http_server"].set("asyncio")
+        statsd = exporter_daemon()
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.ExporterDaemon.serve",
+            side_effect=KeyboardInterrupt,
+        ) as serve, pytest.raises(SystemExit), mock.patch(
+            "prometheus_juju_exporter.exporter.start_exposition_server"
+        ) as start_server:
+            statsd.run()
+
+        serve.assert_called_once()
+        start_server.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_serve(self, exporter_daemon):
+        """Test that the asyncio server is closed once the trigger returns."""
+        Config().get_config()["exporter"]["max_connections"].set(3)
+        statsd = exporter_daemon()
+        server = mock.AsyncMock()
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.AsyncExpositionServer", return_value=server
+        ) as server_class, mock.patch(
+            "prometheus_juju_exporter.exporter.ExporterDaemon.trigger", side_effect=RuntimeError
+        ), pytest.raises(
+            RuntimeError
+        ):
+            await statsd.serve()
+
+        server_class.assert_called_once_with(
+            statsd.exposition, on_scrape=None, max_connections=3, request_timeout=10
+        )
+        server.start.assert_awaited_once_with(9748)
+        server.close.assert_awaited_once()
+
+    def test_warm_start(self, exporter_daemon, tmp_path):
+        """Test serving the snapshot of an earlier run until the first collection."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "snapshot"))
+        statsd = exporter_daemon()
+        save_snapshot(statsd.snapshot_path, collected_stats_data(), 1700000000)
+
+        statsd.warm_start()
+
+        plain = statsd.exposition.rendering.plain
+        assert b'hostname="hostname1"' in plain
+        assert b"prometheus_juju_exporter_serving_snapshot 1.0" in plain
+        assert b"prometheus_juju_exporter_last_success_timestamp_seconds 1.7e+09" in plain
+
+    def test_warm_start_missing_snapshot(self, exporter_daemon, tmp_path):
+        """Test that the first run starts without a snapshot."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "snapshot"))
+        statsd = exporter_daemon()
+
+        statsd.warm_start()
+
+        plain = statsd.exposition.rendering.plain
+        assert b"example_gauge" not in plain
+        assert b"prometheus_juju_exporter_serving_snapshot 0.0" in plain
+        assert statsd._last_results == {}
+
+    @pytest.mark.asyncio
+    async def test_warm_start_failed_controller(self, exporter_daemon, tmp_path):
+        """Test that a controller failing its first collection is served from the snapshot."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "snapshot"))
+        statsd = exporter_daemon()
+        rows = collected_stats_data()["example_gauge"]["labelvalues_update"]
+        collectors = [mock.MagicMock(cache_stats={}, model_stats={}) for _ in range(3)]
+        for collector, customer in zip(collectors, ["customer1", "customer2", "customer3"]):
+            collector.target = {
+                "endpoints": ["10.0.0.1:17070"],
+                "customer": customer,
+                "cloud_name": "cloud name",
+            }
+        fresh = collected_stats_data()
+        fresh["example_gauge"]["labelvalues_update"] = rows[:1]
+        collectors[0].get_stats = mock.AsyncMock(return_value=fresh)
+        collectors[1].get_stats = mock.AsyncMock(side_effect=Exception("boom"))
+        collectors[2].get_stats = mock.AsyncMock(side_effect=Exception("boom"))
+        statsd.collectors = collectors
+        save_snapshot(statsd.snapshot_path, collected_stats_data(), 1700000000)
+
+        statsd.warm_start()
+        data = await statsd.collect()
+
+        assert data["example_gauge"]["labelvalues_update"] == rows
+
+    def test_warm_start_invalid_snapshot(self, exporter_daemon, tmp_path):
+        """Test that an unusable snapshot is ignored."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "snapshot"))
+        statsd = exporter_daemon()
+        (tmp_path / "snapshot").write_bytes(b"corrupted")
+
+        with mock.patch.object(statsd.logger, "warning") as warning:
+            statsd.warm_start()
+
+        assert b"example_gauge" not in statsd.exposition.rendering.plain
+        warning.assert_called_once()
+
+    def test_warm_start_disabled(self, exporter_daemon):
+        """Test that nothing is loaded without a snapshot file."""
+        statsd = exporter_daemon()
+
+        with mock.patch("prometheus_juju_exporter.exporter.load_snapshot") as load:
+            statsd.warm_start()
+
+        assert statsd.snapshot_path is None
+        load.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_trigger_persists_snapshot(self, exporter_daemon, tmp_path):
+        """Test that every successful cycle is saved for the next warm start."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "snapshot"))
+        statsd = exporter_daemon()
+        statsd.serving_snapshot.set(1)
+        asyncio.sleep.side_effect = [None, asyncio.CancelledError]
+
+        with pytest.raises(asyncio.CancelledError):
+            await statsd.trigger()
+
+        assert load_snapshot(statsd.snapshot_path)[1] == collected_stats_data()
+        assert b"prometheus_juju_exporter_serving_snapshot 0.0" in (
+            statsd.exposition.rendering.plain
+        )
+
+    @pytest.mark.asyncio
+    async def test_persist_snapshot_failure(self, exporter_daemon, tmp_path):
+        """Test that a snapshot that cannot be saved does not fail the cycle."""
+        Config().get_config()["exporter"]["snapshot_file"].set(str(tmp_path / "missing/snap"))
+        statsd = exporter_daemon()
+
+        with mock.patch.object(statsd.logger, "warning") as warning:
+            await statsd.persist_snapshot(collected_stats_data())
+
+        warning.assert_called_once()
+
+    def test_render_exposition(self, exporter_daemon):
+        """Test that scrapes are served the registry as of the last rendering."""
+        statsd = exporter_daemon()
+        statsd.update_registry(collected_stats_data())
+
+        assert b"example_gauge" not in statsd.exposition.rendering.plain
+        statsd.render_exposition()
+        assert b'hostname="hostname1"' in statsd.exposition.rendering.plain
+
+    @pytest.mark.asyncio
+    async def test_trigger_scrape_mode(self, exporter_daemon):
+        """Test that the trigger collects once per requested collection in scrape mode."""
+        Config().get_config()["exporter"]["collect_mode"].set("scrape")
+        Config().get_config()["collection"]["max_failed_cycles"].set(1)
+        statsd = exporter_daemon()
+        event = mock.MagicMock()
+        event.wait = mock.AsyncMock(side_effect=[None, None, Exception])
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.asyncio.Event", return_value=event
+        ), pytest.raises(SystemExit):
+            await statsd.trigger()
+
+        assert statsd.collectors[0].get_stats.await_count == 2
+        assert statsd._collect_requested.clear.call_count == 2
+        assert statsd._collected_at is not None
+        assert statsd._loop is asyncio.get_running_loop()
+
+    @pytest.mark.asyncio
+    async def test_wait_for_collection_request_watch_mode(self, exporter_daemon):
+        """Test that machine changes are followed until a scrape requests a collection."""
+        Config().get_config()["exporter"]["collect_mode"].set("scrape")
+        statsd = exporter_daemon()
+        statsd.watch_mode = True
+        statsd._collect_requested = asyncio.Event()
+        following = asyncio.Event()
+
+        async def follow_changes(duration):
+            following.set()
+            await asyncio.Event().wait()
+
+        with mock.patch.object(
+            statsd, "follow_changes", side_effect=follow_changes
+        ) as mock_follow_changes:
+            waiter = asyncio.ensure_future(statsd.wait_for_collection_request())
+            await following.wait()
+            assert not waiter.done()
+            statsd._collect_requested.set()
+            await waiter
+
+        mock_follow_changes.assert_called_once_with(None)
+
+    @pytest.mark.asyncio
+    async def test_follow_changes_until_cancelled(self, exporter_daemon):
+        """Test that changes are followed without a timeout when no duration is given."""
+        statsd = exporter_daemon()
+        statsd.collectors[0].get_state_stats = mock.MagicMock(return_value={})
+        timeouts = []
+
+        async def wait_for(awaitable, timeout):
+            awaitable.close()
+            timeouts.append(timeout)
+            if len(timeouts) > 2:
+                raise asyncio.CancelledError
+
+        with mock.patch(
+            "prometheus_juju_exporter.exporter.asyncio.wait_for", wait_for
+        ), pytest.raises(asyncio.CancelledError):
+            await statsd.follow_changes(None)
+
+        assert timeouts == [None, None, None]
+        assert statsd.collectors[0].get_state_stats.call_count == 2
+
+    def test_multiple_controllers(self, exporter_daemon):
+        """Test that a collector is created for each configured controller."""
+        controller = {
+            "controller_endpoint": "10.0.0.1:17070",
+            "controller_cacert": "CA data",
+            "username": "admin",
+            "password": "secret",
+        }
+        Config().get_config()["controllers"].set(
+            [dict(controller, cloud_name="cloud_a"), dict(controller, cloud_name="cloud_b")]
+        )
+        statsd = exporter_daemon()
+
+        assert [collector.target["cloud_name"] for collector in statsd.collectors] == [
+            "cloud_a",
+            "cloud_b",
+        ]
+        statsd.collectors[1].on_change()
+        assert statsd.state_changed.is_set()
+
+    @pytest.mark.asyncio
+    async def test_collect_multiple_controllers(self, exporter_daemon):
+        """Test that the data of all controllers is merged in controller order."""
+        statsd = exporter_daemon()
+        first, second = collected_stats_data(), collected_stats_data()
+        second["example_gauge"]["labelvalues_update"] = second["example_gauge"][
+            "labelvalues_update"
+        ][:1]
+        second["other_gauge"] = dict(second["example_gauge"])
+        collectors = [mock.MagicMock(), mock.MagicMock()]
+        collectors[0].get_stats = mock.AsyncMock(return_value=first)
+        collectors[1].get_stats = mock.AsyncMock(return_value=second)
+        for collector in collectors:
+            collector.cache_stats = {"hit": 1, "miss": 0}
+        statsd.collectors = collectors
+
+        data = await statsd.collect()
+
+        assert data["example_gauge"]["labelvalues_update"] == (
+            first["example_gauge"]["labelvalues_update"]
+            + second["example_gauge"]["labelvalues_update"]
+        )
+        assert data["other_gauge"] == second["other_gauge"]
+        assert len(first["example_gauge"]["labelvalues_update"]) == 2
+        assert (
+            statsd._registry.get_sample_value(
+                "prometheus_juju_exporter_model_cache_lookups_total", {"result": "hit"}
+            )
+            == 2
+        )
+
+    @pytest.mark.asyncio
+    async def test_collect_failed_controller(self, exporter_daemon):
+        """Test that a failed controller is served with its last collected data."""
+        statsd = exporter_daemon()
+        first, second = collected_stats_data(), collected_stats_data()
+        second["example_gauge"]["labelvalues_update"] = second["example_gauge"][
+            "labelvalues_update"
+        ][:1]
+        collectors = [mock.MagicMock(), mock.MagicMock()]
+        collectors[0].get_stats = mock.AsyncMock(return_value=first)
+        collectors[1].get_stats = mock.AsyncMock(side_effect=[second, Exception("boom")])
+        for collector in collectors:
+            collector.cache_stats = {}
+            collector.model_stats = {}
+        statsd.collectors = collectors
+
+        await statsd.collect()
+        data = await statsd.collect()
+
+        assert data["example_gauge"]["labelvalues_update"] == (
+            first["example_gauge"]["labelvalues_update"]
+            + second["example_gauge"]["labelvalues_update"]
+        )
+
+        collectors[0].get_stats.side_effect = Exception("down")
+        with pytest.raises(Exception, match="down"):
+            await statsd.collect()
+
+    @pytest.mark.asyncio
+    async def test_collect_single_controller_failed(self, exporter_daemon):
+        """Test that the models of a single failed controller are reported stale."""
+        statsd = exporter_daemon()
+        collector = mock.MagicMock(cache_stats={})
+        collector.target = {"endpoints": ["10.0.0.1:17070"], "cloud_name": "example_cloud"}
+        collector.model_stats = {
+            "default": {"seconds": None, "hosts": 5, "error": None, "stale": True},
+        }
+        collector.get_stats = mock.AsyncMock(side_effect=Exception("down"))
+        statsd.collectors = [collector]
+
+        with pytest.raises(Exception, match="down"):
+            await statsd.collect()
+
+        assert (
+            statsd._registry.get_sample_value(
+                "prometheus_juju_exporter_model_stale",
+                {"cloud_name": "example_cloud", "juju_model": "default"},
+            )
+            == 1
+        )
+
+    @pytest.mark.asyncio
+    async def test_collect_interrupted(self, exporter_daemon):
+        """Test that a collector interrupted by a BaseException interrupts the collection."""
+        statsd = exporter_daemon()
+        statsd.collectors[0].get_stats = mock.AsyncMock(side_effect=asyncio.CancelledError)
+
+        with pytest.raises(asyncio.CancelledError):
+            await statsd.collect()
+
+    def test_record_model_stats(self, exporter_daemon):
+        """Test exporting the fetch duration, host count and errors of every model."""
+        statsd = exporter_daemon()
+        collector = statsd.collectors[0]
+        collector.model_stats = {
+            "default": {"seconds": 0.2, "hosts": 5, "error": None, "stale": False},
+            "broken": {"seconds": 30.0, "hosts": 0, "error": "timeout", "stale": True},
+        }
+        statsd._record_model_stats()
+
+        def sample(name, labels=None):
+            return statsd._registry.get_sample_value(f"prometheus_juju_exporter_{name}", labels)
+
+        cloud = {"cloud_name": "example_cloud"}
+        assert sample("model_fetch_duration_seconds_count") == 2
+        assert sample("model_fetch_duration_seconds_bucket", {"le": "0.25"}) == 1
+        assert sample("model_status_hosts", dict(cloud, juju_model="default")) == 5
+        assert (
+            sample("model_errors_total", dict(cloud, juju_model="broken", reason="timeout")) == 1
+        )
+        assert (
+            sample("model_errors_total", dict(cloud, juju_model="default", reason="error")) is None
+        )
+        assert sample("model_stale", dict(cloud, juju_model="default")) == 0
+        assert sample("model_stale", dict(cloud, juju_model="broken")) == 1
+
+        # models that were not fetched again stop being reported
+        collector.model_stats = {
+            "broken": {"seconds": 1.0, "hosts": 3, "error": None, "stale": False},
+            "unreachable": {"seconds": None, "hosts": 2, "error": None, "stale": True},
+        }
+        statsd._record_model_stats()
+
+        assert sample("model_fetch_duration_seconds_count") == 3
+        assert sample("model_status_hosts", dict(cloud, juju_model="default")) is None
+        assert sample("model_stale", dict(cloud, juju_model="default")) is None
+        assert sample("model_stale", dict(cloud, juju_model="broken")) == 0
+        assert sample("model_stale", dict(cloud, juju_model="unreachable")) == 1
+        assert sample("model_status_hosts", dict(cloud, juju_model="broken")) == 3
+        assert (
+            sample("model_errors_total", dict(cloud, juju_model="broken", reason="timeout")) == 1
+        )
+
+        # the errors of models that are gone are no longer reported
+        collector.model_stats = {}
+        statsd._record_model_stats()
+
+        assert (
+            sample("model_errors_total", dict(cloud, juju_model="broken", reason="timeout"))
+            is None
+        )
+        assert statsd._model_error_reasons == {}
+
     def test_run(self, exporter_daemon):
         """Test run function."""
         statsd = exporter_daemon()
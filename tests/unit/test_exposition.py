@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+"""Test the exposition cache and server."""
+
+import asyncio
+import gzip
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import pytest
+from prometheus_client import CollectorRegistry, Gauge
+
+from prometheus_juju_exporter.exposition import (
+    AsyncExpositionServer,
+    ExpositionCache,
+    start_exposition_server,
+)
+
+
+@pytest.fixture
+def registry():
+    registry = CollectorRegistry()
+    gauge = Gauge("example_gauge", "This is an example gauge", registry=registry)
+    gauge.set(1)
+    return registry
+
+
+class TestExpositionCache:
+    """Exposition cache test class."""
+
+    def test_render(self, registry):
+        """Test that the registry is only rendered on demand."""
+        cache = ExpositionCache(registry)
+        rendering = cache.rendering
+
+        assert b"example_gauge 1.0" in rendering.plain
+        assert gzip.decompress(rendering.compressed) == rendering.plain
+
+        registry._names_to_collectors["example_gauge"].set(2)
+        assert cache.rendering is rendering
+        cache.render()
+        assert b"example_gauge 2.0" in cache.rendering.plain
+        assert cache.rendering.etag != rendering.etag
+
+    @pytest.mark.parametrize(
+        "accept_encoding, gzipped",
+        [("", False), ("gzip", True), ("deflate, gzip;q=0.8", True), ("x-gzip", False)],
+    )
+    def test_response(self, registry, accept_encoding, gzipped):
+        """Test that the body is compressed when the client accepts gzip."""
+        cache = ExpositionCache(registry)
+        rendering = cache.rendering
+
+        status, headers, body = cache.response(accept_encoding)
+
+        assert status == 200
+        assert body == (rendering.compressed if gzipped else rendering.plain)
+        assert ("Content-Encoding" in headers) is gzipped
+        assert headers["ETag"].endswith('-gzip"') is gzipped
+
+    def test_response_not_modified(self, registry):
+        """Test that a scrape with a current entity tag gets an empty response."""
+        cache = ExpositionCache(registry)
+        etag = cache.response("gzip")[1]["ETag"]
+
+        assert cache.response("gzip", f'"other", {etag}')[::2] == (304, b"")
+        assert cache.response("gzip", "*")[::2] == (304, b"")
+        # the plain representation has its own tag
+        assert cache.response("", etag)[0] == 200
+        cache.render()
+        assert cache.response("gzip", etag)[0] == 304
+        registry._names_to_collectors["example_gauge"].set(2)
+        cache.render()
+        assert cache.response("gzip", etag)[0] == 200
+
+    def test_response_openmetrics(self, registry):
+        """Test that scrapers accepting OpenMetrics get it, rendered once per rendering."""
+        cache = ExpositionCache(registry)
+        accept = "application/openmetrics-text;version=1.0.0,text/plain;version=0.0.4;q=0.5"
+
+        status, headers, body = cache.response("", "", accept)
+        openmetrics_rendering = cache.openmetrics_rendering
+
+        assert status == 200
+        assert headers["Content-Type"].startswith("application/openmetrics-text")
+        assert body == openmetrics_rendering.plain
+        assert body.endswith(b"# EOF\n")
+        assert headers["ETag"] != cache.response()[1]["ETag"]
+        assert cache.response("", headers["ETag"], accept)[0] == 304
+        assert cache.openmetrics_rendering is openmetrics_rendering
+        cache.render()
+        assert cache.openmetrics_rendering is not openmetrics_rendering
+
+
+def test_exposition_server(registry):
+    """Test serving the cached exposition over HTTP."""
+    cache = ExpositionCache(registry)
+    on_scrape = mock.MagicMock()
+    server = start_exposition_server(0, cache, on_scrape, addr="127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+
+    try:
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert gzip.decompress(response.read()) == cache.rendering.plain
+            etag = response.headers["ETag"]
+
+        request = urllib.request.Request(
+            url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=5)
+        assert error.value.code == 304
+
+        request = urllib.request.Request(
+            url, method="HEAD", headers={"Accept": "application/openmetrics-text"}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+            assert int(response.headers["Content-Length"]) == len(
+                cache.openmetrics_rendering.plain
+            )
+            assert response.read() == b""
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert on_scrape.call_count == 3
+
+
+class TestAsyncExpositionServer:
+    """Asyncio exposition server test class."""
+
+    @staticmethod
+    async def _request(reader, writer, request, head_only=False):
+        writer.write(request)
+        head = (await reader.readuntil(b"\r\n\r\n")).decode()
+        status_line, *header_lines = head.strip().split("\r\n")
+        headers = dict(line.split(": ", 1) for line in header_lines)
+        body = b"" if head_only else await reader.readexactly(int(headers["Content-Length"]))
+        return int(status_line.split(" ")[1]), headers, body
+
+    @pytest.mark.asyncio
+    async def test_serve(self, registry):
+        """Test answering several scrapes on a kept-alive connection."""
+        cache = ExpositionCache(registry)
+        on_scrape = mock.MagicMock()
+        server = AsyncExpositionServer(cache, on_scrape)
+        await server.start(0, addr="127.0.0.1")
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+
+        try:
+            status, headers, body = await self._request(
+                reader, writer, b"GET /metrics HTTP/1.1\r\nAccept-Encoding: gzip\r\n\r\n"
+            )
+            assert status == 200
+            assert headers["Connection"] == "keep-alive"
+            assert gzip.decompress(body) == cache.rendering.plain
+
+            request = f"GET /metrics HTTP/1.1\r\nIf-None-Match: {headers['ETag']}\r\n"
+            status, _, body = await self._request(
+                reader, writer, f"{request}Accept-Encoding: gzip\r\n\r\n".encode()
+            )
+            assert (status, body) == (304, b"")
+
+            status, headers, body = await self._request(
+                reader, writer, b"HEAD / HTTP/1.1\r\n\r\n", head_only=True
+            )
+            assert (status, body) == (200, b"")
+            assert headers["Content-Length"] == str(len(cache.rendering.plain))
+
+            status, headers, _ = await self._request(
+                reader, writer, b"POST / HTTP/1.1\r\nConnection: close\r\n\r\n"
+            )
+            assert (status, headers["Connection"]) == (405, "close")
+            assert await reader.read() == b""
+        finally:
+            writer.close()
+            await server.close()
+
+        assert on_scrape.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_serve_limits(self, registry):
+        """Test that extra connections are refused and idle ones are closed."""
+        server = AsyncExpositionServer(
+            ExpositionCache(registry), max_connections=1, request_timeout=0.1
+        )
+        await server.start(0, addr="127.0.0.1")
+
+        try:
+            idle_reader, idle_writer = await asyncio.open_connection("127.0.0.1", server.port)
+            await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            status, headers, _ = await self._request(reader, writer, b"GET / HTTP/1.1\r\n\r\n")
+            assert (status, headers["Connection"]) == (503, "close")
+            writer.close()
+
+            # the idle connection is closed once the request timeout elapsed
+            assert await asyncio.wait_for(idle_reader.read(), 5) == b""
+            idle_writer.close()
+        finally:
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_close_keep_alive_connection(self, registry):
+        """Test that closing the server closes the kept-alive connections."""
+        server = AsyncExpositionServer(ExpositionCache(registry))
+        await server.start(0, addr="127.0.0.1")
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+
+        try:
+            status, headers, _ = await self._request(reader, writer, b"GET / HTTP/1.1\r\n\r\n")
+            assert (status, headers["Connection"]) == (200, "keep-alive")
+
+            await server.close()
+
+            assert await asyncio.wait_for(reader.read(), 5) == b""
+        finally:
+            writer.close()
+
+    @pytest.mark.asyncio
+    async def test_serve_malformed_request(self, registry):
+        """Test that a malformed request closes the connection."""
+        server = AsyncExpositionServer(ExpositionCache(registry))
+        await server.start(0, addr="127.0.0.1")
+
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"GARBAGE\r\n\r\n")
+            assert await asyncio.wait_for(reader.read(), 5) == b""
+            writer.close()
+        finally:
+            await server.close()
+
+    def test_port_not_started(self, registry):
+        """Test that a server that is not started has no port."""
+        with pytest.raises(RuntimeError):
+            AsyncExpositionServer(ExpositionCache(registry)).port
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+"""Test recording and replaying controller responses."""
+
+import asyncio
+import os
+from unittest import mock
+
+import pytest
+from juju.client.connection import Monitor
+
+from prometheus_juju_exporter.config import Config
+from prometheus_juju_exporter.replay import (
+    REDACTED,
+    Recording,
+    RecordingController,
+    ReplayController,
+    redact,
+)
+from tests.unit.conftest import get_juju_stats_data, get_model_list_data
+
+
+def test_redact():
+    """Test that sensitive values are redacted at any depth."""
+    value = {
+        "name": "default",
+        "applications": [{"config": {"admin-password": "hunter2", "port": 80}}],
+        "Secret-Key": {"nested": "value"},
+    }
+
+    assert redact(value) == {
+        "name": "default",
+        "applications": [{"config": {"admin-password": REDACTED, "port": 80}}],
+        "Secret-Key": REDACTED,
+    }
+
+
+def test_recording(tmp_path):
+    """Test that a recording loads back the recorded model list and statuses."""
+    recording = Recording(str(tmp_path / "cloud"))
+    models = get_model_list_data().return_value
+    status = get_juju_stats_data().return_value
+
+    recording.save_models(models)
+    for uuid in models.values():
+        recording.save_status(uuid, status)
+
+    assert recording.load_models() == models
+    assert list(recording) == [(name, uuid, status) for name, uuid in models.items()]
+    assert sorted(os.listdir(tmp_path / "cloud" / "status")) == sorted(
+        f"{uuid}.json.gz" for uuid in models.values()
+    )
+
+
+@pytest.mark.asyncio
+async def test_recording_controller(tmp_path):
+    """Test that the fetched model list and statuses are recorded."""
+    recording = Recording(str(tmp_path))
+    model = mock.MagicMock()
+    model.get_status = get_juju_stats_data()
+    controller = mock.MagicMock()
+    controller.model_uuids = get_model_list_data()
+    controller.get_model = mock.AsyncMock(return_value=model)
+    recording_controller = RecordingController(controller, recording)
+
+    await recording_controller.model_uuids()
+    recorded_model = await recording_controller.get_model("uuid")
+    status = await recorded_model.get_status()
+    recorded_model.disconnect()
+
+    assert recording.load_models() == get_model_list_data().return_value
+    assert recording.load_status("uuid") == status
+    model.disconnect.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_recording_controller_failure(tmp_path):
+    """Test that a status that cannot be recorded is still returned."""
+    (tmp_path / "status").write_text("not a directory")
+    model = mock.MagicMock()
+    model.get_status = get_juju_stats_data()
+    controller = mock.MagicMock()
+    controller.get_model = mock.AsyncMock(return_value=model)
+    recording_controller = RecordingController(controller, Recording(str(tmp_path)))
+
+    recorded_model = await recording_controller.get_model("uuid")
+
+    assert await recorded_model.get_status() == get_juju_stats_data().return_value
+
+
+@pytest.mark.asyncio
+async def test_recording_controller_models_failure(tmp_path):
+    """Test that a model list that cannot be recorded is still returned."""
+    controller = mock.MagicMock()
+    controller.model_uuids = get_model_list_data()
+    recording = Recording(str(tmp_path / "missing"))
+    recording_controller = RecordingController(controller, recording)
+
+    with mock.patch.object(recording, "save_models", side_effect=OSError("read-only")):
+        model_uuids = await recording_controller.model_uuids()
+
+    assert model_uuids == get_model_list_data().return_value
+
+
+@pytest.mark.asyncio
+async def test_replay_controller(tmp_path):
+    """Test replaying a recording with a latency and a concurrency limit."""
+    recording = Recording(str(tmp_path))
+    recording.save_models({"default": "uuid"})
+    recording.save_status("uuid", get_juju_stats_data().return_value)
+    controller = ReplayController(recording, latency=0.05, concurrency=2)
+
+    await controller.connect(endpoint="ignored")
+    assert controller.is_connected()
+    assert await controller.model_uuids() == {"default": "uuid"}
+    models = [await controller.get_model("uuid") for _ in range(4)]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    statuses = await asyncio.gather(*(model.get_status() for model in models))
+
+    # 4 requests, 2 at a time
+    assert loop.time() - start >= 0.1
+    assert statuses == [get_juju_stats_data().return_value] * 4
+    assert statuses[0] is not statuses[1]
+    assert controller.connection().monitor.status == Monitor.CONNECTED
+    assert models[0].connection().monitor.status == Monitor.CONNECTED
+    await models[0].disconnect()
+    assert not models[0].is_connected()
+    await controller.disconnect()
+    assert not controller.is_connected()
+
+
+@pytest.mark.asyncio
+async def test_collector_record_and_replay(collector_daemon, tmp_path):
+    """Test that a replayed cycle collects the same series as the recorded one."""
+    config = Config().get_config()
+    config["collection"]["recording_dir"].set(str(tmp_path))
+    config["collection"]["transport"].set("record")
+    recorder = collector_daemon()
+    recorded = await recorder.get_stats()
+
+    config["collection"]["transport"].set("replay")
+    with mock.patch("prometheus_juju_exporter.collector.Controller") as controller_class:
+        replayer = collector_daemon()
+    controller_class.assert_not_called()
+    assert isinstance(replayer.controller, ReplayController)
+    assert isinstance(recorder.controller, RecordingController)
+    replayed = await replayer.get_stats()
+
+    assert replayed == recorded
+    assert os.listdir(tmp_path) == [recorder.target["cloud_name"]]
+
+
+@pytest.mark.asyncio
+async def test_collector_replay_ignores_owners(collector_daemon, tmp_path):
+    """Test that the owner filter is ignored, since recordings do not hold the owners."""
+    config = Config().get_config()
+    config["collection"]["recording_dir"].set(str(tmp_path))
+    config["collection"]["transport"].set("replay")
+    config["collection"]["include_owners"].set(["nobody"])
+    replayer = collector_daemon()
+    recording = replayer.controller.recording
+    recording.save_models(get_model_list_data().return_value)
+    for uuid in get_model_list_data().return_value.values():
+        recording.save_status(uuid, get_juju_stats_data().return_value)
+
+    assert await replayer._get_model_owners() is None
+    await replayer.get_stats()
+
+    assert sorted(replayer.model_stats) == ["controller", "default"]
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"""Test saving and loading metrics snapshots."""
+
+import gzip
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from prometheus_juju_exporter.snapshot import load_snapshot, save_snapshot
+from tests.unit.conftest import collected_stats_data
+
+
+def test_save_and_load_snapshot(tmp_path):
+    """Test that a saved snapshot loads back the same gauge data."""
+    path = str(tmp_path / "snapshot.json.gz")
+
+    save_snapshot(path, collected_stats_data(), 1700000000.5)
+
+    assert load_snapshot(path) == (1700000000.5, collected_stats_data())
+    assert os.listdir(tmp_path) == ["snapshot.json.gz"]
+
+
+def test_save_snapshot_failure(tmp_path):
+    """Test that a failed save keeps the previous snapshot and no temporary file."""
+    path = str(tmp_path / "snapshot.json.gz")
+    save_snapshot(path, {}, 1.0)
+
+    with mock.patch(
+        "prometheus_juju_exporter.snapshot.os.replace", side_effect=OSError("disk full")
+    ), pytest.raises(OSError):
+        save_snapshot(path, collected_stats_data(), 2.0)
+
+    assert load_snapshot(path) == (1.0, {})
+    assert os.listdir(tmp_path) == ["snapshot.json.gz"]
+
+
+def test_load_snapshot_missing(tmp_path):
+    """Test that there is no snapshot before the first save."""
+    assert load_snapshot(str(tmp_path / "snapshot.json.gz")) is None
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"not gzip",
+        gzip.compress(b"not json"),
+        gzip.compress(json.dumps({"version": 0, "saved_at": 1, "gauges": {}}).encode()),
+        gzip.compress(json.dumps({"version": 1, "gauges": {}}).encode()),
+        gzip.compress(json.dumps({"version": 1, "saved_at": 1, "gauges": []}).encode()),
+    ],
+)
+def test_load_snapshot_invalid(tmp_path, payload):
+    """Test that corrupted or incompatible snapshots are rejected."""
+    path = tmp_path / "snapshot.json.gz"
+    path.write_bytes(payload)
+
+    with pytest.raises(ValueError):
+        load_snapshot(str(path))